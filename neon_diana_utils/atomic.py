@@ -0,0 +1,244 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import secrets
+
+from contextlib import contextmanager
+from enum import Enum
+from os.path import abspath, basename, dirname, isdir, isfile, join
+from threading import local
+from typing import IO, Iterator, List, Optional, Tuple
+
+
+class Durability(Enum):
+    """
+    Enum representing how written files are flushed to storage
+    """
+    # Files are renamed into place without being flushed; a crash may lose
+    # recent writes, but never leaves a partially written file
+    NONE = "none"
+    # Each file and its directory are flushed as they are committed
+    FILE = "file"
+    # Files are not flushed individually; all writes are flushed together
+    # when a batch is committed
+    DEFERRED = "deferred"
+
+
+_STATE = local()
+
+
+def get_durability() -> Durability:
+    """
+    Get the durability used by writes that do not specify one
+    """
+    return getattr(_STATE, "durability", Durability.FILE)
+
+
+@contextmanager
+def default_durability(durability: Durability):
+    """
+    Context manager to change the durability used by writes in this thread
+    that do not specify one, i.e. to skip flushing each generated file.
+    :param durability: durability to use within the context
+    """
+    previous = get_durability()
+    _STATE.durability = durability
+    try:
+        yield durability
+    finally:
+        _STATE.durability = previous
+
+
+def _fsync_path(path: str):
+    """
+    Flush a file or directory to storage. Directory sync is not supported on
+    all platforms and is skipped where unsupported.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def sync_paths(paths: List[str]):
+    """
+    Flush written files to storage, i.e. after writing with deferred
+    durability. Each file and each directory containing a written file is
+    flushed once; directories in `paths` are flushed recursively.
+    :param paths: written file or directory paths to flush
+    """
+    files = set()
+    directories = set()
+    for path in paths:
+        path = abspath(path)
+        if isdir(path):
+            for root, _, names in os.walk(path):
+                directories.add(root)
+                files.update(join(root, name) for name in names)
+        else:
+            files.add(path)
+        directories.add(dirname(path))
+    for path in files:
+        _fsync_path(path)
+    for directory in directories:
+        _fsync_path(directory)
+
+
+def get_active_batch() -> Optional["AtomicBatch"]:
+    """
+    Get the innermost `AtomicBatch` context active in this thread, if any
+    """
+    return getattr(_STATE, "batch", None)
+
+
+def _same_contents(file_a: str, file_b: str) -> bool:
+    """
+    Check if two files have identical contents
+    """
+    if os.stat(file_a).st_size != os.stat(file_b).st_size:
+        return False
+    with open(file_a, 'rb') as a, open(file_b, 'rb') as b:
+        while True:
+            chunk = a.read(65536)
+            if chunk != b.read(65536):
+                return False
+            if not chunk:
+                return True
+
+
+class AtomicBatch:
+    def __init__(self, durability: Optional[Durability] = None):
+        """
+        Write a set of files so that none of them are replaced until all of
+        them have been written successfully. Each file is written to a
+        temporary file in its destination directory and renamed into place
+        when the batch is committed; readers see either the previous or the
+        new contents of each file, never a partial write. Files written with
+        unchanged contents are not replaced.
+        :param durability: how written files are flushed to storage (default
+            from `get_durability`)
+        """
+        self.durability = durability or get_durability()
+        self._pending: List[Tuple[str, str]] = list()
+        self._previous: Optional[AtomicBatch] = None
+
+    @contextmanager
+    def open(self, path: str, mode: str = 'w', **kwargs) -> Iterator[IO]:
+        """
+        Open a file to be written when the batch is committed
+        :param path: destination file path
+        :param mode: file mode; must be a write mode (`w` or `wb`)
+        :param kwargs: additional kwargs to pass to `open`
+        """
+        if not mode.startswith('w'):
+            raise ValueError(f"Unsupported mode: {mode}")
+        path = abspath(path)
+        tmp = join(dirname(path),
+                   f".{basename(path)}.{secrets.token_hex(4)}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, mode, **kwargs) as f:
+                yield f
+                f.flush()
+                if self.durability == Durability.FILE:
+                    os.fsync(f.fileno())
+            if isfile(path):
+                if _same_contents(tmp, path):
+                    # Leave unchanged files (and their mtimes) untouched
+                    os.remove(tmp)
+                    return
+                os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._pending.append((tmp, path))
+
+    def commit(self):
+        """
+        Rename all written files into place and flush them according to the
+        configured durability
+        """
+        pending, self._pending = self._pending, list()
+        for tmp, path in pending:
+            os.replace(tmp, path)
+        paths = [path for _, path in pending]
+        if self.durability == Durability.FILE:
+            for directory in {dirname(p) for p in paths}:
+                _fsync_path(directory)
+        elif self.durability == Durability.DEFERRED and paths:
+            sync_paths(paths)
+
+    def abort(self):
+        """
+        Discard all written files
+        """
+        pending, self._pending = self._pending, list()
+        for tmp, _ in pending:
+            os.remove(tmp)
+
+    def __enter__(self):
+        self._previous = get_active_batch()
+        _STATE.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _STATE.batch = self._previous
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'w',
+                 durability: Optional[Durability] = None,
+                 **kwargs) -> Iterator[IO]:
+    """
+    Open a file to be atomically replaced when the context exits without an
+    exception. If called within an `AtomicBatch` context, the file is instead
+    replaced when that batch is committed.
+    :param path: destination file path
+    :param mode: file mode; must be a write mode (`w` or `wb`)
+    :param durability: how the file is flushed to storage (default from
+        `get_durability`); if specified, the file is not added to an active
+        batch
+    :param kwargs: additional kwargs to pass to `open`
+    """
+    batch = get_active_batch()
+    if batch and durability is None:
+        with batch.open(path, mode, **kwargs) as f:
+            yield f
+        return
+    with AtomicBatch(durability) as batch:
+        with batch.open(path, mode, **kwargs) as f:
+            yield f
@@ -0,0 +1,281 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Dependency graph of the bundled Helm charts, used to keep chart versions,
+`appVersion`s, and dependency version pins consistent.
+"""
+
+import re
+
+from os import walk
+from os.path import join, dirname, abspath
+from typing import Dict, Iterable, List, Optional
+
+from neon_diana_utils.atomic import AtomicBatch, atomic_write
+
+CHART_DIR = join(dirname(__file__), "helm_charts")
+# Deployment charts; these depend on bundled charts but are not released
+DEPLOYMENT_CHART_DIR = join(dirname(__file__), "templates")
+BUMP_PARTS = ("major", "minor", "patch")
+
+_VERSION = re.compile(r"^(version:\s*)(\S+)(.*)$")
+_APP_VERSION = re.compile(r"^(appVersion:\s*)(\S+)(.*)$")
+_ITEM_FIELD = re.compile(r"^(\s*(?:-\s+)?)(name|version):\s*(\S+)(.*)$")
+
+
+def bump_version(version: str, part: str = "patch") -> str:
+    """
+    Increment part of a semantic version, dropping any prerelease or build
+    :param version: version to bump (i.e. `0.1.25`)
+    :param part: one of `major`, `minor`, `patch`
+    :returns: bumped version
+    """
+    match = re.match(r"^v?(\d+)\.(\d+)\.(\d+)", str(version))
+    if not match or part not in BUMP_PARTS:
+        raise ValueError(f"Cannot bump {part} of version: {version}")
+    parts = [int(p) for p in match.groups()]
+    index = BUMP_PARTS.index(part)
+    parts[index] += 1
+    parts[index + 1:] = [0] * (2 - index)
+    return ".".join(str(p) for p in parts)
+
+
+class ChartNode:
+    def __init__(self, path: str, text: str, managed: bool):
+        """
+        A chart in the graph
+        :param path: path to the chart's `Chart.yaml`
+        :param text: contents of `Chart.yaml`
+        :param managed: True if the chart's versions are managed by this
+            package (i.e. it is released)
+        """
+        import yaml
+        self.path = path
+        self.text = text
+        self.managed = managed
+        self.metadata = yaml.load(text, Loader=getattr(
+            yaml, "CSafeLoader", yaml.SafeLoader)) or dict()
+        self.name = self.metadata["name"]
+        self.version = str(self.metadata.get("version"))
+        self.app_version = self.metadata.get("appVersion")
+        # Dependency name to resolved ChartNode, populated by ChartGraph
+        self.dependencies: Dict[str, "ChartNode"] = dict()
+
+    @property
+    def chart_dir(self) -> str:
+        return dirname(self.path)
+
+    @property
+    def pins(self) -> Dict[str, str]:
+        """
+        Dependency name to pinned version
+        """
+        return {dep["name"]: str(dep.get("version"))
+                for dep in self.metadata.get("dependencies") or []}
+
+
+class ChartGraph:
+    def __init__(self, nodes: Iterable[ChartNode]):
+        """
+        Graph of charts and their local dependencies
+        :param nodes: charts to include in the graph
+        """
+        from neon_diana_utils.helm_render import resolve_dependency
+        self.nodes: Dict[str, ChartNode] = {n.path: n for n in nodes}
+        index = {n.name: n.chart_dir for n in self.nodes.values()
+                 if n.managed}
+        by_dir = {abspath(n.chart_dir): n for n in self.nodes.values()}
+        for node in self.nodes.values():
+            for dependency in node.metadata.get("dependencies") or []:
+                dep_path = resolve_dependency(node.chart_dir, dependency,
+                                              index)
+                dep = by_dir.get(abspath(dep_path)) if dep_path else None
+                if dep:
+                    node.dependencies[dependency["name"]] = dep
+
+    @classmethod
+    def load(cls, chart_dir: str = CHART_DIR,
+             deployment_dirs: Iterable[str] = (DEPLOYMENT_CHART_DIR,)) -> \
+            "ChartGraph":
+        """
+        Read every `Chart.yaml` in the specified directories
+        :param chart_dir: directory containing managed charts
+        :param deployment_dirs: directories containing charts that depend on
+            managed charts, but are not themselves managed
+        :returns: ChartGraph
+        """
+        nodes = list()
+        for root_dir, managed in [(chart_dir, True)] + \
+                [(d, False) for d in deployment_dirs]:
+            for root, dirs, files in walk(root_dir):
+                # Skip vendored dependencies
+                dirs[:] = sorted(d for d in dirs if d != "charts")
+                if "Chart.yaml" in files:
+                    path = join(root, "Chart.yaml")
+                    with open(path) as f:
+                        nodes.append(ChartNode(path, f.read(), managed))
+        return cls(nodes)
+
+    def topological_order(self) -> List[ChartNode]:
+        """
+        Get charts ordered so every chart follows its dependencies
+        :returns: list of ChartNode
+        """
+        order = list()
+        state: Dict[str, bool] = dict()
+
+        def _visit(node: ChartNode, stack: tuple):
+            if state.get(node.path) is True:
+                return
+            if node.path in stack:
+                cycle = " -> ".join(self.nodes[p].name
+                                    for p in stack + (node.path,))
+                raise ValueError(f"Chart dependency cycle: {cycle}")
+            for dep in node.dependencies.values():
+                _visit(dep, stack + (node.path,))
+            state[node.path] = True
+            order.append(node)
+
+        for path in sorted(self.nodes):
+            _visit(self.nodes[path], ())
+        return order
+
+    def plan_sync(self, app_version: Optional[str] = None,
+                  bump: Optional[str] = None,
+                  charts: Iterable[str] = ()) -> Dict[str, str]:
+        """
+        Compute `Chart.yaml` updates, visiting charts in dependency order so
+        each chart's pins reflect any version bumped earlier in the pass.
+        :param app_version: `appVersion` to set for managed charts
+        :param bump: part of managed charts' versions to bump (`major`,
+            `minor`, `patch`) when a chart changes, or None to only update
+            `appVersion` and pins
+        :param charts: names of managed charts to treat as changed
+        :returns: dict of `Chart.yaml` path to updated contents for files
+            that change
+        """
+        charts = set(charts)
+        versions: Dict[str, str] = dict()
+        changes = dict()
+        for node in self.topological_order():
+            new_app_version = app_version if node.managed and app_version \
+                else None
+            pins = {name: versions.get(dep.path, dep.version)
+                    for name, dep in node.dependencies.items()}
+            changed = node.name in charts or \
+                (new_app_version is not None and
+                 str(node.app_version) != new_app_version) or \
+                any(node.pins.get(name) != pin for name, pin in pins.items())
+            new_version = bump_version(node.version, bump) \
+                if bump and node.managed and changed else None
+            versions[node.path] = new_version or node.version
+            text = _update_chart_text(node.text, new_version,
+                                      new_app_version, pins)
+            if text != node.text:
+                changes[node.path] = text
+        return changes
+
+    def sync(self, app_version: Optional[str] = None,
+             bump: Optional[str] = None,
+             charts: Iterable[str] = ()) -> List[str]:
+        """
+        Apply `plan_sync` changes, writing only files that change
+        :returns: list of written `Chart.yaml` paths
+        """
+        changes = self.plan_sync(app_version, bump, charts)
+        with AtomicBatch():
+            for path, text in changes.items():
+                with atomic_write(path) as f:
+                    f.write(text)
+        for path, text in changes.items():
+            self.nodes[path] = ChartNode(path, text,
+                                         self.nodes[path].managed)
+        return list(changes)
+
+
+def _update_chart_text(text: str, version: Optional[str],
+                       app_version: Optional[str],
+                       pins: Dict[str, str]) -> str:
+    """
+    Update versions in `Chart.yaml` contents, preserving comments and
+    formatting
+    :param text: `Chart.yaml` contents
+    :param version: chart version to set, or None to leave unchanged
+    :param app_version: `appVersion` to set, or None to leave unchanged
+    :param pins: dependency name to version to set
+    :returns: updated contents
+    """
+    lines = text.splitlines(keepends=True)
+    in_dependencies = False
+    # Line index of the current dependency's version, and its name
+    item_version: Optional[int] = None
+    item_name: Optional[str] = None
+
+    def _apply_pin():
+        if item_version is not None and item_name in pins:
+            match = _ITEM_FIELD.match(lines[item_version].rstrip("\n"))
+            if match.group(3).strip("\"'") != pins[item_name]:
+                lines[item_version] = f"{match.group(1)}version: " \
+                                      f"{pins[item_name]}{match.group(4)}" \
+                                      f"{_newline(lines[item_version])}"
+
+    for idx, line in enumerate(lines):
+        stripped = line.rstrip("\n")
+        if not stripped.strip() or stripped.lstrip().startswith("#"):
+            continue
+        if not stripped[0].isspace() and not stripped.startswith("-"):
+            if in_dependencies:
+                _apply_pin()
+                item_version = item_name = None
+            in_dependencies = stripped.startswith("dependencies:")
+            match = _VERSION.match(stripped)
+            if match and version is not None:
+                lines[idx] = f"{match.group(1)}{version}{match.group(3)}" \
+                             f"{_newline(line)}"
+            match = _APP_VERSION.match(stripped)
+            if match and app_version is not None and \
+                    match.group(2).strip("\"'") != app_version:
+                lines[idx] = f"{match.group(1)}\"{app_version}\"" \
+                             f"{match.group(3)}{_newline(line)}"
+            continue
+        if not in_dependencies:
+            continue
+        if stripped.lstrip().startswith("-"):
+            _apply_pin()
+            item_version = item_name = None
+        match = _ITEM_FIELD.match(stripped)
+        if match and match.group(2) == "name":
+            item_name = match.group(3).strip("\"'")
+        elif match:
+            item_version = idx
+    if in_dependencies:
+        _apply_pin()
+    return "".join(lines)
+
+
+def _newline(line: str) -> str:
+    return "\n" if line.endswith("\n") else ""
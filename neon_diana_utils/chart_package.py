@@ -0,0 +1,307 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Deterministic packaging of Helm charts with a content-addressed cache.
+Archives are equivalent to `helm dependency build` + `helm package`, but are
+byte-for-byte reproducible so a chart only needs to be packaged once for any
+given contents of it and its dependencies.
+"""
+
+import os
+
+from fnmatch import fnmatch
+from hashlib import sha256
+from os.path import join, isfile, expanduser, relpath, basename
+from typing import Dict, List, Optional, Tuple
+
+from neon_diana_utils.atomic import atomic_write
+from neon_diana_utils.imports import lazy_import, LazyAttribute
+
+shutil = lazy_import("shutil")
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+
+# Increment when archive contents change for the same chart contents
+PACKAGE_FORMAT = 1
+# Build artifacts that are regenerated when a chart is packaged
+_BUILD_ARTIFACTS = ("charts", "Chart.lock")
+
+
+def default_cache_dir() -> str:
+    """
+    Get the default directory for packaged charts
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or expanduser("~/.cache")
+    return join(cache_home, "neon-diana", "charts")
+
+
+def _load_helmignore(chart_path: str) -> List[str]:
+    """
+    Read `.helmignore` patterns for a chart
+    """
+    ignore_file = join(chart_path, ".helmignore")
+    if not isfile(ignore_file):
+        return list()
+    with open(ignore_file) as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.startswith("#")]
+
+
+def _is_ignored(rel_path: str, is_dir: bool, patterns: List[str]) -> bool:
+    """
+    Check a path against `.helmignore` patterns; later patterns take
+    precedence and `!` negates a pattern
+    """
+    ignored = False
+    for pattern in patterns:
+        negate = pattern.startswith("!")
+        pattern = pattern.lstrip("!")
+        if pattern.endswith("/"):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip("/")
+        target = rel_path if "/" in pattern.lstrip("/") else basename(rel_path)
+        if fnmatch(target, pattern.lstrip("/")):
+            ignored = not negate
+    return ignored
+
+
+def chart_files(chart_path: str) -> List[str]:
+    """
+    List files included when packaging a chart, excluding `.helmignore`d
+    files and build artifacts
+    :param chart_path: path to the chart directory
+    :returns: sorted list of paths relative to `chart_path`
+    """
+    patterns = _load_helmignore(chart_path)
+    files = list()
+    for root, dirs, names in os.walk(chart_path):
+        rel_root = relpath(root, chart_path)
+        rel_root = "" if rel_root == "." else f"{rel_root}/"
+        dirs[:] = [d for d in dirs if not
+                   (not rel_root and d in _BUILD_ARTIFACTS) and
+                   not _is_ignored(f"{rel_root}{d}", True, patterns)]
+        for name in names:
+            rel_path = f"{rel_root}{name}"
+            if (not rel_root and name in _BUILD_ARTIFACTS) or \
+                    _is_ignored(rel_path, False, patterns):
+                continue
+            files.append(rel_path)
+    return sorted(files)
+
+
+class _PackageSource:
+    def __init__(self, path: str, metadata: dict, files: List[str],
+                 dependencies: List["_PackageSource"], key: str):
+        """
+        A chart and its resolved dependencies, identified by content hash
+        """
+        self.path = path
+        self.metadata = metadata
+        self.files = files
+        self.dependencies = dependencies
+        self.key = key
+
+    @property
+    def archive_name(self) -> str:
+        return f"{self.metadata['name']}-{self.metadata['version']}.tgz"
+
+
+def _load_source(chart_path: str,
+                 sources: Dict[str, _PackageSource]) -> _PackageSource:
+    """
+    Hash a chart and its local dependencies
+    :param chart_path: path to the chart directory
+    :param sources: dict of chart path to already loaded sources
+    """
+    import yaml
+    from neon_diana_utils.helm_render import resolve_dependency
+    chart_path = os.path.abspath(chart_path)
+    if chart_path in sources:
+        return sources[chart_path]
+    files = chart_files(chart_path)
+    digest = sha256(f"{PACKAGE_FORMAT}\0".encode())
+    for file in files:
+        with open(join(chart_path, file), 'rb') as f:
+            contents = f.read()
+        executable = os.access(join(chart_path, file), os.X_OK)
+        digest.update(f"{file}\0{int(executable)}\0{len(contents)}\0"
+                      .encode())
+        digest.update(contents)
+        if file == "Chart.yaml":
+            metadata = yaml.safe_load(contents)
+    dependencies = list()
+    for dependency in metadata.get("dependencies") or []:
+        dep_path = resolve_dependency(chart_path, dependency)
+        if not dep_path:
+            # Left for `helm dependency build` at deploy time
+            LOG.warning(f"Not packaging unavailable dependency of "
+                        f"{metadata['name']}: {dependency['name']} "
+                        f"({dependency.get('repository')})")
+            continue
+        dep = _load_source(dep_path, sources)
+        dependencies.append(dep)
+        digest.update(f"dependency\0{dep.key}\0".encode())
+    source = _PackageSource(chart_path, metadata, files, dependencies,
+                            digest.hexdigest())
+    sources[chart_path] = source
+    return source
+
+
+def _add_file(archive, name: str, contents: bytes, executable: bool = False):
+    """
+    Add a file to a tar archive with normalized metadata
+    """
+    import tarfile
+    from io import BytesIO
+    info = tarfile.TarInfo(name)
+    info.size = len(contents)
+    info.mode = 0o755 if executable else 0o644
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    archive.addfile(info, BytesIO(contents))
+
+
+class ChartStore:
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        Content-addressed store of packaged charts. Stored archives are never
+        modified, so they are safe to share between runs and tenants.
+        :param cache_dir: directory to store archives in
+            (default `default_cache_dir()`)
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.hits = 0
+        self.misses = 0
+        self._sources: Dict[str, _PackageSource] = dict()
+
+    def _object_path(self, key: str) -> str:
+        return join(self.cache_dir, key[:2], f"{key}.tgz")
+
+    def _build(self, source: _PackageSource) -> str:
+        """
+        Get the archive for a chart, packaging it and its dependencies if not
+        already in the store
+        """
+        import gzip
+        import tarfile
+        object_path = self._object_path(source.key)
+        if isfile(object_path):
+            self.hits += 1
+            return object_path
+        self.misses += 1
+        dependencies = [(dep.archive_name, self._build(dep))
+                        for dep in source.dependencies]
+        name = source.metadata["name"]
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with atomic_write(object_path, 'wb') as f, \
+                gzip.GzipFile(filename="", mode='wb', fileobj=f,
+                              mtime=0) as gz, \
+                tarfile.open(fileobj=gz, mode='w',
+                             format=tarfile.PAX_FORMAT) as archive:
+            for file in source.files:
+                file_path = join(source.path, file)
+                with open(file_path, 'rb') as src:
+                    _add_file(archive, f"{name}/{file}", src.read(),
+                              os.access(file_path, os.X_OK))
+            for archive_name, dep_path in sorted(dependencies):
+                with open(dep_path, 'rb') as src:
+                    _add_file(archive, f"{name}/charts/{archive_name}",
+                              src.read())
+        return object_path
+
+    def package(self, chart_path: str) -> Tuple[str, str]:
+        """
+        Get a packaged chart, including its locally available dependencies
+        :param chart_path: path to the chart directory
+        :returns: path to the archive in the store and the archive file name
+            (`<name>-<version>.tgz`)
+        """
+        source = _load_source(chart_path, self._sources)
+        return self._build(source), source.archive_name
+
+    def dependencies(self, chart_path: str) -> List[Tuple[str, str]]:
+        """
+        Get packaged dependencies of a chart
+        :param chart_path: path to the chart directory
+        :returns: list of archive paths in the store and archive file names
+        """
+        source = _load_source(chart_path, self._sources)
+        return [(self._build(dep), dep.archive_name)
+                for dep in source.dependencies]
+
+
+def _place(src: str, dst: str):
+    """
+    Link or copy a stored archive to `dst`, leaving an identical file in place
+    """
+    import filecmp
+    if isfile(dst):
+        if filecmp.cmp(src, dst, shallow=False):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def package_chart(chart_path: str, output_dir: str,
+                  store: Optional[ChartStore] = None) -> str:
+    """
+    Package a chart with its dependencies, equivalent to
+    `helm dependency build` followed by `helm package`.
+    :param chart_path: path to the chart directory
+    :param output_dir: directory to write `<name>-<version>.tgz` to
+    :param store: ChartStore to get packaged charts from
+    :returns: path to the written archive
+    """
+    store = store or ChartStore()
+    archive, archive_name = store.package(chart_path)
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = join(output_dir, archive_name)
+    _place(archive, output_file)
+    return output_file
+
+
+def vendor_dependencies(chart_path: str,
+                        store: Optional[ChartStore] = None) -> List[str]:
+    """
+    Write packaged dependencies to a chart's `charts/` directory, equivalent
+    to `helm dependency build` for dependencies available locally.
+    :param chart_path: path to the chart directory
+    :param store: ChartStore to get packaged charts from
+    :returns: list of written archive paths
+    """
+    store = store or ChartStore()
+    charts_dir = join(chart_path, "charts")
+    written = list()
+    for archive, archive_name in store.dependencies(chart_path):
+        os.makedirs(charts_dir, exist_ok=True)
+        _place(archive, join(charts_dir, archive_name))
+        written.append(join(charts_dir, archive_name))
+    return written
@@ -37,9 +37,17 @@ from neon_diana_utils.version import __version__
                   "See also: diana COMMAND --help")
 @click.option("--version", "-v", is_flag=True, required=False,
               help='Print the current version')
-def neon_diana_cli(version: bool = False):
+@click.option("--profile-startup", is_flag=True, required=False,
+              help='Print a summary of module import times')
+def neon_diana_cli(version: bool = False, profile_startup: bool = False):
     if version:
         click.echo(f"Diana version {__version__}")
+    if profile_startup:
+        from neon_diana_utils.imports import profile_imports, \
+            summarize_import_profile
+        results = profile_imports(("neon_diana_utils.cli",
+                                   "neon_diana_utils.configuration"))
+        click.echo(summarize_import_profile(results))
 
 
 # Generic Utilities
@@ -147,6 +155,243 @@ def update_rmq_config(config_path):
     update_rmq_config(join(config_path, "rabbitmq.json"))
 
 
+@neon_diana_cli.command(help="Apply RabbitMQ definitions to a running server")
+@click.option("--url", default="http://localhost:15672",
+              help="RabbitMQ management URL")
+@click.option("--username", "-u", prompt=True, help="RabbitMQ admin username")
+@click.option("--password", "-p", prompt=True, hide_input=True,
+              help="RabbitMQ admin password")
+@click.option("--dry-run", is_flag=True,
+              help="Print planned changes without applying them")
+@click.option("--prune", is_flag=True,
+              help="Delete users, vhosts, and permissions not in definitions")
+@click.option("--prune-admins", is_flag=True,
+              help="With --prune, also delete administrator users other "
+                   "than --username")
+@click.argument("rabbitmq_json_path", default=None, required=False)
+def reconcile_rabbitmq(url, username, password, dry_run, prune, prune_admins,
+                       rabbitmq_json_path):
+    import json
+    from os.path import expanduser
+    from ovos_utils.xdg_utils import xdg_config_home
+    from neon_diana_utils.rabbitmq_api import RabbitMQAPI
+    from neon_diana_utils.rabbitmq_definitions import reconcile_definitions, \
+        format_plan
+    rabbitmq_json_path = expanduser(rabbitmq_json_path or
+                                    join(xdg_config_home(), "diana",
+                                         "diana-backend", "rabbitmq.json"))
+    with open(rabbitmq_json_path) as f:
+        desired = json.load(f)
+    with RabbitMQAPI(url) as api:
+        api.login(username, password)
+        plan = reconcile_definitions(api, desired, dry_run, prune,
+                                     prune_admins)
+    click.echo(format_plan(plan))
+    if not dry_run:
+        click.echo(f"Applied changes to {url}")
+
+
+@neon_diana_cli.command(help="Generate definitions from a deployment spec")
+@click.option("--link-mode", "-l", default="auto",
+              type=click.Choice(["auto", "copy", "reflink", "hardlink"]),
+              help="How to materialize unmodified template files. "
+                   "Hardlinked files must not be modified")
+@click.option("--incremental", "-i", is_flag=True,
+              help="Update existing outputs, regenerating only sections "
+                   "whose inputs changed")
+@click.argument("spec_file")
+@click.argument("output_path", default=None, required=False)
+def apply_spec(link_mode, incremental, spec_file, output_path):
+    from neon_diana_utils.materialize import LinkMode
+    from neon_diana_utils.spec import load_spec, apply_spec
+    try:
+        output_path = apply_spec(load_spec(spec_file), output_path,
+                                 LinkMode(link_mode), incremental)
+    except (ValueError, FileExistsError, FileNotFoundError) as e:
+        click.echo(f"Failed to apply {spec_file}: {e}")
+        return
+    click.echo(f"Outputs generated in {output_path}")
+
+
+@neon_diana_cli.command(help="Generate definitions for many tenants")
+@click.option("--workers", "-w", type=int, default=None,
+              help="Number of worker processes (default CPU count)")
+@click.option("--link-mode", "-l", default="auto",
+              type=click.Choice(["auto", "copy", "reflink", "hardlink"]),
+              help="How to materialize unmodified template files. "
+                   "Hardlinked files must not be modified")
+@click.option("--durability", "-d", default="deferred",
+              type=click.Choice(["none", "file", "deferred"]),
+              help="How generated files are flushed to storage. `deferred` "
+                   "flushes all tenants once at the end")
+@click.option("--incremental", "-i", is_flag=True,
+              help="Update existing outputs, regenerating only sections "
+                   "whose inputs changed")
+@click.argument("fleet_file")
+@click.argument("output_path", default=None, required=False)
+def generate_fleet(workers, link_mode, durability, incremental, fleet_file,
+                   output_path):
+    from time import perf_counter
+    from neon_diana_utils.fleet import load_fleet, generate_fleet, \
+        format_fleet_report
+    from neon_diana_utils.atomic import Durability
+    from neon_diana_utils.materialize import LinkMode
+    try:
+        tenants = load_fleet(fleet_file)
+    except (ValueError, FileNotFoundError) as e:
+        click.echo(f"Invalid fleet file {fleet_file}: {e}")
+        return
+    start = perf_counter()
+    results = generate_fleet(tenants, output_path, workers,
+                             LinkMode(link_mode), Durability(durability),
+                             incremental)
+    click.echo(format_fleet_report(results, perf_counter() - start))
+
+
+@neon_diana_cli.command(help="Render a Helm chart without helm")
+@click.option("--values", "-f", "value_files", multiple=True,
+              help="YAML values file to apply (may be repeated)")
+@click.option("--set", "set_values", multiple=True,
+              help="Value to set, i.e. `backend.domain=example.com`")
+@click.option("--release-name", "-n", default="release-name",
+              help="Release name to render with")
+@click.option("--kube-version", default=None,
+              help="Kubernetes version to render for (i.e. v1.28.0)")
+@click.argument("chart_path")
+def render_chart(value_files, set_values, release_name, kube_version,
+                 chart_path):
+    from neon_diana_utils.helm_render import render_chart, \
+        format_manifests, parse_set_values, DEFAULT_KUBE_VERSION
+    from neon_diana_utils.go_template import TemplateError
+    try:
+        manifests = render_chart(chart_path, parse_set_values(set_values),
+                                 value_files, release_name,
+                                 kube_version=kube_version or
+                                 DEFAULT_KUBE_VERSION)
+    except (TemplateError, ValueError, FileNotFoundError) as e:
+        click.echo(f"Failed to render {chart_path}: {e}")
+        return
+    click.echo(format_manifests(manifests), nl=False)
+
+
+@neon_diana_cli.command(help="Package Helm charts with their dependencies")
+@click.option("--output-dir", "-o", default=".",
+              help="Directory to write packaged charts to")
+@click.option("--cache-dir", "-c", default=None,
+              help="Directory to cache packaged charts in")
+@click.option("--vendor", is_flag=True,
+              help="Write packaged dependencies to each chart's `charts/` "
+                   "directory instead of packaging the chart")
+@click.argument("chart_paths", nargs=-1, required=True)
+def package_charts(output_dir, cache_dir, vendor, chart_paths):
+    from neon_diana_utils.chart_package import ChartStore, package_chart, \
+        vendor_dependencies
+    store = ChartStore(cache_dir)
+    for chart_path in chart_paths:
+        try:
+            if vendor:
+                for archive in vendor_dependencies(chart_path, store):
+                    click.echo(archive)
+            else:
+                click.echo(package_chart(chart_path, output_dir, store))
+        except FileNotFoundError as e:
+            click.echo(f"Failed to package {chart_path}: {e}")
+    click.echo(f"Reused {store.hits}/{store.hits + store.misses} "
+               f"packaged charts")
+
+
+@neon_diana_cli.command(help="Benchmark MQ latency for the DIANA vhosts")
+@click.option("--local", is_flag=True,
+              help="Benchmark an in-memory stand-in broker")
+@click.option("--url", default="http://localhost:15672",
+              help="RabbitMQ management URL")
+@click.option("--amqp-host", default=None,
+              help="RabbitMQ AMQP host (default from --url)")
+@click.option("--amqp-port", type=int, default=5672,
+              help="RabbitMQ AMQP port")
+@click.option("--username", "-u", help="RabbitMQ admin username")
+@click.option("--password", "-p", help="RabbitMQ admin password")
+@click.option("--service", "-s", "services", multiple=True,
+              help="Service user to benchmark (default all)")
+@click.option("--messages", "-m", type=int, default=1000,
+              help="Round trips to measure per service and vhost")
+@click.option("--in-flight", type=int, default=1,
+              help="Max requests awaiting a reply per service")
+@click.option("--message-size", type=int, default=256,
+              help="Request size in bytes")
+@click.option("--concurrency", "-c", type=int, default=1,
+              help="Number of services to benchmark at a time")
+@click.option("--timeout", type=float, default=5.0,
+              help="Seconds to wait for a reply")
+@click.option("--prefix", default="bench_",
+              help="Prefix for benchmark users and vhosts. An empty prefix "
+                   "is only allowed with --local")
+@click.option("--output", "-o", default=None,
+              help="Path to write a JSON report to")
+@click.option("--baseline", "-b", default=None,
+              help="JSON report to check for regressions against")
+@click.option("--tolerance", type=float, default=0.2,
+              help="Allowed fractional change from the baseline")
+def bench_mq(local, url, amqp_host, amqp_port, username, password, services,
+             messages, in_flight, message_size, concurrency, timeout, prefix,
+             output, baseline, tolerance):
+    import json
+    from urllib.parse import urlparse
+    from neon_diana_utils.atomic import atomic_write
+    from neon_diana_utils.configuration import generate_rmq_config
+    from neon_diana_utils.mq_bench import LocalBroker, PikaConnector, \
+        bench_definitions, plan_targets, run_benchmark, cleanup_definitions, \
+        format_bench_report, report_to_dict, compare_reports
+    from neon_diana_utils.rabbitmq_api import RabbitMQAPI
+    if not (local or prefix):
+        # Benchmark users and vhosts are deleted afterwards; without a prefix
+        # they are the broker's real service users and vhosts
+        click.echo("--prefix may only be empty with --local")
+        return
+    definitions = bench_definitions(generate_rmq_config(None, None), prefix)
+    targets = plan_targets(definitions, services, prefix)
+    if not targets:
+        click.echo(f"No benchmark targets for services: {services}")
+        return
+    if local:
+        api = connector = LocalBroker()
+    else:
+        if not (username and password):
+            click.echo("--username and --password are required")
+            return
+        api = RabbitMQAPI(url)
+        api.login(username, password)
+        connector = PikaConnector(amqp_host or urlparse(url).hostname,
+                                  amqp_port)
+    try:
+        report = api.import_definitions(definitions)
+        failed = [key for section in report.values()
+                  for key, ok in section.items() if not ok]
+        if failed:
+            click.echo(f"Failed to provision: {failed}")
+            return
+        results = run_benchmark(connector, targets, messages, in_flight,
+                                message_size, timeout, concurrency)
+    finally:
+        cleanup_definitions(api, definitions)
+        if not local:
+            api.close()
+    click.echo(format_bench_report(results))
+    current = report_to_dict(results, broker="local" if local else url,
+                             messages=messages, in_flight=in_flight,
+                             message_size=message_size)
+    if output:
+        with atomic_write(output) as f:
+            json.dump(current, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare_reports(json.load(f), current, tolerance)
+        for regression in regressions:
+            click.echo(f"Regression: {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
 @neon_diana_cli.command(help="Generate a configuration file with access keys")
 @click.option("--skip-write", "-s", help="Skip writing config to file",
               is_flag=True)
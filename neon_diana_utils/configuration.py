@@ -24,19 +24,33 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import click
-import yaml
 import json
-import secrets
-import shutil
+import pickle
 
 from enum import Enum
-from pprint import pformat
-from typing import Optional, Set
-from os import makedirs, listdir
+from threading import Lock
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from os import makedirs, listdir, stat
 from os.path import expanduser, join, abspath, isfile, isdir, dirname
-from ovos_utils.xdg_utils import xdg_config_home
-from ovos_utils.log import LOG
+
+from neon_diana_utils.atomic import AtomicBatch, atomic_write
+from neon_diana_utils.credentials import CredentialService, \
+    get_default_credentials
+from neon_diana_utils.imports import lazy_import, LazyAttribute
+from neon_diana_utils.materialize import LinkMode, materialize_tree
+from neon_diana_utils.template_snapshot import TemplateSnapshot
+
+# Dependencies are loaded on first use to keep CLI startup fast
+click = lazy_import("click")
+yaml = lazy_import("yaml")
+shutil = lazy_import("shutil")
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+xdg_config_home = LazyAttribute("ovos_utils.xdg_utils", "xdg_config_home")
+pformat = LazyAttribute("pprint", "pformat")
+
+# RabbitMQ user KEDA authenticates as to read queue lengths
+KEDA_MQ_USER = "neon_keda"
 
 
 class Orchestrator(Enum):
@@ -47,6 +61,117 @@ class Orchestrator(Enum):
     COMPOSE = "docker-compose"
 
 
+class _TemplateCacheEntry:
+    def __init__(self, mtime: int, data: Any):
+        """
+        Parsed template file cached by `load_template`
+        :param mtime: modification time (ns) of the file when it was parsed
+        :param data: parsed file contents
+        """
+        self.mtime = mtime
+        self.serialized = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        self._frozen = None
+
+    @classmethod
+    def from_serialized(cls, mtime: int, serialized: bytes):
+        """
+        Create an entry from contents already serialized by another process
+        :param mtime: modification time (ns) of the file when it was parsed
+        :param serialized: pickled file contents
+        """
+        entry = cls.__new__(cls)
+        entry.mtime = mtime
+        entry.serialized = serialized
+        entry._frozen = None
+        return entry
+
+    @property
+    def frozen(self) -> Any:
+        """
+        Read-only view of the cached template
+        """
+        if self._frozen is None:
+            self._frozen = _freeze(pickle.loads(self.serialized))
+        return self._frozen
+
+
+_TEMPLATE_CACHE: Dict[str, _TemplateCacheEntry] = dict()
+_TEMPLATE_CACHE_LOCK = Lock()
+_TEMPLATE_SNAPSHOT = TemplateSnapshot()
+
+
+def _freeze(data: Any) -> Any:
+    """
+    Recursively convert dicts to read-only mappings and lists to tuples
+    """
+    if isinstance(data, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return tuple(_freeze(v) for v in data)
+    return data
+
+
+def load_template(template: str, mutable: bool = True) -> Any:
+    """
+    Load a bundled YAML template. Templates are read from the snapshot built
+    with the package if it is current, else each template is parsed once
+    (using the libyaml loader if available) and re-parsed only if the file is
+    modified.
+    @param template: path to a YAML file, relative to the bundled `templates`
+        directory (i.e. `mq_user_mapping.yml`)
+    @param mutable: if True, return a copy that may be modified; else return a
+        read-only view shared by all callers
+    @returns: parsed template contents
+    """
+    template_file = join(dirname(__file__), "templates", template)
+    mtime = stat(template_file).st_mtime_ns
+    entry = _TEMPLATE_CACHE.get(template_file)
+    if entry is None or entry.mtime != mtime:
+        with _TEMPLATE_CACHE_LOCK:
+            entry = _TEMPLATE_CACHE.get(template_file)
+            if entry is None or entry.mtime != mtime:
+                data = _TEMPLATE_SNAPSHOT.get(template_file, mtime)
+                if data is None:
+                    LOG.debug(f"Parsing template: {template_file}")
+                    with open(template_file) as f:
+                        data = yaml.load(f, Loader=getattr(
+                            yaml, "CSafeLoader", yaml.SafeLoader))
+                entry = _TemplateCacheEntry(mtime, data)
+                _TEMPLATE_CACHE[template_file] = entry
+    if mutable:
+        return pickle.loads(entry.serialized)
+    return entry.frozen
+
+
+def export_template_cache() -> Dict[str, Tuple[int, bytes]]:
+    """
+    Parse all bundled templates and export the cache so it may be shared with
+    other processes, i.e. workers generating configuration in parallel.
+    @returns: dict template file to (mtime, serialized contents)
+    """
+    from glob import glob
+    from neon_diana_utils.template_snapshot import SNAPSHOT_TEMPLATES, \
+        TEMPLATE_DIR
+    for pattern in SNAPSHOT_TEMPLATES:
+        for template_file in glob(join(TEMPLATE_DIR, pattern)):
+            load_template(template_file, mutable=False)
+    with _TEMPLATE_CACHE_LOCK:
+        return {template_file: (entry.mtime, entry.serialized)
+                for template_file, entry in _TEMPLATE_CACHE.items()}
+
+
+def import_template_cache(cache: Dict[str, Tuple[int, bytes]]):
+    """
+    Seed the template cache with entries exported by `export_template_cache`.
+    Entries are still validated against file modification times on load.
+    @param cache: dict template file to (mtime, serialized contents)
+    """
+    with _TEMPLATE_CACHE_LOCK:
+        for template_file, (mtime, serialized) in cache.items():
+            _TEMPLATE_CACHE[template_file] = \
+                _TemplateCacheEntry.from_serialized(mtime, serialized)
+
+
 # def _collect_helm_charts(output_path: str, charts_dir: str):
 #     """
 #     Collect Helm charts in the output directory and remove any leftover build
@@ -77,23 +202,83 @@ def validate_output_path(output_path: str) -> bool:
     return True
 
 
+def build_llm_bot_config(llms: Iterable[str]) -> dict:
+    """
+    Build configuration for llm personas to participate in chatbotsforum/Klat.
+    @param llms: LLMs to configure personas for (i.e. `chat_gpt`, `claude`)
+    @returns: dict configuration
+    """
+    persona_config = load_template("llm_personas.yml")
+    configuration = {"llm_bots": dict()}
+    for llm in llms:
+        if llm not in persona_config:
+            raise ValueError(f"No personas defined for LLM: {llm}")
+        configuration['llm_bots'][llm] = persona_config[llm]
+    return configuration
+
+
 def make_llm_bot_config():
     """
     Interactive configuration tool to configure llm personas to participate in
     chatbotsforum/Klat.
     """
-    with open(join(dirname(__file__), "templates", "llm_personas.yml")) as f:
-        persona_config = yaml.safe_load(f)
-    configuration = {"llm_bots": dict()}
+    llms = list()
     if click.confirm("Configure ChatGPT Personas?"):
-        configuration['llm_bots']['chat_gpt'] = persona_config['chat_gpt']
+        llms.append('chat_gpt')
     if click.confirm("Configure PaLM2 Personas?"):
-        configuration['llm_bots']['palm2'] = persona_config['palm2']
+        llms.append('palm2')
     if click.confirm("Configure Gemini Personas?"):
-        configuration['llm_bots']['gemini'] = persona_config['gemini']
+        llms.append('gemini')
     if click.confirm("Configure Claude Personas?"):
-        configuration['llm_bots']['claude'] = persona_config['claude']
-    return configuration
+        llms.append('claude')
+    return build_llm_bot_config(llms)
+
+
+def build_keys_config(api_services: Optional[dict] = None,
+                      emails: Optional[dict] = None,
+                      track_my_brands: Optional[dict] = None,
+                      chat_gpt: Optional[dict] = None,
+                      fastchat: Optional[dict] = None,
+                      palm2: Optional[dict] = None,
+                      gemini: Optional[dict] = None,
+                      claude: Optional[dict] = None,
+                      hana: Optional[dict] = None,
+                      credentials: Optional[CredentialService] = None) \
+        -> dict:
+    """
+    Build a configuration with API keys and service accounts. Unspecified
+    services are left unconfigured.
+    @param api_services: API proxy service keys
+    @param emails: Email service configuration
+    @param track_my_brands: Brands/Coupons service configuration
+    @param chat_gpt: ChatGPT LLM configuration
+    @param fastchat: FastChat LLM configuration
+    @param palm2: PaLM2 LLM configuration
+    @param gemini: Gemini LLM configuration
+    @param claude: Anthropic Claude LLM configuration
+    @param hana: HANA token secrets; if None, secrets are generated
+    @param credentials: service to get generated secrets from (default
+        random)
+    @returns: dict configuration
+    """
+    fastchat = fastchat or dict()
+    if not hana:
+        credentials = credentials or get_default_credentials()
+        hana = {name.split('/', 1)[1]: secret for name, secret in
+                credentials.get_or_create(("hana/access_token_secret",
+                                           "hana/refresh_token_secret"),
+                                          encoding="hex").items()}
+    return {"keys": {"api_services": api_services or dict(),
+                     "emails": emails or dict(),
+                     "track_my_brands": track_my_brands or dict()},
+            "LLM_CHAT_GPT": chat_gpt or dict(),
+            "LLM_FASTCHAT": fastchat,
+            "LLM_PALM2": palm2 or dict(),
+            "LLM_GEMINI": gemini or dict(),
+            "LLM_CLAUDE": claude or dict(),
+            "FastChat": fastchat,  # TODO: Backwards-compat. only
+            "hana": hana
+            }
 
 
 def make_keys_config(write_config: bool,
@@ -296,23 +481,12 @@ def make_keys_config(write_config: bool,
             config_confirmed = \
                 click.confirm("Is this configuration correct?")
 
-    config = {"keys": {"api_services": api_services,
-                       "emails": email_config,
-                       "track_my_brands": brands_config},
-              "LLM_CHAT_GPT": chatgpt_config,
-              "LLM_FASTCHAT": fastchat_config,
-              "LLM_PALM2": palm2_config,
-              "LLM_GEMINI": gemini_config,
-              "LLM_CLAUDE": claude_config,
-              "FastChat": fastchat_config,  # TODO: Backwards-compat. only
-              "hana": {
-                  "access_token_secret": secrets.token_hex(32),
-                  "refresh_token_secret": secrets.token_hex(32)
-              }
-              }
+    config = build_keys_config(api_services, email_config, brands_config,
+                               chatgpt_config, fastchat_config, palm2_config,
+                               gemini_config, claude_config)
     if write_config:
         click.echo(f"Writing configuration to {output_file}")
-        with open(output_file, 'w+') as f:
+        with atomic_write(output_file) as f:
             yaml.dump(config, f)
     return config
 
@@ -321,7 +495,9 @@ def update_rmq_config(config_file: str = None) -> str:
     """
     Update an existing RabbitMQ configuration with new definitions from DIANA.
     This can be used to handle added service users without changing existing
-    ones and to reset/update permissions and vhosts.
+    ones and to reset/update permissions and vhosts. Any other objects in the
+    existing configuration (i.e. queues, policies, or permissions added by an
+    operator) are preserved.
     @param config_file: Path to file to be updated
     @returns: Path to updated file
     """
@@ -334,43 +510,62 @@ def update_rmq_config(config_file: str = None) -> str:
     if not isfile(config_file):
         raise FileNotFoundError(config_file)
 
-    with open(config_file) as f:
-        real_config = json.load(f)
+    from neon_diana_utils.rabbitmq_definitions import hash_user_passwords, \
+        iter_definitions_section, stream_merge_definitions
     new_config = generate_rmq_config("", "")
-    existing_users = [user['name'] for user in real_config['users']]
-    for user in new_config['users']:
-        if user['name'] in existing_users:
-            continue
-        LOG.info(f"Adding user: {user['name']}")
-        real_config['users'].append(user)
-    real_config['vhosts'] = new_config['vhosts']
-    real_config['permissions'] = new_config['permissions']
-
-    shutil.move(config_file, f"{config_file}.old")
-    with open(config_file, 'w+') as f:
-        json.dump(real_config, f, indent=2)
+    # Added users are hashed like the existing users so that no plaintext
+    # passwords are written to a hashed configuration
+    with open(config_file) as f:
+        hashing_algorithm = next((user['hashing_algorithm'] for user in
+                                  iter_definitions_section(f, 'users')
+                                  if user.get('password_hash') and
+                                  user.get('hashing_algorithm')), None)
+    if hashing_algorithm:
+        new_config = hash_user_passwords(new_config, hashing_algorithm)
+
+    # Definitions are merged section by section so that large exports (i.e.
+    # with many queues and bindings) are never fully loaded into memory. The
+    # existing file is only replaced once the merge completes
+    shutil.copy2(config_file, f"{config_file}.old")
+    try:
+        with open(config_file) as src, atomic_write(config_file) as dst:
+            stream_merge_definitions(src, dst, new_config)
+    except Exception as e:
+        LOG.error(f"Failed to update {config_file}: {e}")
+        raise e
     return config_file
 
 
 def generate_rmq_config(admin_username: str, admin_password: str,
-                        output_file: str = None) -> dict:
+                        output_file: str = None,
+                        passwords: Optional[Dict[str, str]] = None,
+                        credentials: Optional[CredentialService] = None) \
+        -> dict:
     """
     Generate a default configuration for RabbitMQ. This defines all default
     users, vhosts, and permissions that may be used with a deployment.
     @param admin_username: Username for admin account
     @param admin_password: Password for admin account
     @param output_file: Optional path to write configuration to
+    @param passwords: Optional dict of username to existing password to use
+        instead of generating a new password
+    @param credentials: service to get generated passwords from (default
+        random); passwords for all users are requested in one batch
     @returns: dict RabbitMQ Configuration
     """
-    base_config_file = join((dirname(__file__)), "templates",
-                            "rmq_backend_config.yml")
-    with open(base_config_file) as f:
-        base_config = yaml.safe_load(f)
+    passwords = passwords or dict()
+    base_config = load_template("rmq_backend_config.yml")
+    # Skip users with defined passwords
+    unset = [user for user in base_config['users']
+             if not user['password'] and not passwords.get(user['name'])]
+    credentials = credentials or get_default_credentials()
+    generated = credentials.get_or_create(f"rabbitmq/{user['name']}"
+                                          for user in unset)
     for user in base_config['users']:
         if user["password"]:
-            # Skip users with defined passwords
             continue
-        user['password'] = secrets.token_urlsafe(32)
+        user['password'] = passwords.get(user['name']) or \
+            generated[f"rabbitmq/{user['name']}"]
 
     if admin_username and admin_password:
         base_config['users'].append({'name': admin_username,
@@ -379,30 +574,38 @@ def generate_rmq_config(admin_username: str, admin_password: str,
     else:
         LOG.debug("Not adding unconfigured admin user")
     if output_file and validate_output_path(output_file):
-        with open(output_file, 'w+') as f:
+        with atomic_write(output_file) as f:
             json.dump(base_config, f, indent=2)
     return base_config
 
 
+def add_monitoring_user(rmq_config: dict, username: str,
+                        password: str) -> dict:
+    """
+    Add a user that may read metrics (i.e. queue lengths) from the management
+    API of every vhost in a RabbitMQ configuration, but may not configure,
+    publish to, or consume from any resource
+    @param rmq_config: RabbitMQ definitions, i.e. from `generate_rmq_config`
+    @param username: monitoring username
+    @param password: monitoring user password
+    @returns: updated `rmq_config`
+    """
+    rmq_config['users'].append({'name': username, 'password': password,
+                                'tags': ['monitoring']})
+    rmq_config['permissions'].extend(
+        {'user': username, 'vhost': vhost['name'], 'configure': '^$',
+         'write': '^$', 'read': '^$'} for vhost in rmq_config['vhosts'])
+    return rmq_config
+
+
 def generate_mq_auth_config(rmq_config: dict) -> dict:
     """
     Generate an MQ auth config from RabbitMQ config
     :param rmq_config: RabbitMQ definitions, i.d. from `generate_rmq_config
     :returns: Configuration for Neon MQ-Connector
     """
-    mq_user_mapping_file = join(dirname(__file__), "templates",
-                                "mq_user_mapping.yml")
-    with open(mq_user_mapping_file) as f:
-        mq_user_mapping = yaml.safe_load(f)
-
-    mq_config = dict()
-    LOG.debug(rmq_config.keys())
-    for user in rmq_config['users']:
-        username = user['name']
-        for service in mq_user_mapping.get(username, []):
-            mq_config[service] = {"user": username,
-                                  "password": user['password']}
-    return mq_config
+    from neon_diana_utils.mq_auth import MQAuthIndex
+    return MQAuthIndex.from_definitions(rmq_config).auth_config()
 
 
 def update_env_file(env_file: str):
@@ -415,10 +618,24 @@ def update_env_file(env_file: str):
     with open(env_file, 'r') as f:
         contents = f.read()
     contents = contents.replace('./', f"{dirname(env_file)}/")
-    with open(env_file, 'w') as f:
+    with atomic_write(env_file) as f:
         f.write(contents)
 
 
+def find_mq_service_user(mq_tag: str, rmq_config: str,
+                         auth_config: Optional[str] = None) -> Optional[dict]:
+    """
+    Find the first user with the specified tag in a RabbitMQ configuration.
+    @param mq_tag: RabbitMQ User tag used to identify a service
+    @param rmq_config: Path to RabbitMQ configuration file to read
+    @param auth_config: Optional path to backend `diana.yaml` to read hashed
+        users' passwords from
+    @returns: dict `user` and `password` if a matching user exists, else None
+    """
+    from neon_diana_utils.mq_auth import MQAuthIndex
+    return MQAuthIndex.from_file(rmq_config, auth_config).find_tag(mq_tag)
+
+
 def _get_mq_service_user_config(mq_user: Optional[str], mq_pass: Optional[str],
                                 mq_tag: str, rmq_config: str) -> dict:
     """
@@ -432,13 +649,10 @@ def _get_mq_service_user_config(mq_user: Optional[str], mq_pass: Optional[str],
     # Check for passed or previously configured MQ user
     if not all((mq_user, mq_pass)) and isfile(rmq_config):
         if click.confirm(f"Import {mq_tag} MQ user from {rmq_config}?"):
-            with open(rmq_config) as f:
-                config = json.load(f)
-            for user in config['users']:
-                if mq_tag in user['tags']:
-                    mq_user = user['name']
-                    mq_pass = user['password']
-                    break
+            user_config = find_mq_service_user(mq_tag, rmq_config)
+            if user_config:
+                mq_user = user_config['user']
+                mq_pass = user_config['password']
 
     # Interactively configure MQ authentication
     user_config = {"user": mq_user, "password": mq_pass}
@@ -458,53 +672,39 @@ def _get_mq_service_user_config(mq_user: Optional[str], mq_pass: Optional[str],
     return user_config
 
 
+def build_chatbots_mq_config(rmq_config: Optional[str] = None,
+                             auth_config: Optional[str] = None) -> dict:
+    """
+    Build MQ config for chatbots.
+    @param rmq_config: Path to RabbitMQ configuration file to import chatbot
+        user passwords from. If None, passwords are left empty
+    @param auth_config: Optional path to backend `diana.yaml` to read hashed
+        users' passwords from
+    @returns: dict configuration for chatbots
+    """
+    from neon_diana_utils.mq_auth import MQAuthIndex, CHATBOT_USERS
+    index = MQAuthIndex.from_file(rmq_config, auth_config) if rmq_config \
+        else MQAuthIndex()
+    users = dict()
+    for user in CHATBOT_USERS:
+        auth = {"user": user, "password": index.password(user) or ""}
+        for service in index.services(user):
+            users[service] = dict(auth)
+    return {"MQ": {"server": "neon-rabbitmq",
+                   "port": 5672,
+                   "users": users}}
+
+
 def _get_chatbots_mq_config(rmq_config: str) -> dict:
     """
     Get MQ config for chatbots.
     @param rmq_config: Path to RabbitMQ configuration file to import
     @returns: dict configuration for chatbots
     """
-    # Define default user mappings and MQ config
-    mq_map_file = join(dirname(__file__), "templates", "mq_user_mapping.yml")
-    chatbot_config = {"server": "neon-rabbitmq",
-                      "port": 5672,
-                      "users": {}}
-    with open(mq_map_file) as f:
-        mq_mapping = yaml.safe_load(f)
-    subminds = mq_mapping['neon_bot_submind']
-    facilitators = mq_mapping['neon_bot_facilitator']
-    for user in subminds:
-        chatbot_config['users'][user] = {"user": "neon_bot_submind",
-                                         "password": ""}
-    for user in facilitators:
-        chatbot_config['users'][user] = {"user": "neon_bot_facilitator",
-                                         "password": ""}
     if not click.confirm(f"Import Chatbot users from {rmq_config}?"):
         click.echo("Chatbot user passwords will need to be manually configured")
-        return {"MQ": chatbot_config}
-
-    with open(rmq_config) as f:
-        config = json.load(f)
-
-    # Get auth from MQ config
-    submind_pass = ""
-    facilitator_pass = ""
-    for user in config['users']:
-        if user['name'] == 'neon_bot_submind':
-            submind_pass = user['password']
-        if user['name'] == 'neon_bot_facilitator':
-            facilitator_pass = user['password']
-
-    # Update MQ config for chatbot users with MQ auth
-    for user in chatbot_config['users']:
-        if chatbot_config['users'][user]['user'] == 'neon_bot_submind':
-            chatbot_config['users'][user]['password'] = submind_pass
-        elif chatbot_config['users'][user]['user'] == 'neon_bot_facilitator':
-            chatbot_config['users'][user]['password'] = facilitator_pass
-        else:
-            LOG.warning(f"Unknown user: {user}")
-
-    return {"MQ": chatbot_config}
+        return build_chatbots_mq_config()
+    return build_chatbots_mq_config(rmq_config)
 
 
 def _get_unconfigured_mq_backend_services(config: dict) -> Set[str]:
@@ -562,6 +762,202 @@ def _read_backend_domain(deploy_path: str) -> str:
     return root_domain
 
 
+def _get_rmq_config_path(output_path: str,
+                         orchestrator: Orchestrator) -> str:
+    """
+    Get the path to the RabbitMQ configuration in a backend deployment
+    @param output_path: directory backend definitions are written to
+    @param orchestrator: Container orchestrator the backend is configured for
+    """
+    if orchestrator == Orchestrator.COMPOSE:
+        return join(output_path, "xdg", "config", "rabbitmq", "rabbitmq.json")
+    return join(output_path, "diana-backend", "rabbitmq.json")
+
+
+def _get_diana_config_path(output_path: str,
+                           orchestrator: Orchestrator) -> str:
+    """
+    Get the path to the backend configuration (`diana.yaml`) in a backend
+    deployment
+    @param output_path: directory backend definitions are written to
+    @param orchestrator: Container orchestrator the backend is configured for
+    """
+    if orchestrator == Orchestrator.COMPOSE:
+        return join(output_path, "xdg", "config", "neon", "diana.yaml")
+    return join(output_path, "diana-backend", "diana.yaml")
+
+
+def write_backend_config(output_path: str,
+                         keys_config: dict,
+                         rmq_username: str,
+                         rmq_password: str,
+                         orchestrator: Orchestrator = Orchestrator.KUBERNETES,
+                         github_username: str = "",
+                         github_token: str = "",
+                         email: str = "",
+                         domain: str = "",
+                         tag: str = "latest",
+                         disable_optional_http: bool = False,
+                         llm_config: Optional[dict] = None,
+                         google_credential: Optional[str] = None,
+                         link_mode: LinkMode = LinkMode.AUTO,
+                         rmq_passwords: Optional[Dict[str, str]] = None,
+                         service_sizing: Optional[dict] = None,
+                         autoscaling: Optional[Dict[str, dict]] = None,
+                         credentials: Optional[CredentialService] = None,
+                         hashing_algorithm: Optional[str] = None) -> dict:
+    """
+    Write DIANA backend definitions without prompting for any input
+    @param output_path: directory to write output definitions to
+    @param keys_config: dict API keys config, i.e. from `build_keys_config`
+    @param rmq_username: RabbitMQ Admin username to configure
+    @param rmq_password: RabbitMQ Admin password to configure
+    @param orchestrator: Container orchestrator to generate configuration for
+    @param github_username: GitHub username for private service images
+    @param github_token: GitHub token with `read:packages` permission
+    @param email: Email address for SSL Certificates
+    @param domain: Root domain for HTTP services
+    @param tag: Image tag to use for MQ Services
+    @param disable_optional_http: if True, disable optional HTTP services
+    @param llm_config: dict LLM personas config, i.e. from
+        `build_llm_bot_config`
+    @param google_credential: Path to Google credential file to include
+    @param link_mode: How to materialize unmodified template files
+    @param rmq_passwords: Optional dict of RabbitMQ username to existing
+        password, i.e. when regenerating an existing deployment
+    @param service_sizing: Optional replicas and resources for backend
+        services, i.e. from `sizing.size_backend` (Kubernetes only)
+    @param autoscaling: Optional dict of MQ service name to kwargs for
+        `sizing.queue_autoscaling` (Kubernetes only). If any MQ service is
+        autoscaled, a `monitoring` RabbitMQ user is added for KEDA
+    @param credentials: service to get generated RabbitMQ passwords from
+    @param hashing_algorithm: Optional RabbitMQ hashing algorithm (i.e.
+        `rabbit_password_hashing_sha256`) to write user password hashes with
+        instead of plaintext passwords. Service passwords are then only
+        written to the MQ auth config in `diana.yaml`
+    @returns: dict MQ auth config for services
+    """
+    disabled_mq_services = list(
+        _get_unconfigured_mq_backend_services(keys_config))
+    keda_password = None
+
+    with AtomicBatch():
+        if orchestrator == Orchestrator.KUBERNETES:
+            materialize_tree(join(dirname(__file__), "templates", "backend"),
+                             join(output_path, "diana-backend"), link_mode,
+                             exclude=("values.yaml",))
+            diana_config = join(output_path, "diana-backend", "diana.yaml")
+
+            # Do Helm configuration
+            from neon_diana_utils.kubernetes_utils import \
+                get_github_encoded_auth
+            # Generate GH Auth config secret
+            encoded_token = get_github_encoded_auth(github_username or "",
+                                                    github_token or "")
+            if not github_token:
+                to_disable = ['neon-brands-service', 'neon-script-parser']
+                disabled_mq_services += to_disable
+            LOG.info(f"Disabled MQ services: {disabled_mq_services}")
+
+            if disable_optional_http:
+                disabled_http_services = _get_optional_http_backend()
+                LOG.info(f"Disabled HTTP services: {disabled_http_services}")
+            else:
+                disabled_http_services = set()
+
+            # Generate values.yaml with configured params
+            values_file = join(output_path, "diana-backend", "values.yaml")
+            helm_values = load_template(join("backend", "values.yaml"))
+            helm_values['backend']['letsencrypt']['email'] = email
+            helm_values['backend']['diana-http']['domain'] = domain
+            helm_values['backend']['ghTokenEncoded'] = encoded_token
+            for service in disabled_mq_services:
+                LOG.debug(f"Disable {service}")
+                helm_values['backend']['diana-mq'][service]['replicaCount'] = 0
+            for service in disabled_http_services:
+                LOG.debug(f"Disable {service}")
+                http_values = helm_values['backend']['diana-http']
+                http_values.setdefault(service, dict())
+                http_values[service]['replicaCount'] = 0
+            for service in helm_values['backend']['diana-mq']:
+                helm_values['backend']['diana-mq'][service]['image']['tag'] = \
+                    tag
+            helm_values['backend']['diana-http']['endpoint-hana']['image'][
+                'tag'] = tag
+            if service_sizing or autoscaling:
+                from neon_diana_utils.sizing import apply_sizing, \
+                    queue_autoscaling
+                apply_sizing(helm_values['backend'], service_sizing)
+                apply_sizing(helm_values['backend'], {'diana-mq': {
+                    service: queue_autoscaling(**options) for
+                    service, options in (autoscaling or dict()).items()}})
+            if any((values.get('autoscaling') or dict()).get('enabled')
+                   for values in helm_values['backend']['diana-mq'].values()):
+                # Management API credentials for KEDA queue length scalers
+                from urllib.parse import quote
+                keda_password = (rmq_passwords or dict()).get(KEDA_MQ_USER) \
+                    or (credentials or get_default_credentials()
+                        ).get_or_create([f"rabbitmq/{KEDA_MQ_USER}"])[
+                        f"rabbitmq/{KEDA_MQ_USER}"]
+                helm_values['backend']['kedaRabbitMQHost'] = \
+                    f"http://{KEDA_MQ_USER}:" \
+                    f"{quote(keda_password, safe='')}@neon-rabbitmq:15672/"
+            with atomic_write(values_file) as f:
+                yaml.safe_dump(helm_values, f)
+        elif orchestrator == Orchestrator.COMPOSE:
+            if service_sizing or autoscaling:
+                LOG.warning("Service sizing and autoscaling are not "
+                            "supported for docker-compose")
+            materialize_tree(join(dirname(__file__), "docker", "backend"),
+                             output_path, link_mode, copy=(".env", "xdg"))
+            update_env_file(join(output_path, ".env"))
+            diana_config = join(output_path, "xdg", "config", "neon",
+                                "diana.yaml")
+        else:
+            raise RuntimeError(f"{orchestrator} is not yet supported")
+
+        # Generate RabbitMQ config
+        rmq_file = _get_rmq_config_path(output_path, orchestrator)
+        rmq_config = generate_rmq_config(rmq_username, rmq_password,
+                                         passwords=rmq_passwords,
+                                         credentials=credentials)
+        if keda_password:
+            add_monitoring_user(rmq_config, KEDA_MQ_USER, keda_password)
+        # Generate MQ Auth config from plaintext passwords
+        mq_auth_config = generate_mq_auth_config(rmq_config)
+        LOG.info(f"Generated auth for services: {set(mq_auth_config.keys())}")
+
+        if hashing_algorithm:
+            from neon_diana_utils.rabbitmq_definitions import \
+                hash_user_passwords, iter_definitions_section
+            existing = None
+            if isfile(rmq_file):
+                with open(rmq_file) as f:
+                    existing = list(iter_definitions_section(f, 'users'))
+            rmq_config = hash_user_passwords(rmq_config, hashing_algorithm,
+                                             existing)
+        makedirs(dirname(rmq_file), exist_ok=True)
+        with atomic_write(rmq_file) as f:
+            json.dump(rmq_config, f, indent=2)
+        LOG.info(f"Generated RabbitMQ config at {rmq_file}")
+
+        # Generate `diana.yaml` output
+        if google_credential:
+            with open(expanduser(google_credential), 'rb') as src, \
+                    atomic_write(join(dirname(diana_config), "google.json"),
+                                 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        config = {**{"MQ": {"users": mq_auth_config,
+                            "server": "neon-rabbitmq",
+                            "port": 5672}},
+                  **keys_config,
+                  **(llm_config or dict())}
+        LOG.info(f"Writing configuration to {diana_config}")
+        with atomic_write(diana_config) as f:
+            yaml.dump(config, f)
+    return mq_auth_config
+
+
 def configure_backend(username: str = None,
                       password: str = None,
                       output_path: str = None,
@@ -587,26 +983,19 @@ def configure_backend(username: str = None,
     disabled_mq_services = list(
         _get_unconfigured_mq_backend_services(keys_config))
 
+    helm_options = dict()
     if orchestrator == Orchestrator.KUBERNETES:
-        shutil.copytree(join(dirname(__file__), "templates", "backend"),
-                        join(output_path, "diana-backend"))
-        rmq_file = join(output_path, "diana-backend", "rabbitmq.json")
-        diana_config = join(output_path, "diana-backend", "diana.yaml")
-
-        # Do Helm configuration
-        from neon_diana_utils.kubernetes_utils import get_github_encoded_auth
         # Generate GH Auth config secret
         if click.confirm("Configure GitHub token for private services?"):
             gh_username = click.prompt("GitHub username", type=str)
             gh_token = click.prompt("GitHub Token with `read:packages` "
                                     "permission", type=str)
-            encoded_token = get_github_encoded_auth(gh_username, gh_token)
+            helm_options['github_username'] = gh_username
+            helm_options['github_token'] = gh_token
             click.echo(f"Parsed GH token for {gh_username}")
         else:
-            # Define a default value so secret can be generated
-            encoded_token = get_github_encoded_auth("", "")
-            to_disable = ['neon-brands-service', 'neon-script-parser']
-            disabled_mq_services += to_disable
+            disabled_mq_services += ['neon-brands-service',
+                                     'neon-script-parser']
         confirmed = False
         email = ''
         domain = ''
@@ -622,84 +1011,61 @@ def configure_backend(username: str = None,
                                 'domain': domain,
                                 'tag': tag}))
             confirmed = click.confirm("Is this configuration correct?")
+        helm_options.update({'email': email, 'domain': domain, 'tag': tag})
 
         click.echo(f"The following MQ services are disabled: "
                    f"{disabled_mq_services}")
 
         if click.confirm(f"Disable optional HTTP Services?"):
-            disabled_http_services = _get_optional_http_backend()
+            helm_options['disable_optional_http'] = True
             click.echo(f"The following HTTP services are disabled: "
-                       f"{disabled_http_services}")
-        else:
-            disabled_http_services = set()
-
-        # Generate values.yaml with configured params
-        values_file = join(output_path, "diana-backend", "values.yaml")
-        with open(values_file, 'r') as f:
-            helm_values = yaml.safe_load(f)
-        helm_values['backend']['letsencrypt']['email'] = email
-        helm_values['backend']['diana-http']['domain'] = domain
-        helm_values['backend']['ghTokenEncoded'] = encoded_token
-        for service in disabled_mq_services:
-            LOG.debug(f"Disable {service}")
-            helm_values['backend']['diana-mq'][service]['replicaCount'] = 0
-        for service in disabled_http_services:
-            LOG.debug(f"Disable {service}")
-            helm_values['backend']['diana-http'].setdefault(service, dict())
-            helm_values['backend']['diana-http'][service]['replicaCount'] = 0
-        for service in helm_values['backend']['diana-mq']:
-            helm_values['backend']['diana-mq'][service]['image']['tag'] = \
-                tag
-        helm_values['backend']['diana-http']['endpoint-hana']['image']['tag'] \
-            = tag
-        with open(values_file, 'w') as f:
-            yaml.safe_dump(helm_values, f)
-    elif orchestrator == Orchestrator.COMPOSE:
-        shutil.copytree(join(dirname(__file__), "docker", "backend"),
-                        output_path)
-        update_env_file(join(output_path, ".env"))
-        rmq_file = join(output_path, "xdg", "config", "rabbitmq",
-                        "rabbitmq.json")
-        diana_config = join(output_path, "xdg", "config", "neon", "diana.yaml")
-    else:
+                       f"{_get_optional_http_backend()}")
+
+        llm_services = [s for s in ('neon-llm-chatgpt', 'neon-llm-fastchat',
+                                    'neon-llm-claude', 'neon-llm-gemini',
+                                    'neon-llm-palm')
+                        if s not in disabled_mq_services]
+        if llm_services and click.confirm("Autoscale LLM services on queue "
+                                          "length? (requires KEDA)",
+                                          default=False):
+            autoscaling = dict()
+            for service in llm_services:
+                min_replicas = click.prompt(f"Minimum replicas for {service}",
+                                            type=int, default=1)
+                max_replicas = click.prompt(f"Maximum replicas for {service}",
+                                            type=int, default=3)
+                target = click.prompt(f"Target queue length for {service}",
+                                      type=int, default=5)
+                autoscaling[service] = {'min_replicas': min_replicas,
+                                        'max_replicas': max_replicas,
+                                        'target_queue_length': target}
+            helm_options['autoscaling'] = autoscaling
+    elif orchestrator != Orchestrator.COMPOSE:
         raise RuntimeError(f"{orchestrator} is not yet supported")
     try:
-        # Generate RabbitMQ config
         username = username or click.prompt("RabbitMQ Admin Username", type=str)
         password = password or click.prompt("RabbitMQ Admin Password", type=str,
                                             hide_input=True)
-        rmq_config = generate_rmq_config(username, password, rmq_file)
-        click.echo(f"Generated RabbitMQ config at {rmq_file}")
-
-        # Generate MQ Auth config
-        mq_auth_config = generate_mq_auth_config(rmq_config)
-        click.echo(f"Generated auth for services: {set(mq_auth_config.keys())}")
-
-        # Generate `diana.yaml` output
         if keys_config.get("LLM_CHAT_GPT"):
             llm_config = make_llm_bot_config()
         else:
             llm_config = dict()
         # Check if google.json file is expected
+        google_credential = None
         if any((keys_config['LLM_PALM2'], keys_config['LLM_GEMINI'])):
-            handled = False
-            while not handled:
+            while not google_credential:
                 cred = click.prompt("Path to Google credential file", type=str)
                 cred = expanduser(cred)
                 if not isfile(cred):
                     click.echo(f"Invalid path ({cred}). Please, try again.")
                 else:
-                    shutil.copyfile(cred, join(dirname(diana_config),
-                                               "google.json"))
-                    handled = True
-        config = {**{"MQ": {"users": mq_auth_config,
-                            "server": "neon-rabbitmq",
-                            "port": 5672}},
-                  **keys_config,
-                  **llm_config}
-        click.echo(f"Writing configuration to {diana_config}")
-        with open(diana_config, 'w+') as f:
-            yaml.dump(config, f)
+                    google_credential = cred
+
+        mq_auth_config = write_backend_config(
+            output_path, keys_config, username, password, orchestrator,
+            llm_config=llm_config, google_credential=google_credential,
+            **helm_options)
+        click.echo(f"Generated auth for services: {set(mq_auth_config.keys())}")
         click.echo(f"Outputs generated in {output_path}")
 
         # Prompt to continue to Neon Core config
@@ -710,7 +1076,8 @@ def configure_backend(username: str = None,
 
         # Prompt to continue to Chatbots config
         if click.confirm("Configure Chatbots?"):
-            configure_chatbots(rmq_file, output_path, False, orchestrator)
+            configure_chatbots(_get_rmq_config_path(output_path, orchestrator),
+                               output_path, False, orchestrator)
 
         # TODO: Prompt for Klat deployment?
 
@@ -718,6 +1085,39 @@ def configure_backend(username: str = None,
         click.echo(e)
 
 
+def write_chatbots_config(output_path: str,
+                          rmq_config: str,
+                          orchestrator: Orchestrator = Orchestrator.KUBERNETES,
+                          update_rmq: bool = False,
+                          import_users: bool = True,
+                          link_mode: LinkMode = LinkMode.AUTO):
+    """
+    Write Chatbots definitions without prompting for any input
+    @param output_path: directory to write output definitions to
+    @param rmq_config: Path to RabbitMQ configuration file
+    @param orchestrator: Container orchestrator to generate configuration for
+    @param update_rmq: if True, update RabbitMQ config to add chatbot-related
+        users, vhosts, etc.
+    @param import_users: if True, import chatbot user passwords from
+        `rmq_config`
+    @param link_mode: How to materialize unmodified template files
+    """
+    if orchestrator == Orchestrator.KUBERNETES:
+        materialize_tree(join(dirname(__file__), "templates", "chatbots"),
+                         join(output_path, "chatbots"), link_mode)
+    else:
+        raise RuntimeError(f"{orchestrator} is not yet supported")
+
+    if update_rmq:
+        update_rmq_config(rmq_config)
+        LOG.info(f"Updated RabbitMQ config file: {rmq_config}")
+    chatbots_config = build_chatbots_mq_config(
+        rmq_config if import_users else None,
+        _get_diana_config_path(output_path, orchestrator))
+    with atomic_write(join(output_path, "chatbots", "chatbots.yaml")) as f:
+        yaml.safe_dump(chatbots_config, f)
+
+
 def configure_chatbots(rmq_path: str = None,
                        output_path: str = None,
                        prompt_update_rmq: bool = True,
@@ -737,24 +1137,119 @@ def configure_chatbots(rmq_path: str = None,
         click.echo(f"Path exists: {output_path}")
         return
     try:
-        if orchestrator == Orchestrator.KUBERNETES:
-            shutil.copytree(join(dirname(__file__), "templates", "chatbots"),
-                            join(output_path, "chatbots"))
-        else:
+        if orchestrator != Orchestrator.KUBERNETES:
             raise RuntimeError(f"{orchestrator} is not yet supported")
-
-        if prompt_update_rmq and click.confirm("Configure RabbitMQ for chatbots?"):
-            update_rmq_config(rmq_config)
-            click.echo(f"Updated RabbitMQ config file: {rmq_config}")
-        chatbots_config = _get_chatbots_mq_config(rmq_config)
-        with open(join(output_path, "chatbots", "chatbots.yaml"), 'w+') as f:
-            yaml.safe_dump(chatbots_config, f)
+        update_rmq = prompt_update_rmq and \
+            click.confirm("Configure RabbitMQ for chatbots?")
+        if click.confirm(f"Import Chatbot users from {rmq_config}?"):
+            import_rmq_config = rmq_config
+        else:
+            click.echo("Chatbot user passwords will need to be manually "
+                       "configured")
+            import_rmq_config = None
+        write_chatbots_config(output_path, rmq_config, orchestrator,
+                              update_rmq, import_rmq_config is not None)
         click.echo(f"Outputs generated in {output_path}")
 
     except Exception as e:
         click.echo(e)
 
 
+def write_neon_core_config(output_path: str,
+                           mq_user: Optional[str],
+                           mq_pass: Optional[str],
+                           orchestrator: Orchestrator =
+                           Orchestrator.KUBERNETES,
+                           tag: str = "latest",
+                           iris_domain: Optional[str] = None,
+                           link_mode: LinkMode = LinkMode.AUTO) -> str:
+    """
+    Write Neon Core definitions without prompting for any input
+    @param output_path: directory to write output definitions to
+    @param mq_user: RabbitMQ Neon username to configure
+    @param mq_pass: RabbitMQ Neon password to configure
+    @param orchestrator: Container orchestrator to generate configuration for
+    @param tag: Image tag to use for Neon Core Services
+    @param iris_domain: Hostname for Iris Gradio Web UI; if None, the UI is
+        disabled
+    @param link_mode: How to materialize unmodified template files
+    @returns: path to written Neon configuration
+    """
+    with AtomicBatch():
+        if orchestrator == Orchestrator.KUBERNETES:
+            materialize_tree(join(dirname(__file__), "templates", "neon"),
+                             join(output_path, "neon-core"), link_mode,
+                             exclude=("values.yaml",))
+            neon_config_file = join(output_path, "neon-core", "neon.yaml")
+
+            values = join(output_path, "neon-core", "values.yaml")
+            config = load_template(join("neon", "values.yaml"))
+            for service in {'neon-messagebus', 'neon-speech', 'neon-skills',
+                            'neon-audio', 'neon-enclosure', 'neon-gui',
+                            'iris-gradio'}:
+                config['core'][service]['image']['tag'] = tag
+
+            if iris_domain:
+                iris_subdomain, iris_domain = iris_domain.split('.', 1)
+                config['core']['domain'] = iris_domain
+                config['core']['ingress']['rules'].append(
+                    {'host': iris_subdomain, 'serviceName': 'neon-core-iris',
+                     'servicePort': 7860})
+            else:
+                LOG.info("iris Gradio UI disabled")
+                config['core']['iris-gradio']['replicaCount'] = 0
+
+            if not config['core']['ingress']['rules']:
+                LOG.info('No HTTP ingress configured')
+                config['core']['ingress']['enabled'] = False
+            with atomic_write(values) as f:
+                yaml.safe_dump(config, f)
+        elif orchestrator == Orchestrator.COMPOSE:
+            materialize_tree(join(dirname(__file__), "docker", "neon_core"),
+                             output_path, link_mode, copy=(".env", "xdg"))
+            update_env_file(join(output_path, ".env"))
+            neon_config_file = join(output_path, "xdg", "config", "neon",
+                                    "neon.yaml")
+        else:
+            raise RuntimeError(f"{orchestrator} is not yet supported")
+
+        if not all((mq_user, mq_pass)):
+            # TODO: Configure MQ server/port?
+            mq_config = dict()
+        else:
+            mq_config = {"users": {"neon_chat_api": {"user": mq_user,
+                                                     "password": mq_pass}},
+                         "server": "neon-rabbitmq", "port": 5672}
+        # Build default Neon config
+        neon_config = {
+            "websocket": {"host": "neon-core-messagebus",
+                          "shared_connection": True},
+            "gui_websocket": {"host": "neon-core-gui"},
+            "gui": {"server_path": "/xdg/data/neon/gui_files"},
+            "ready_settings": ["skills", "voice", "audio", "gui_service"],
+            "listener": {"enable_voice_loop": False},
+            "stt": {"module": "neon-stt-plugin-nemo-remote",
+                    "neon-stt-plugin-nemo-remote": {
+                        "url": "http://backend-nemo:4430"}},
+            "tts": {"module": "neon-tts-plugin-coqui-remote",
+                    "neon-tts-plugin-coqui-remote": {
+                        "url": "http://backend-coqui:4430"}},
+            "skills": {"blacklisted_skills": [
+                "skill-local_music.neongeckocom",
+                "skill-device_controls.neongeckocom",
+                "skill-update.neongeckocom",
+                "neon_homeassistant_skill.mikejgray",
+                "skill-homescreen-lite.openvoiceos"]},
+            "MQ": mq_config,
+            "iris": {"languages": ["en-us", "uk-ua"]},
+            "log_level": "DEBUG"
+        }
+        LOG.info(f"Writing configuration to {neon_config_file}")
+        with atomic_write(neon_config_file) as f:
+            yaml.dump(neon_config, f)
+    return neon_config_file
+
+
 def configure_neon_core(mq_user: str = None,
                         mq_pass: str = None,
                         output_path: str = None,
@@ -789,10 +1284,6 @@ def configure_neon_core(mq_user: str = None,
             confirmed = click.confirm(f"Is {iris_domain} correct?")
 
     if orchestrator == Orchestrator.KUBERNETES:
-        shutil.copytree(join(dirname(__file__), "templates", "neon"),
-                        join(output_path, "neon-core"))
-        neon_config_file = join(output_path, "neon-core", "neon.yaml")
-
         # Determine image tag to use
         tag = 'latest'
         confirmed = False
@@ -800,35 +1291,10 @@ def configure_neon_core(mq_user: str = None,
             tag = click.prompt("Image tags to use for Neon Core Services",
                                type=str, default=tag)
             confirmed = click.confirm(f"Is `{tag}` correct?")
-        values = join(output_path, "neon-core", "values.yaml")
-        with open(values, "r") as f:
-            config = yaml.safe_load(f)
-        for service in {'neon-messagebus', 'neon-speech', 'neon-skills',
-                        'neon-audio', 'neon-enclosure', 'neon-gui',
-                        'iris-gradio'}:
-            config['core'][service]['image']['tag'] = tag
-
-        if iris_domain:
-            iris_subdomain, iris_domain = iris_domain.split('.', 1)
-            config['core']['domain'] = iris_domain
-            config['core']['ingress']['rules'].append(
-                {'host': iris_subdomain, 'serviceName': 'neon-core-iris',
-                 'servicePort': 7860})
-        else:
+        if not iris_domain:
             click.echo("iris Gradio UI disabled")
-            config['core']['iris-gradio']['replicaCount'] = 0
-
-        if not config['core']['ingress']['rules']:
-            click.echo('No HTTP ingress configured')
-            config['core']['ingress']['enabled'] = False
-        with open(values, 'w') as f:
-            yaml.safe_dump(config, f)
     elif orchestrator == Orchestrator.COMPOSE:
-        shutil.copytree(join(dirname(__file__), "docker", "neon_core"),
-                        output_path)
-        update_env_file(join(output_path, ".env"))
-        neon_config_file = join(output_path, "xdg", "config", "neon",
-                                "neon.yaml")
+        tag = None
     else:
         raise RuntimeError(f"{orchestrator} is not yet supported")
 
@@ -836,39 +1302,10 @@ def configure_neon_core(mq_user: str = None,
         # Get MQ User Configuration
         user_config = _get_mq_service_user_config(mq_user, mq_pass, "core",
                                                   rmq_config)
-        if not all((user_config['user'], user_config['password'])):
-            # TODO: Prompt to configure MQ server/port?
-            mq_config = dict()
-        else:
-            mq_config = {"users": {"neon_chat_api": user_config},
-                         "server": "neon-rabbitmq", "port": 5672}
-        # Build default Neon config
-        neon_config = {
-            "websocket": {"host": "neon-core-messagebus",
-                          "shared_connection": True},
-            "gui_websocket": {"host": "neon-core-gui"},
-            "gui": {"server_path": "/xdg/data/neon/gui_files"},
-            "ready_settings": ["skills", "voice", "audio", "gui_service"],
-            "listener": {"enable_voice_loop": False},
-            "stt": {"module": "neon-stt-plugin-nemo-remote",
-                    "neon-stt-plugin-nemo-remote": {
-                        "url": "http://backend-nemo:4430"}},
-            "tts": {"module": "neon-tts-plugin-coqui-remote",
-                    "neon-tts-plugin-coqui-remote": {
-                        "url": "http://backend-coqui:4430"}},
-            "skills": {"blacklisted_skills": [
-                "skill-local_music.neongeckocom",
-                "skill-device_controls.neongeckocom",
-                "skill-update.neongeckocom",
-                "neon_homeassistant_skill.mikejgray",
-                "skill-homescreen-lite.openvoiceos"]},
-            "MQ": mq_config,
-            "iris": {"languages": ["en-us", "uk-ua"]},
-            "log_level": "DEBUG"
-        }
-        click.echo(f"Writing configuration to {neon_config_file}")
-        with open(neon_config_file, 'w+') as f:
-            yaml.dump(neon_config, f)
+        neon_config_file = write_neon_core_config(
+            output_path, user_config['user'], user_config['password'],
+            orchestrator, tag, iris_domain)
+        click.echo(f"Wrote configuration to {neon_config_file}")
         click.echo(f"Outputs generated in {output_path}")
     except Exception as e:
         click.echo(e)
@@ -925,7 +1362,6 @@ def configure_klat_chat(external_url: str = None,
         api_url = click.prompt("Klat API URL", type=str,
                                default=api_url)
         confirmed = click.confirm(f"Is '{api_url}' correct?")
-    api_subdomain = api_url.split('://', 1)[1].split('.', 1)[0]
 
     forward_www = False
     if subdomain != "www":
@@ -939,9 +1375,6 @@ def configure_klat_chat(external_url: str = None,
                                default=libretranslate_url)
         confirmed = click.confirm(f"Is '{libretranslate_url}' correct?")
 
-    # Validate https URL
-    https = external_url.startswith("https")
-
     # Confirm MongoDB host/port
     confirmed = False
     while not confirmed:
@@ -967,7 +1400,6 @@ def configure_klat_chat(external_url: str = None,
                         "database": mongo_database}
         click.echo(pformat(mongo_config))
         confirmed = click.confirm("Is this configuration correct?")
-    mongo_config['dialect'] = 'mongo'
 
     # Configure SFTP
     confirmed = False
@@ -986,9 +1418,49 @@ def configure_klat_chat(external_url: str = None,
         click.echo(pformat(sftp_config))
         confirmed = click.confirm("Is this configuration correct?")
 
+    write_klat_config(output_path, external_url, api_url, mongo_config,
+                      sftp_config, user_config, forward_www,
+                      libretranslate_url, orchestrator)
+    click.echo(f"Wrote Klat configuration to {output_path}")
+
+
+def write_klat_config(output_path: str,
+                      external_url: str,
+                      api_url: str,
+                      mongo_config: dict,
+                      sftp_config: dict,
+                      mq_user_config: dict,
+                      forward_www: bool = False,
+                      libretranslate_url: str =
+                      "https://libretranslate.2022.us",
+                      orchestrator: Orchestrator = Orchestrator.KUBERNETES,
+                      link_mode: LinkMode = LinkMode.AUTO) -> str:
+    """
+    Write Klat chat definitions without prompting for any input
+    @param output_path: directory to write output definitions to
+    @param external_url: Klat Client URL
+    @param api_url: Klat API URL
+    @param mongo_config: dict MongoDB `host`, `port`, `username`, `password`,
+        and `database`
+    @param sftp_config: dict SFTP `HOST`, `PORT`, `USERNAME`, `PASSWORD`, and
+        `ROOT_PATH`
+    @param mq_user_config: dict RabbitMQ Klat observer `user` and `password`
+    @param forward_www: if True, route www.<domain> traffic to Klat
+    @param libretranslate_url: Libretranslate API URL
+    @param orchestrator: Container orchestrator to generate configuration for
+    @param link_mode: How to materialize unmodified template files
+    @returns: path to written Klat configuration
+    """
+    if not external_url.startswith("http"):
+        external_url = f"https://{external_url}"
+    subdomain, domain = external_url.split('://', 1)[1].split('.', 1)
+    api_subdomain = api_url.split('://', 1)[1].split('.', 1)[0]
+    https = external_url.startswith("https")
+    mongo_config = {**mongo_config, 'dialect': 'mongo'}
+
     # Define klat.yaml config
     config = {"SIO_URL": api_url,
-              "MQ": {"users": {"chat_observer": user_config},
+              "MQ": {"users": {"chat_observer": mq_user_config},
                      "server": "neon-rabbitmq",
                      "port": 5672},
               "CHAT_CLIENT": {"SERVER_URL": api_url,
@@ -1008,38 +1480,42 @@ def configure_klat_chat(external_url: str = None,
                               },
               "DATABASE_CONFIG": mongo_config}
 
-    if orchestrator == Orchestrator.KUBERNETES:
-        shutil.copytree(join(dirname(__file__), "templates", "klat"),
-                        join(output_path, "klat-chat"))
-        klat_config_file = join(output_path, "klat-chat", "klat.yaml")
-        # Update Helm values with configured URL
-        with open(join(output_path, "klat-chat", "values.yaml"), 'r') as f:
-            helm_values = yaml.safe_load(f)
-        admin_subdomain = "klatadmin"  # TODO: Allow user override
-        helm_values['klat']['domain'] = domain
-        helm_values['klat']['clientSubdomain'] = subdomain
-        helm_values['klat']['serverSubdomain'] = api_subdomain
-        helm_values['klat']['adminSubdomain'] = admin_subdomain
-        helm_values['klat']['images']['tag'] = 'dev'  # TODO: Get user config
-        helm_values['klat']['ingress']['rules'] = [
-            {'host': subdomain, 'serviceName': 'klat-chat-client',
-             'servicePort': 8001},
-            {'host': api_subdomain, 'serviceName': 'klat-chat-server',
-             'servicePort': 8010},
-            {'host': admin_subdomain, 'serviceName': 'klat-chat-admin',
-             'servicePort': 3000}
-        ]
-        if forward_www:
-            helm_values['klat']['ingress']['rules'].append(
-                {'host': 'www', 'serviceName': 'klat-chat-client',
-                 'servicePort': 8001}
-            )
-        with open(join(output_path, "klat-chat", "values.yaml"), 'w') as f:
-            yaml.safe_dump(helm_values, f)
-    else:
-        raise RuntimeError(f"{orchestrator} is not yet supported")
+    with AtomicBatch():
+        if orchestrator == Orchestrator.KUBERNETES:
+            materialize_tree(join(dirname(__file__), "templates", "klat"),
+                             join(output_path, "klat-chat"), link_mode,
+                             exclude=("values.yaml",))
+            klat_config_file = join(output_path, "klat-chat", "klat.yaml")
+            # Update Helm values with configured URL
+            helm_values = load_template(join("klat", "values.yaml"))
+            admin_subdomain = "klatadmin"  # TODO: Allow user override
+            helm_values['klat']['domain'] = domain
+            helm_values['klat']['clientSubdomain'] = subdomain
+            helm_values['klat']['serverSubdomain'] = api_subdomain
+            helm_values['klat']['adminSubdomain'] = admin_subdomain
+            # TODO: Get user config
+            helm_values['klat']['images']['tag'] = 'dev'
+            helm_values['klat']['ingress']['rules'] = [
+                {'host': subdomain, 'serviceName': 'klat-chat-client',
+                 'servicePort': 8001},
+                {'host': api_subdomain, 'serviceName': 'klat-chat-server',
+                 'servicePort': 8010},
+                {'host': admin_subdomain, 'serviceName': 'klat-chat-admin',
+                 'servicePort': 3000}
+            ]
+            if forward_www:
+                helm_values['klat']['ingress']['rules'].append(
+                    {'host': 'www', 'serviceName': 'klat-chat-client',
+                     'servicePort': 8001}
+                )
+            values_file = join(output_path, "klat-chat", "values.yaml")
+            with atomic_write(values_file) as f:
+                yaml.safe_dump(helm_values, f)
+        else:
+            raise RuntimeError(f"{orchestrator} is not yet supported")
 
-    # Write Klat configuration
-    with open(klat_config_file, 'w+') as f:
-        yaml.safe_dump(config, f)
-    click.echo(f"Wrote Klat configuration to {klat_config_file}")
+        # Write Klat configuration
+        with atomic_write(klat_config_file) as f:
+            yaml.safe_dump(config, f)
+    LOG.info(f"Wrote Klat configuration to {klat_config_file}")
+    return klat_config_file
@@ -0,0 +1,373 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Generate and store deployment credentials. Secrets are either drawn in bulk
+from a buffered `os.urandom` pool or derived deterministically from a master
+key with HKDF-SHA256, so regenerating a deployment yields the same secrets
+without storing any state. Generated secrets may be persisted to a JSON file
+or to a SQLite database with encrypted values (requires `cryptography`).
+"""
+
+import hmac
+import json
+import os
+
+from abc import ABC, abstractmethod
+from base64 import urlsafe_b64encode
+from hashlib import sha256
+from os import urandom
+from os.path import dirname, expanduser, isfile
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+from neon_diana_utils.atomic import atomic_write, get_durability
+
+ENCODINGS = ("urlsafe", "hex")
+_HKDF_INFO_PREFIX = b"neon-diana/v1\0"
+
+
+def encode_secret(raw: bytes, encoding: str = "urlsafe") -> str:
+    """
+    Encode secret bytes as text, matching `secrets.token_urlsafe` and
+    `secrets.token_hex`
+    :param raw: secret bytes
+    :param encoding: `urlsafe` or `hex`
+    """
+    if encoding == "urlsafe":
+        return urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+    if encoding == "hex":
+        return raw.hex()
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def hkdf_sha256(key: bytes, info: bytes, length: int = 32,
+                salt: bytes = b"") -> bytes:
+    """
+    Derive key material with HKDF-SHA256 (RFC 5869)
+    :param key: input key material
+    :param info: context for the derived key
+    :param length: number of bytes to derive (max 8160)
+    :param salt: optional salt
+    :returns: derived bytes
+    """
+    if not 0 < length <= 255 * 32:
+        raise ValueError(f"Invalid HKDF length: {length}")
+    prk = hmac.new(salt or b"\0" * 32, key, sha256).digest()
+    okm = b""
+    block = b""
+    for counter in range(1, -(-length // 32) + 1):
+        block = hmac.new(prk, block + info + bytes((counter,)),
+                         sha256).digest()
+        okm += block
+    return okm[:length]
+
+
+class SecretGenerator:
+    def __init__(self, pool_size: int = 4096):
+        """
+        Generates random secrets from a buffer filled by one `os.urandom`
+        read at a time. The buffer is discarded in forked child processes so
+        workers never reuse the parent's random bytes.
+        :param pool_size: minimum number of random bytes read at a time
+        """
+        self._pool_size = pool_size
+        self._pool = b""
+        self._offset = 0
+        self._pid = os.getpid()
+        self._lock = Lock()
+
+    def token_bytes(self, nbytes: int = 32) -> bytes:
+        """
+        Get random bytes from the pool, refilling it if necessary
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool, self._offset = b"", 0
+                self._pid = os.getpid()
+            if len(self._pool) - self._offset < nbytes:
+                self._pool = urandom(max(self._pool_size, nbytes))
+                self._offset = 0
+            raw = self._pool[self._offset:self._offset + nbytes]
+            self._offset += nbytes
+            return raw
+
+    def generate(self, names: Iterable[str], nbytes: int = 32,
+                 encoding: str = "urlsafe") -> Dict[str, str]:
+        """
+        Generate a random secret for each name
+        :param names: secret names
+        :param nbytes: bytes of entropy per secret
+        :param encoding: `urlsafe` or `hex`
+        :returns: dict of name to secret
+        """
+        names = list(names)
+        raw = self.token_bytes(nbytes * len(names))
+        return {name: encode_secret(raw[idx * nbytes:(idx + 1) * nbytes],
+                                    encoding)
+                for idx, name in enumerate(names)}
+
+
+class DerivedSecretGenerator:
+    def __init__(self, master_key: bytes, context: str = ""):
+        """
+        Derives secrets from a master key, so the same names always yield
+        the same secrets. Secrets for different contexts (i.e. tenants) are
+        independent.
+        :param master_key: secret master key (at least 16 bytes)
+        :param context: optional context to derive secrets for
+        """
+        if len(master_key) < 16:
+            raise ValueError("Master key must be at least 16 bytes")
+        self._master_key = master_key
+        self.context = context
+
+    def generate(self, names: Iterable[str], nbytes: int = 32,
+                 encoding: str = "urlsafe") -> Dict[str, str]:
+        """
+        Derive a secret for each name
+        :param names: secret names
+        :param nbytes: bytes of key material per secret
+        :param encoding: `urlsafe` or `hex`
+        :returns: dict of name to secret
+        """
+        prefix = _HKDF_INFO_PREFIX + self.context.encode() + b"\0"
+        return {name: encode_secret(hkdf_sha256(self._master_key,
+                                                prefix + name.encode(),
+                                                nbytes), encoding)
+                for name in names}
+
+
+class SecretStore(ABC):
+    """
+    Base class for persistent secret storage
+    """
+    @abstractmethod
+    def get_many(self, names: Iterable[str]) -> Dict[str, str]:
+        """
+        Get stored secrets
+        :param names: secret names to look up
+        :returns: dict of name to secret for names that are stored
+        """
+
+    @abstractmethod
+    def set_many(self, values: Dict[str, str]):
+        """
+        Store secrets, replacing any existing values
+        :param values: dict of name to secret
+        """
+
+    @abstractmethod
+    def names(self) -> List[str]:
+        """
+        Get the names of all stored secrets
+        """
+
+    def close(self):
+        """
+        Release any resources held by this store
+        """
+        pass
+
+
+class FileSecretStore(SecretStore):
+    def __init__(self, path: str):
+        """
+        Stores secrets in a JSON file readable only by the current user
+        :param path: path to the secrets file
+        """
+        self.path = expanduser(path)
+        self._secrets: Optional[Dict[str, str]] = None
+
+    def _load(self) -> Dict[str, str]:
+        if self._secrets is None:
+            self._secrets = dict()
+            if isfile(self.path):
+                with open(self.path) as f:
+                    self._secrets = json.load(f)
+        return self._secrets
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, str]:
+        stored = self._load()
+        return {name: stored[name] for name in names if name in stored}
+
+    def set_many(self, values: Dict[str, str]):
+        os.makedirs(dirname(self.path) or ".", exist_ok=True)
+        # Stores may be shared by concurrent processes (i.e. fleet workers);
+        # re-read the file under an exclusive lock so no updates are lost
+        with open(f"{self.path}.lock", 'a') as lock:
+            try:
+                import fcntl
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            except ImportError:
+                pass
+            self._secrets = None
+            stored = {**self._load(), **values}
+            # Write immediately rather than with any active batch, which
+            # would only be committed after the lock is released
+            with atomic_write(self.path,
+                              durability=get_durability()) as f:
+                os.fchmod(f.fileno(), 0o600)
+                json.dump(stored, f, indent=2, sort_keys=True)
+            self._secrets = stored
+
+    def names(self) -> List[str]:
+        return list(self._load())
+
+
+class SQLiteSecretStore(SecretStore):
+    def __init__(self, path: str, key: bytes):
+        """
+        Stores secrets in a SQLite database, encrypting each value with a key
+        derived from `key`. This is a local stand-in for a secrets vault and
+        requires `cryptography` (`neon-diana-utils[crypto]`).
+        :param path: path to the database file
+        :param key: master key to derive the encryption key from
+        """
+        import sqlite3
+        from cryptography.fernet import Fernet
+        self.path = expanduser(path)
+        os.makedirs(dirname(self.path) or ".", exist_ok=True)
+        self._fernet = Fernet(urlsafe_b64encode(
+            hkdf_sha256(key, _HKDF_INFO_PREFIX + b"sqlite-store")))
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        os.chmod(self.path, 0o600)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS secrets "
+                             "(name TEXT PRIMARY KEY, value BLOB NOT NULL)")
+
+    def close(self):
+        self._db.close()
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, str]:
+        from cryptography.fernet import InvalidToken
+        names = list(names)
+        found = dict()
+        # Stay under SQLite's default limit on query parameters
+        for idx in range(0, len(names), 500):
+            chunk = names[idx:idx + 500]
+            rows = self._db.execute(
+                f"SELECT name, value FROM secrets WHERE name IN "
+                f"({','.join('?' * len(chunk))})", chunk)
+            for name, value in rows:
+                try:
+                    found[name] = self._fernet.decrypt(value).decode()
+                except InvalidToken:
+                    raise ValueError(f"Unable to decrypt {name} in "
+                                     f"{self.path}; wrong key?")
+        return found
+
+    def set_many(self, values: Dict[str, str]):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO secrets (name, value) VALUES (?, ?)",
+                [(name, self._fernet.encrypt(value.encode()))
+                 for name, value in values.items()])
+
+    def names(self) -> List[str]:
+        return [row[0] for row in
+                self._db.execute("SELECT name FROM secrets ORDER BY name")]
+
+
+class CredentialService:
+    def __init__(self, generator=None, store: Optional[SecretStore] = None,
+                 context: str = ""):
+        """
+        Get or create named secrets. Secrets already in `store` are returned
+        as-is so regenerating a deployment does not change existing
+        credentials; new secrets are generated in one batch and stored.
+        :param generator: SecretGenerator or DerivedSecretGenerator
+            (default random)
+        :param store: optional store to persist generated secrets to
+        :param context: optional context (i.e. tenant) secrets belong to.
+            Secrets are stored as `<context>/<name>`, so deployments sharing
+            a store do not share secrets
+        """
+        self.generator = generator or _DEFAULT_GENERATOR
+        self.store = store
+        self.context = context
+
+    def get_or_create(self, names: Iterable[str], nbytes: int = 32,
+                      encoding: str = "urlsafe") -> Dict[str, str]:
+        """
+        Get secrets, generating any that are not already stored
+        :param names: secret names, i.e. `rabbitmq/neon_api`
+        :param nbytes: bytes of entropy per generated secret
+        :param encoding: `urlsafe` or `hex`
+        :returns: dict of name to secret
+        """
+        names = list(dict.fromkeys(names))
+        prefix = f"{self.context}/" if self.context else ""
+        existing = dict()
+        if self.store:
+            existing = {key[len(prefix):]: value for key, value in
+                        self.store.get_many(f"{prefix}{name}"
+                                            for name in names).items()}
+        missing = [name for name in names if name not in existing]
+        created = self.generator.generate(missing, nbytes, encoding) \
+            if missing else dict()
+        if created and self.store:
+            self.store.set_many({f"{prefix}{name}": value
+                                 for name, value in created.items()})
+        return {name: existing.get(name) or created[name] for name in names}
+
+
+def load_master_key(path: str, create: bool = False) -> bytes:
+    """
+    Read a master key file, optionally creating it with a new random key
+    :param path: path to key file containing a hex-encoded key
+    :param create: if True and the file does not exist, create it
+    :returns: master key bytes
+    """
+    path = expanduser(path)
+    if not isfile(path):
+        if not create:
+            raise FileNotFoundError(path)
+        os.makedirs(dirname(path) or ".", exist_ok=True)
+        with atomic_write(path) as f:
+            os.fchmod(f.fileno(), 0o600)
+            f.write(urandom(32).hex())
+    with open(path) as f:
+        return bytes.fromhex(f.read().strip())
+
+
+_DEFAULT_GENERATOR = SecretGenerator()
+_DEFAULT_SERVICE = CredentialService(_DEFAULT_GENERATOR)
+
+
+def get_default_credentials() -> CredentialService:
+    """
+    Get the shared service that generates random, unstored secrets
+    """
+    return _DEFAULT_SERVICE
+
+
+def generate_secrets(names: Iterable[str], nbytes: int = 32,
+                     encoding: str = "urlsafe") -> Dict[str, str]:
+    """
+    Generate random secrets for names with the shared generator
+    """
+    return _DEFAULT_GENERATOR.generate(names, nbytes, encoding)
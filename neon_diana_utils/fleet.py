@@ -0,0 +1,230 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+from os.path import expanduser, join
+from time import perf_counter
+from typing import Dict, List, NamedTuple, Optional
+
+from neon_diana_utils.atomic import Durability, default_durability, \
+    sync_paths
+from neon_diana_utils.imports import LazyAttribute
+from neon_diana_utils.materialize import LinkMode
+
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+xdg_config_home = LazyAttribute("ovos_utils.xdg_utils", "xdg_config_home")
+
+# Tenant names are used as output directory names
+_TENANT_NAME = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+class TenantResult(NamedTuple):
+    """
+    Result of generating definitions for one tenant in a fleet
+    """
+    name: str
+    output_path: str
+    seconds: float
+    error: Optional[str] = None
+
+
+def _merge_spec(defaults: dict, spec: dict) -> dict:
+    """
+    Recursively merge a tenant spec over fleet defaults
+    :param defaults: spec values shared by all tenants
+    :param spec: tenant-specific spec values
+    :returns: merged spec
+    """
+    merged = dict(defaults)
+    for key, value in spec.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_spec(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def validate_tenant_name(name: str) -> str:
+    """
+    Check that a tenant name is safe to use as a directory name
+    :param name: tenant name
+    :returns: `name`
+    """
+    if not _TENANT_NAME.match(name) or name in (".", ".."):
+        raise ValueError(f"Invalid tenant name: {name!r}")
+    return name
+
+
+def load_fleet(fleet_file: str) -> Dict[str, dict]:
+    """
+    Load tenant specs from a YAML or JSON fleet file. The file defines a
+    `tenants` mapping of tenant name to deployment spec (see
+    `neon_diana_utils.spec`) and optionally `defaults` which are merged into
+    every tenant spec. Tenants with `backend.credentials` that do not set a
+    `context` get secrets in a context named for the tenant.
+    :param fleet_file: path to fleet file
+    :returns: dict tenant name to deployment spec
+    """
+    from neon_diana_utils.spec import load_spec
+    fleet = load_spec(fleet_file)
+    tenants = fleet.get("tenants")
+    if not isinstance(tenants, dict) or not tenants:
+        raise ValueError(f"No `tenants` defined in {fleet_file}")
+    defaults = fleet.get("defaults") or dict()
+    return {validate_tenant_name(str(name)): _tenant_credentials(
+        str(name), _merge_spec(defaults, spec or dict()), spec or dict())
+        for name, spec in tenants.items()}
+
+
+def _tenant_credentials(name: str, spec: dict,
+                        tenant_spec: Optional[dict] = None) -> dict:
+    """
+    Scope a tenant's `backend.credentials` to the tenant, so tenants sharing
+    a master key or secret store do not share secrets. A `context` set by
+    the tenant itself is kept; a `context` shared by all tenants (i.e. from
+    fleet defaults) is extended with the tenant name.
+    :param name: tenant name
+    :param spec: tenant deployment spec
+    :param tenant_spec: tenant-specific spec values, before defaults are
+        merged (default `spec`)
+    :returns: spec with a tenant credentials context
+    """
+    backend = spec.get("backend")
+    if not isinstance(backend, dict) or \
+            not isinstance(backend.get("credentials"), dict):
+        return spec
+    tenant_spec = spec if tenant_spec is None else tenant_spec
+    own = ((tenant_spec.get("backend") or dict()).get("credentials")
+           or dict()).get("context")
+    if own:
+        return spec
+    shared = backend["credentials"].get("context")
+    context = f"{shared}/{name}" if shared else name
+    return {**spec, "backend": {**backend, "credentials": {
+        **backend["credentials"], "context": context}}}
+
+
+def _init_worker(template_cache: dict):
+    """
+    Initialize a worker process with templates parsed by the parent process
+    """
+    from neon_diana_utils.configuration import import_template_cache
+    import_template_cache(template_cache)
+
+
+def _generate_tenant(name: str, spec: dict, output_path: str,
+                     link_mode: LinkMode, durability: Durability,
+                     incremental: bool) -> TenantResult:
+    """
+    Generate definitions for a single tenant. Exceptions are reported in the
+    result so one invalid tenant does not stop the rest of the fleet.
+    """
+    from neon_diana_utils.mq_auth import clear_file_cache
+    from neon_diana_utils.spec import apply_spec
+    start = perf_counter()
+    try:
+        with default_durability(durability):
+            apply_spec(spec, output_path, link_mode, incremental)
+        error = None
+    except Exception as e:
+        LOG.error(f"Failed to generate {name}: {e}")
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        # Tenant credentials are not reused by other tenants
+        clear_file_cache()
+    return TenantResult(name, output_path, perf_counter() - start, error)
+
+
+def generate_fleet(tenants: Dict[str, dict],
+                   output_path: Optional[str] = None,
+                   max_workers: Optional[int] = None,
+                   link_mode: LinkMode = LinkMode.AUTO,
+                   durability: Durability = Durability.DEFERRED,
+                   incremental: bool = False) -> List[TenantResult]:
+    """
+    Generate definitions for many tenants in parallel. Templates are parsed
+    once in this process and shared with each worker process.
+    :param tenants: dict tenant name to deployment spec. Names may only
+        contain letters, digits, `.`, `_`, and `-`
+    :param output_path: directory to write tenant definitions to; each tenant
+        is written to a subdirectory named for the tenant
+    :param max_workers: max number of worker processes (default CPU count).
+        If 1, tenants are generated serially in this process
+    :param link_mode: how to materialize unmodified template files
+    :param durability: how generated files are flushed to storage. If
+        `DEFERRED`, files are not flushed individually and all tenants are
+        flushed once after they have been generated
+    :param incremental: if True, update existing tenant outputs, regenerating
+        only sections whose inputs changed
+    :returns: list of results in the same order as `tenants`
+    """
+    from neon_diana_utils.configuration import export_template_cache
+    for name in tenants:
+        validate_tenant_name(name)
+    output_path = expanduser(output_path or
+                             join(xdg_config_home(), "diana", "fleet"))
+    tenant_durability = Durability.NONE if \
+        durability == Durability.DEFERRED else durability
+    jobs = [(name, _tenant_credentials(name, spec), join(output_path, name),
+             link_mode, tenant_durability, incremental)
+            for name, spec in tenants.items()]
+    if max_workers == 1 or len(jobs) < 2:
+        results = [_generate_tenant(*job) for job in jobs]
+    else:
+        template_cache = export_template_cache()
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                 initargs=(template_cache,)) as executor:
+            futures = [executor.submit(_generate_tenant, *job)
+                       for job in jobs]
+            results = [future.result() for future in futures]
+    if durability == Durability.DEFERRED:
+        sync_paths([result.output_path for result in results])
+    return results
+
+
+def format_fleet_report(results: List[TenantResult],
+                        elapsed: Optional[float] = None) -> str:
+    """
+    Format a summary of fleet generation results
+    :param results: list of results from `generate_fleet`
+    :param elapsed: total wall time in seconds, if known
+    :returns: string report with one line per tenant
+    """
+    width = max([len(r.name) for r in results] + [len("Tenant")])
+    lines = [f"{'Tenant':<{width}}  {'Time (s)':>8}  Status"]
+    for result in results:
+        status = f"FAILED ({result.error})" if result.error else \
+            result.output_path
+        lines.append(f"{result.name:<{width}}  {result.seconds:>8.3f}  "
+                     f"{status}")
+    failed = len([r for r in results if r.error])
+    summary = f"Generated {len(results) - failed}/{len(results)} tenants"
+    if elapsed is not None:
+        summary += f" in {elapsed:.2f}s"
+    lines.append(summary)
+    return "\n".join(lines)
@@ -0,0 +1,1139 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A Python implementation of the subset of Go `text/template` syntax and Sprig
+functions used by the bundled Helm charts. See
+`neon_diana_utils.helm_render` for rendering charts with this module.
+"""
+
+import re
+
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class TemplateError(Exception):
+    """
+    Raised when a template cannot be parsed or executed
+    """
+
+
+_MISSING = object()
+_KEYWORDS = {"if", "else", "end", "range", "with", "define", "template",
+             "block", "break", "continue"}
+_LITERALS = {"true": True, "false": False, "nil": None}
+_NUMBER = re.compile(r"[+-]?(0[xX][0-9a-fA-F_]+|(\d[\d_]*)?\.?\d+"
+                     r"([eE][+-]?\d+)?)")
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"', "'": "'",
+            "a": "\a", "b": "\b", "f": "\f", "v": "\v", "0": "\0"}
+
+
+# Lexing
+class _Token:
+    __slots__ = ("kind", "value", "adjacent")
+
+    def __init__(self, kind: str, value: Any = None, adjacent: bool = False):
+        """
+        A lexical token in a template action
+        :param kind: token type (i.e. `field`, `string`, `|`)
+        :param value: token value, if any
+        :param adjacent: True if the token immediately follows the previous
+            token without whitespace (i.e. chained fields)
+        """
+        self.kind = kind
+        self.value = value
+        self.adjacent = adjacent
+
+    def __repr__(self):
+        return f"{self.kind}({self.value!r})"
+
+
+def _read_string(source: str, pos: int, name: str) -> Tuple[str, int]:
+    """
+    Read an interpreted string literal starting at the opening quote
+    :returns: string value and position after the closing quote
+    """
+    chars = list()
+    pos += 1
+    while pos < len(source):
+        char = source[pos]
+        if char == '"':
+            return "".join(chars), pos + 1
+        if char == "\n":
+            break
+        if char == "\\":
+            escape = source[pos + 1:pos + 2]
+            if escape in _ESCAPES:
+                chars.append(_ESCAPES[escape])
+                pos += 2
+                continue
+            if escape in ("x", "u", "U"):
+                size = {"x": 2, "u": 4, "U": 8}[escape]
+                chars.append(chr(int(source[pos + 2:pos + 2 + size], 16)))
+                pos += 2 + size
+                continue
+            raise TemplateError(f"{name}: invalid escape: \\{escape}")
+        chars.append(char)
+        pos += 1
+    raise TemplateError(f"{name}: unterminated string")
+
+
+def _tokenize_action(source: str, pos: int,
+                     name: str) -> Tuple[List[_Token], int, bool]:
+    """
+    Tokenize a template action
+    :param source: template source
+    :param pos: position after the action's opening delimiter
+    :param name: template name for error messages
+    :returns: list of tokens, position after the closing delimiter, and True
+        if whitespace after the action should be trimmed
+    """
+    tokens = list()
+    adjacent = False
+    while pos < len(source):
+        char = source[pos]
+        if char in " \t\r\n":
+            pos += 1
+            adjacent = False
+            if source.startswith("-}}", pos):
+                return tokens, pos + 3, True
+            continue
+        if source.startswith("}}", pos):
+            return tokens, pos + 2, False
+        if char == '"':
+            value, pos = _read_string(source, pos, name)
+            tokens.append(_Token("string", value, adjacent))
+        elif char == '`':
+            end = source.find('`', pos + 1)
+            if end < 0:
+                raise TemplateError(f"{name}: unterminated raw string")
+            tokens.append(_Token("string", source[pos + 1:end], adjacent))
+            pos = end + 1
+        elif char == "'":
+            end = source.find("'", pos + 2)
+            value = source[pos + 1:end]
+            if end < 0 or len(value) != 1:
+                raise TemplateError(f"{name}: invalid character constant")
+            tokens.append(_Token("number", ord(value), adjacent))
+            pos = end + 1
+        elif source.startswith(":=", pos):
+            tokens.append(_Token(":=", adjacent=adjacent))
+            pos += 2
+        elif char in "|(),=":
+            tokens.append(_Token(char, adjacent=adjacent))
+            pos += 1
+        elif char == "$":
+            match = _IDENTIFIER.match(source, pos + 1)
+            value = "$" + (match.group() if match else "")
+            tokens.append(_Token("variable", value, adjacent))
+            pos += len(value)
+        elif char == ".":
+            match = _IDENTIFIER.match(source, pos + 1)
+            if match:
+                tokens.append(_Token("field", match.group(), adjacent))
+                pos = match.end()
+            elif _NUMBER.match(source, pos):
+                match = _NUMBER.match(source, pos)
+                tokens.append(_Token("number", _parse_number(match.group()),
+                                     adjacent))
+                pos = match.end()
+            else:
+                tokens.append(_Token("dot", adjacent=adjacent))
+                pos += 1
+        elif char.isdigit() or (char in "+-" and
+                                source[pos + 1:pos + 2].isdigit()):
+            match = _NUMBER.match(source, pos)
+            tokens.append(_Token("number", _parse_number(match.group()),
+                                 adjacent))
+            pos = match.end()
+        else:
+            match = _IDENTIFIER.match(source, pos)
+            if not match:
+                raise TemplateError(f"{name}: unexpected {char!r} in action")
+            word = match.group()
+            if word in _LITERALS:
+                tokens.append(_Token("literal", _LITERALS[word], adjacent))
+            elif word in _KEYWORDS:
+                tokens.append(_Token("keyword", word, adjacent))
+            else:
+                tokens.append(_Token("identifier", word, adjacent))
+            pos = match.end()
+        adjacent = True
+    raise TemplateError(f"{name}: unclosed action")
+
+
+def _parse_number(value: str):
+    """
+    Parse a Go number literal
+    """
+    value = value.replace("_", "")
+    if value.lower().lstrip("+-").startswith("0x"):
+        return int(value, 16)
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _lex(source: str, name: str) -> List[Tuple[str, Any]]:
+    """
+    Split a template into text and actions, applying whitespace trim markers
+    and dropping comments
+    :returns: list of (`text`, str) and (`action`, List[_Token]) items
+    """
+    items = list()
+    pos = 0
+    trim_next = False
+    while True:
+        start = source.find("{{", pos)
+        text = source[pos:] if start < 0 else source[pos:start]
+        if trim_next:
+            text = text.lstrip(" \t\r\n")
+        if start < 0:
+            if text:
+                items.append(("text", text))
+            return items
+        pos = start + 2
+        if source[pos:pos + 1] == "-" and source[pos + 1:pos + 2] in \
+                (" ", "\t", "\r", "\n"):
+            text = text.rstrip(" \t\r\n")
+            pos += 1
+        if text:
+            items.append(("text", text))
+        comment_start = len(source[pos:]) - len(source[pos:].lstrip())
+        if source.startswith("/*", pos + comment_start):
+            end = source.find("*/", pos + comment_start + 2)
+            if end < 0:
+                raise TemplateError(f"{name}: unclosed comment")
+            close = source.find("}}", end + 2)
+            if close < 0 or source[end + 2:close].strip() not in ("", "-"):
+                raise TemplateError(f"{name}: comment ends before closing "
+                                    f"delimiter")
+            trim_next = source[end + 2:close].strip() == "-"
+            pos = close + 2
+            continue
+        tokens, pos, trim_next = _tokenize_action(source, pos, name)
+        items.append(("action", tokens))
+
+
+# Parsing
+class _Node:
+    __slots__ = ()
+
+
+class _Text(_Node):
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Action(_Node):
+    __slots__ = ("pipeline",)
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+
+class _Branch(_Node):
+    __slots__ = ("kind", "pipeline", "body", "else_body", "variables")
+
+    def __init__(self, kind: str, pipeline, body: list, else_body: list,
+                 variables: Tuple[str, ...] = ()):
+        """
+        An `if`, `range`, or `with` block
+        """
+        self.kind = kind
+        self.pipeline = pipeline
+        self.body = body
+        self.else_body = else_body
+        self.variables = variables
+
+
+class _TemplateCall(_Node):
+    __slots__ = ("name", "pipeline")
+
+    def __init__(self, name: str, pipeline):
+        self.name = name
+        self.pipeline = pipeline
+
+
+class _LoopControl(_Node):
+    __slots__ = ("kind",)
+
+    def __init__(self, kind: str):
+        self.kind = kind
+
+
+class _Pipeline:
+    __slots__ = ("declarations", "assign", "commands")
+
+    def __init__(self, declarations: Tuple[str, ...], assign: bool,
+                 commands: list):
+        self.declarations = declarations
+        self.assign = assign
+        self.commands = commands
+
+
+class _Parser:
+    def __init__(self, source: str, name: str):
+        """
+        Parse a template into a node tree and named templates
+        :param source: template source
+        :param name: template name for error messages
+        """
+        self.name = name
+        self.items = _lex(source, name)
+        self.pos = 0
+        self.defines: Dict[str, list] = dict()
+        self.root, terminator = self._parse_list()
+        if terminator is not None:
+            raise TemplateError(f"{name}: unexpected {{{{{terminator[0]}}}}}")
+
+    def _error(self, message: str):
+        return TemplateError(f"{self.name}: {message}")
+
+    def _parse_list(self) -> Tuple[list, Optional[Tuple[str, list]]]:
+        """
+        Parse nodes until an `end` or `else` action
+        :returns: list of nodes and the terminating keyword and remaining
+            tokens, or None at the end of the template
+        """
+        nodes = list()
+        while self.pos < len(self.items):
+            kind, value = self.items[self.pos]
+            self.pos += 1
+            if kind == "text":
+                nodes.append(_Text(value))
+                continue
+            if not value:
+                raise self._error("missing value for command")
+            first = value[0]
+            if first.kind != "keyword":
+                nodes.append(_Action(self._parse_pipeline(value)))
+            elif first.value in ("end", "else"):
+                return nodes, (first.value, value[1:])
+            elif first.value in ("if", "with", "range"):
+                nodes.append(self._parse_branch(first.value, value[1:]))
+            elif first.value == "define":
+                self._parse_define(value[1:])
+            elif first.value == "block":
+                name = self._parse_define(value[1:])
+                nodes.append(_TemplateCall(name, self._parse_pipeline(
+                    value[2:])))
+            elif first.value == "template":
+                if len(value) < 2 or value[1].kind != "string":
+                    raise self._error("template name must be a string")
+                pipeline = self._parse_pipeline(value[2:]) \
+                    if len(value) > 2 else None
+                nodes.append(_TemplateCall(value[1].value, pipeline))
+            else:
+                nodes.append(_LoopControl(first.value))
+        return nodes, None
+
+    def _parse_define(self, tokens: List[_Token]) -> str:
+        if not tokens or tokens[0].kind != "string":
+            raise self._error("define name must be a string")
+        body, terminator = self._parse_list()
+        if terminator is None or terminator[0] != "end":
+            raise self._error(f"unterminated define: {tokens[0].value}")
+        self.defines[tokens[0].value] = body
+        return tokens[0].value
+
+    def _parse_branch(self, kind: str, tokens: List[_Token]) -> _Branch:
+        variables = ()
+        if kind == "range" and len(tokens) > 1 and \
+                tokens[0].kind == "variable":
+            # range $v := ... or range $i, $v := ...
+            if tokens[1].kind == ":=":
+                variables = (tokens[0].value,)
+                tokens = tokens[2:]
+            elif tokens[1].kind == "," and len(tokens) > 3 and \
+                    tokens[2].kind == "variable" and tokens[3].kind == ":=":
+                variables = (tokens[0].value, tokens[2].value)
+                tokens = tokens[4:]
+        pipeline = self._parse_pipeline(tokens)
+        body, terminator = self._parse_list()
+        if terminator is None:
+            raise self._error(f"unterminated {kind}")
+        else_body = list()
+        if terminator[0] == "else":
+            rest = terminator[1]
+            if rest and rest[0].kind == "keyword" and \
+                    rest[0].value in ("if", "with"):
+                # `else if` shares the `end` of the enclosing block
+                else_body = [self._parse_branch(rest[0].value, rest[1:])]
+            else:
+                else_body, terminator = self._parse_list()
+                if terminator is None or terminator[0] != "end":
+                    raise self._error(f"unterminated {kind}")
+        return _Branch(kind, pipeline, body, else_body, variables)
+
+    def _parse_pipeline(self, tokens: List[_Token]) -> _Pipeline:
+        declarations = ()
+        assign = False
+        if len(tokens) > 1 and tokens[0].kind == "variable" and \
+                tokens[1].kind in (":=", "="):
+            declarations = (tokens[0].value,)
+            assign = tokens[1].kind == "="
+            tokens = tokens[2:]
+        commands, pos = self._parse_commands(tokens, 0)
+        if pos != len(tokens):
+            raise self._error(f"unexpected {tokens[pos]} in pipeline")
+        if not commands:
+            raise self._error("missing value for command")
+        return _Pipeline(declarations, assign, commands)
+
+    def _parse_commands(self, tokens: List[_Token],
+                        pos: int) -> Tuple[list, int]:
+        """
+        Parse `|` separated commands until the end of tokens or a `)`
+        """
+        commands = list()
+        command = list()
+        while pos < len(tokens):
+            token = tokens[pos]
+            if token.kind == ")":
+                break
+            if token.kind == "|":
+                if not command:
+                    raise self._error("missing command before |")
+                commands.append(command)
+                command = list()
+                pos += 1
+                continue
+            operand, pos = self._parse_operand(tokens, pos)
+            command.append(operand)
+        if command:
+            commands.append(command)
+        return commands, pos
+
+    def _parse_operand(self, tokens: List[_Token], pos: int):
+        """
+        Parse a single command argument, including any chained fields
+        :returns: operand tuple and position of the next token
+        """
+        token = tokens[pos]
+        pos += 1
+        if token.kind == "(":
+            commands, pos = self._parse_commands(tokens, pos)
+            if pos >= len(tokens) or tokens[pos].kind != ")":
+                raise self._error("unclosed left paren")
+            pos += 1
+            operand = ("pipeline", _Pipeline((), False, commands))
+        elif token.kind in ("string", "number", "literal"):
+            operand = ("literal", token.value)
+        elif token.kind == "dot":
+            operand = ("dot",)
+        elif token.kind == "field":
+            operand = ("dot",)
+            pos -= 1
+        elif token.kind == "variable":
+            operand = ("variable", token.value)
+        elif token.kind == "identifier":
+            operand = ("function", token.value)
+        else:
+            raise self._error(f"unexpected {token} in command")
+        fields = list()
+        while pos < len(tokens) and tokens[pos].kind == "field" and \
+                (tokens[pos].adjacent or
+                 (not fields and operand == ("dot",) and
+                  token.kind == "field")):
+            fields.append(tokens[pos].value)
+            pos += 1
+        if fields:
+            operand = ("chain", operand, tuple(fields))
+        return operand, pos
+
+
+@lru_cache(maxsize=1024)
+def parse_template(source: str, name: str = "template") -> \
+        Tuple[list, Dict[str, list]]:
+    """
+    Parse a template. Parsed templates are cached by source.
+    :param source: template source
+    :param name: template name for error messages
+    :returns: parsed root node list and dict of named templates it defines
+    """
+    parser = _Parser(source, name)
+    return parser.root, parser.defines
+
+
+# Execution
+class _Break(Exception):
+    pass
+
+
+class _Continue(Exception):
+    pass
+
+
+def is_true(value: Any) -> bool:
+    """
+    Get the truth value of a template value; false, 0, nil, and empty strings
+    and collections are false
+    """
+    if value is None or value is False:
+        return False
+    if isinstance(value, (int, float, str, list, tuple, dict)):
+        return bool(value)
+    return True
+
+
+def format_value(value: Any) -> str:
+    """
+    Format a value as printed by a template action
+    """
+    if value is None:
+        # Helm replaces `<no value>` with an empty string
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e21:
+            return str(int(value))
+        return repr(value)
+    if isinstance(value, dict):
+        return "map[" + " ".join(f"{k}:{format_value(v)}" for k, v in
+                                 sorted(value.items())) + "]"
+    if isinstance(value, (list, tuple)):
+        return "[" + " ".join(format_value(v) for v in value) + "]"
+    return str(value)
+
+
+class Template:
+    def __init__(self, functions: Optional[Dict[str, Callable]] = None):
+        """
+        A set of named templates sharing a function map, equivalent to a Go
+        `template.Template` with its associated templates.
+        :param functions: dict of function name to callable; callables with a
+            `needs_template` attribute are passed this `Template` as their
+            first argument (i.e. `include`)
+        """
+        self.functions = dict(_BUILTINS)
+        self.functions.update(functions or dict())
+        self.named: Dict[str, list] = dict()
+
+    def add(self, source: str, name: str = "template") -> list:
+        """
+        Parse a template and register any templates it defines
+        :param source: template source
+        :param name: template name; the parsed body is also registered with
+            this name
+        :returns: parsed template body
+        """
+        root, defines = parse_template(source, name)
+        self.named.update(defines)
+        self.named[name] = root
+        return root
+
+    def execute(self, name: str, data: Any) -> str:
+        """
+        Execute a named template
+        :param name: name of template to execute
+        :param data: value of `.` (and `$`) in the template
+        :returns: rendered string
+        """
+        if name not in self.named:
+            raise TemplateError(f"no template {name!r} associated with "
+                                f"template")
+        output = list()
+        _Executor(self, name, data).walk(self.named[name], data, output)
+        return "".join(output)
+
+    def render(self, source: str, data: Any, name: str = "template") -> str:
+        """
+        Parse and execute a template with access to this template's named
+        templates, i.e. for Helm's `tpl` function
+        :param source: template source
+        :param data: value of `.` in the template
+        :param name: template name for error messages
+        :returns: rendered string
+        """
+        root, defines = parse_template(source, name)
+        self.named.update(defines)
+        output = list()
+        _Executor(self, name, data).walk(root, data, output)
+        return "".join(output)
+
+
+class _Executor:
+    def __init__(self, template: Template, name: str, data: Any):
+        """
+        State of a single template execution
+        """
+        self.template = template
+        self.name = name
+        self.variables: List[Tuple[str, Any]] = [("$", data)]
+
+    def _error(self, message: str):
+        return TemplateError(f"{self.name}: {message}")
+
+    def walk(self, nodes: list, dot: Any, output: List[str]):
+        for node in nodes:
+            if isinstance(node, _Text):
+                output.append(node.text)
+            elif isinstance(node, _Action):
+                value = self.eval_pipeline(node.pipeline, dot)
+                if not node.pipeline.declarations:
+                    output.append(format_value(value))
+            elif isinstance(node, _Branch):
+                self.walk_branch(node, dot, output)
+            elif isinstance(node, _TemplateCall):
+                data = self.eval_pipeline(node.pipeline, dot) \
+                    if node.pipeline else None
+                output.append(self.template.execute(node.name, data))
+            elif node.kind == "break":
+                raise _Break()
+            else:
+                raise _Continue()
+
+    def _walk_scoped(self, nodes: list, dot: Any, output: List[str]):
+        mark = len(self.variables)
+        try:
+            self.walk(nodes, dot, output)
+        finally:
+            del self.variables[mark:]
+
+    def walk_branch(self, node: _Branch, dot: Any, output: List[str]):
+        mark = len(self.variables)
+        value = self.eval_pipeline(node.pipeline, dot)
+        try:
+            if node.kind == "if":
+                if is_true(value):
+                    self._walk_scoped(node.body, dot, output)
+                else:
+                    self._walk_scoped(node.else_body, dot, output)
+            elif node.kind == "with":
+                if is_true(value):
+                    self._walk_scoped(node.body, value, output)
+                else:
+                    self._walk_scoped(node.else_body, dot, output)
+            else:
+                self.walk_range(node, value, dot, output)
+        finally:
+            del self.variables[mark:]
+
+    def walk_range(self, node: _Branch, value: Any, dot: Any,
+                   output: List[str]):
+        if isinstance(value, dict):
+            items = [(key, value[key]) for key in sorted(value)]
+        elif isinstance(value, (list, tuple)):
+            items = list(enumerate(value))
+        elif isinstance(value, int) and not isinstance(value, bool):
+            items = [(i, i) for i in range(value)]
+        elif value is None:
+            items = list()
+        else:
+            raise self._error(f"range can't iterate over {value!r}")
+        if not items:
+            self._walk_scoped(node.else_body, dot, output)
+            return
+        mark = len(self.variables)
+        for key, element in items:
+            if len(node.variables) == 1:
+                self.variables.append((node.variables[0], element))
+            elif len(node.variables) == 2:
+                self.variables.append((node.variables[0], key))
+                self.variables.append((node.variables[1], element))
+            try:
+                self._walk_scoped(node.body, element, output)
+            except _Break:
+                break
+            except _Continue:
+                pass
+            finally:
+                del self.variables[mark:]
+
+    def lookup_variable(self, name: str) -> Any:
+        for variable, value in reversed(self.variables):
+            if variable == name:
+                return value
+        raise self._error(f"undefined variable: {name}")
+
+    def eval_pipeline(self, pipeline: _Pipeline, dot: Any) -> Any:
+        value = _MISSING
+        for command in pipeline.commands:
+            value = self.eval_command(command, dot, value)
+        for name in pipeline.declarations:
+            if pipeline.assign:
+                for i in range(len(self.variables) - 1, -1, -1):
+                    if self.variables[i][0] == name:
+                        self.variables[i] = (name, value)
+                        break
+                else:
+                    raise self._error(f"undefined variable: {name}")
+            else:
+                self.variables.append((name, value))
+        return value
+
+    def eval_command(self, command: list, dot: Any, final: Any) -> Any:
+        first = command[0]
+        if first[0] == "function":
+            return self.call_function(first[1], command[1:], dot, final)
+        args = [self.eval_operand(arg, dot) for arg in command[1:]]
+        if final is not _MISSING:
+            args.append(final)
+        if first[0] == "chain":
+            receiver = self.eval_operand(first[1], dot)
+            return self.eval_fields(receiver, first[2], args)
+        if args:
+            raise self._error(f"can't give argument to non-function "
+                              f"{first}")
+        return self.eval_operand(first, dot)
+
+    def call_function(self, name: str, operands: list, dot: Any,
+                      final: Any) -> Any:
+        if name in ("and", "or"):
+            # `and` and `or` only evaluate arguments until the result is known
+            values = [lambda o=o: self.eval_operand(o, dot) for o in operands]
+            if final is not _MISSING:
+                values.append(lambda: final)
+            if not values:
+                raise self._error(f"wrong number of args for {name}")
+            value = None
+            for get_value in values:
+                value = get_value()
+                if is_true(value) != (name == "and"):
+                    return value
+            return value
+        function = self.template.functions.get(name)
+        if function is None:
+            raise self._error(f"function {name!r} not defined")
+        args = [self.eval_operand(arg, dot) for arg in operands]
+        if final is not _MISSING:
+            args.append(final)
+        try:
+            if getattr(function, "needs_template", False):
+                return function(self.template, *args)
+            return function(*args)
+        except TemplateError:
+            raise
+        except Exception as e:
+            raise self._error(f"error calling {name}: {e}") from e
+
+    def eval_operand(self, operand: tuple, dot: Any) -> Any:
+        kind = operand[0]
+        if kind == "literal":
+            return operand[1]
+        if kind == "dot":
+            return dot
+        if kind == "variable":
+            return self.lookup_variable(operand[1])
+        if kind == "pipeline":
+            return self.eval_pipeline(operand[1], dot)
+        if kind == "function":
+            return self.call_function(operand[1], [], dot, _MISSING)
+        receiver = self.eval_operand(operand[1], dot)
+        return self.eval_fields(receiver, operand[2], [])
+
+    def eval_fields(self, receiver: Any, fields: Tuple[str, ...],
+                    args: list) -> Any:
+        value = receiver
+        for i, field in enumerate(fields):
+            if value is None:
+                raise self._error(f"nil pointer evaluating interface {{}}."
+                                  f"{field}")
+            if isinstance(value, dict):
+                value = value.get(field)
+            else:
+                attribute = getattr(value, field, _MISSING)
+                if attribute is _MISSING:
+                    raise self._error(f"can't evaluate field {field} in "
+                                      f"type {type(value).__name__}")
+                if callable(attribute):
+                    call_args = args if i == len(fields) - 1 else []
+                    value = attribute(*call_args)
+                    if i == len(fields) - 1:
+                        return value
+                    continue
+                value = attribute
+        if args:
+            raise self._error(f"{fields[-1]} is not a method but has "
+                              f"arguments")
+        return value
+
+
+# Built-in Go template functions
+def _index(value, *keys):
+    for key in keys:
+        if value is None:
+            return None
+        value = value.get(key) if isinstance(value, dict) else value[key]
+    return value
+
+
+def _eq(first, *others):
+    if not others:
+        raise TemplateError("missing argument for comparison")
+    return any(first == other for other in others)
+
+
+def _go_printf(fmt: str, *args) -> str:
+    """
+    Format a string with Go `fmt` verbs
+    """
+    args = list(args)
+
+    def _replace(match):
+        verb = match.group(2)
+        if verb == "%":
+            return "%"
+        if not args:
+            return f"%!{verb}(MISSING)"
+        arg = args.pop(0)
+        flags = match.group(1)
+        if verb == "q":
+            return quote_string(format_value(arg))
+        if verb in "dxXobeEfFgG" and isinstance(arg, (int, float)) and \
+                not isinstance(arg, bool):
+            return ("%" + flags + verb.replace("b", "d")) % arg
+        return ("%" + flags + "s") % format_value(arg)
+    return re.sub(r"%([-+# 0]*\d*(?:\.\d+)?)([a-zA-Z%])", _replace, fmt)
+
+
+def quote_string(value: str) -> str:
+    """
+    Quote a string as Go `%q` does
+    """
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    escaped = escaped.replace("\n", "\\n").replace("\t", "\\t") \
+        .replace("\r", "\\r")
+    return f'"{escaped}"'
+
+
+_BUILTINS = {
+    "and": None,
+    "or": None,
+    "not": lambda value: not is_true(value),
+    "len": lambda value: len(value) if value is not None else 0,
+    "index": _index,
+    "print": lambda *args: "".join(format_value(a) for a in args),
+    "println": lambda *args: " ".join(format_value(a) for a in args) + "\n",
+    "printf": _go_printf,
+    "eq": _eq,
+    "ne": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "le": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "ge": lambda a, b: a >= b,
+}
+
+
+# Sprig functions
+def _default(default, *value):
+    if not value or not is_true(value[0]):
+        return default
+    return value[0]
+
+
+def _trunc(length: int, value: str) -> str:
+    value = format_value(value)
+    if length < 0:
+        return value[length:] if -length < len(value) else value
+    return value[:length]
+
+
+def _indent(spaces: int, value: str) -> str:
+    pad = " " * spaces
+    return pad + format_value(value).replace("\n", "\n" + pad)
+
+
+def _semver(version: str) -> Tuple[Tuple[int, int, int], Tuple]:
+    """
+    Parse a semantic version, allowing a `v` prefix and missing minor or patch
+    :returns: (major, minor, patch) and prerelease identifiers
+    """
+    match = re.match(r"^v?(\d+)(?:\.(\d+))?(?:\.(\d+))?"
+                     r"(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$",
+                     str(version).strip())
+    if not match:
+        raise TemplateError(f"invalid semantic version: {version}")
+    release = tuple(int(part or 0) for part in match.groups()[:3])
+    prerelease = tuple(int(part) if part.isdigit() else part for part in
+                       match.group(4).split(".")) if match.group(4) else ()
+    return release, prerelease
+
+
+def _semver_key(version) -> tuple:
+    release, prerelease = _semver(version)
+    if not prerelease:
+        return release, 1, ()
+    # Numeric identifiers sort before alphanumeric ones
+    return release, 0, tuple((isinstance(p, str), p) for p in prerelease)
+
+
+def _semver_compare(constraint: str, version: str) -> bool:
+    """
+    Check a version against a Masterminds/semver constraint string.
+    Supports comparison operators, `,`/space separated AND and `||` OR.
+    """
+    for alternative in str(constraint).split("||"):
+        parts = [p for p in re.split(r"[\s,]+", alternative.strip()) if p]
+        if all(_check_constraint(part, version) for part in parts):
+            return True
+    return False
+
+
+def _check_constraint(constraint: str, version: str) -> bool:
+    match = re.match(r"^(>=|<=|!=|=>|=<|>|<|=|~|\^)?\s*(.+)$", constraint)
+    operator, target = match.group(1) or "=", match.group(2)
+    release, prerelease = _semver(version)
+    target_release, target_prerelease = _semver(target)
+    if prerelease and not target_prerelease:
+        # Prerelease versions only satisfy constraints with a prerelease
+        return False
+    key, target_key = _semver_key(version), _semver_key(target)
+    if operator in (">=", "=>"):
+        return key >= target_key
+    if operator in ("<=", "=<"):
+        return key <= target_key
+    if operator == ">":
+        return key > target_key
+    if operator == "<":
+        return key < target_key
+    if operator == "!=":
+        return key != target_key
+    if operator == "~":
+        upper = (target_release[0], target_release[1] + 1, 0)
+        return target_key <= key < (upper, 0, ())
+    if operator == "^":
+        upper = (target_release[0] + 1, 0, 0)
+        return target_key <= key < (upper, 0, ())
+    return key == target_key
+
+
+_GO_TIME_LAYOUT = (("2006", "%Y"), ("January", "%B"), ("Jan", "%b"),
+                   ("Monday", "%A"), ("Mon", "%a"), ("MST", "%Z"),
+                   ("01", "%m"), ("02", "%d"), ("15", "%H"), ("03", "%I"),
+                   ("04", "%M"), ("05", "%S"), ("06", "%y"), ("PM", "%p"),
+                   ("-0700", "%z"), ("1", "%-m"), ("2", "%-d"))
+
+
+def _date_in_zone(layout: str, date, zone: str) -> str:
+    """
+    Format a datetime with a Go reference time layout in a time zone
+    """
+    from datetime import datetime, timezone
+    if isinstance(date, (int, float)):
+        date = datetime.fromtimestamp(date, timezone.utc)
+    if zone and zone.upper() != "LOCAL":
+        if zone.upper() == "UTC":
+            date = date.astimezone(timezone.utc)
+        else:
+            from zoneinfo import ZoneInfo
+            date = date.astimezone(ZoneInfo(zone))
+    pattern = "|".join(re.escape(go) for go, _ in _GO_TIME_LAYOUT)
+    formats = dict(_GO_TIME_LAYOUT)
+    strftime = re.sub(pattern, lambda m: formats[m.group()],
+                      layout.replace("%", "%%"))
+    return date.strftime(strftime)
+
+
+def _now():
+    from datetime import datetime
+    return datetime.now().astimezone()
+
+
+def _set(mapping: dict, key: str, value) -> dict:
+    mapping[key] = value
+    return mapping
+
+
+def _unset(mapping: dict, key: str) -> dict:
+    mapping.pop(key, None)
+    return mapping
+
+
+def _dict(*args) -> dict:
+    if len(args) % 2:
+        args = args + ("",)
+    return {format_value(args[i]): args[i + 1]
+            for i in range(0, len(args), 2)}
+
+
+def _concat(*lists) -> list:
+    result = list()
+    for value in lists:
+        result.extend(value or [])
+    return result
+
+
+def _b64enc(value) -> str:
+    from base64 import b64encode
+    return b64encode(format_value(value).encode()).decode()
+
+
+def _b64dec(value) -> str:
+    from base64 import b64decode
+    return b64decode(format_value(value)).decode()
+
+
+def _to_string(value) -> str:
+    return format_value(value)
+
+
+def _quote(*values) -> str:
+    return " ".join(quote_string(format_value(v)) for v in values
+                    if v is not None)
+
+
+def _squote(*values) -> str:
+    return " ".join(f"'{format_value(v)}'" for v in values if v is not None)
+
+
+def _ternary(true_value, false_value, condition):
+    return true_value if is_true(condition) else false_value
+
+
+def _sha256sum(value) -> str:
+    from hashlib import sha256
+    return sha256(format_value(value).encode()).hexdigest()
+
+
+def _fail(message: str):
+    raise TemplateError(message)
+
+
+def _merge(destination: dict, *sources) -> dict:
+    """
+    Recursively merge `sources` into `destination`, keeping existing values
+    """
+    for source in sources:
+        for key, value in (source or dict()).items():
+            if key not in destination:
+                destination[key] = value
+            elif isinstance(destination[key], dict) and \
+                    isinstance(value, dict):
+                _merge(destination[key], value)
+    return destination
+
+
+SPRIG_FUNCTIONS: Dict[str, Callable] = {
+    "default": _default,
+    "empty": lambda value: not is_true(value),
+    "coalesce": lambda *values: next((v for v in values if is_true(v)), None),
+    "ternary": _ternary,
+    "fail": _fail,
+    "toString": _to_string,
+    "quote": _quote,
+    "squote": _squote,
+    "upper": lambda value: format_value(value).upper(),
+    "lower": lambda value: format_value(value).lower(),
+    "title": lambda value: format_value(value).title(),
+    "trim": lambda value: format_value(value).strip(),
+    "trimAll": lambda chars, value: format_value(value).strip(chars),
+    "trimPrefix": lambda prefix, value: format_value(value)[len(prefix):]
+    if format_value(value).startswith(prefix) else format_value(value),
+    "trimSuffix": lambda suffix, value: format_value(value)[:-len(suffix)]
+    if suffix and format_value(value).endswith(suffix)
+    else format_value(value),
+    "trunc": _trunc,
+    "contains": lambda substring, value: substring in format_value(value),
+    "hasPrefix": lambda prefix, value: format_value(value).startswith(prefix),
+    "hasSuffix": lambda suffix, value: format_value(value).endswith(suffix),
+    "replace": lambda old, new, value: format_value(value).replace(old, new),
+    "repeat": lambda count, value: format_value(value) * count,
+    "split": lambda sep, value: {f"_{i}": part for i, part in
+                                 enumerate(format_value(value).split(sep))},
+    "splitList": lambda sep, value: format_value(value).split(sep),
+    "join": lambda sep, values: sep.join(format_value(v) for v in values),
+    "cat": lambda *values: " ".join(format_value(v) for v in values
+                                    if v is not None),
+    "indent": _indent,
+    "nindent": lambda spaces, value: "\n" + _indent(spaces, value),
+    "b64enc": _b64enc,
+    "b64dec": _b64dec,
+    "sha256sum": _sha256sum,
+    "semverCompare": _semver_compare,
+    "now": _now,
+    "date": lambda layout, date: _date_in_zone(layout, date, "Local"),
+    "dateInZone": _date_in_zone,
+    "list": lambda *values: list(values),
+    "first": lambda values: values[0] if values else None,
+    "last": lambda values: values[-1] if values else None,
+    "append": lambda values, value: list(values or []) + [value],
+    "has": lambda value, values: value in (values or []),
+    "uniq": lambda values: list(dict.fromkeys(values)),
+    "concat": _concat,
+    "dict": _dict,
+    "get": lambda mapping, key: mapping.get(key, ""),
+    "set": _set,
+    "unset": _unset,
+    "hasKey": lambda mapping, key: key in mapping,
+    "keys": lambda *maps: [k for m in maps for k in m],
+    "values": lambda mapping: list(mapping.values()),
+    "pick": lambda mapping, *keys: {k: mapping[k] for k in keys
+                                    if k in mapping},
+    "omit": lambda mapping, *keys: {k: v for k, v in mapping.items()
+                                    if k not in keys},
+    "merge": _merge,
+    "deepCopy": lambda value: __import__("copy").deepcopy(value),
+    "add": lambda *values: sum(int(v) for v in values),
+    "add1": lambda value: int(value) + 1,
+    "sub": lambda a, b: int(a) - int(b),
+    "mul": lambda *values: __import__("math").prod(int(v) for v in values),
+    "div": lambda a, b: int(int(a) / int(b)),
+    "mod": lambda a, b: int(a) % int(b),
+    "max": lambda *values: max(int(v) for v in values),
+    "min": lambda *values: min(int(v) for v in values),
+    "int": lambda value: int(float(value or 0)),
+    "int64": lambda value: int(float(value or 0)),
+    "float64": lambda value: float(value or 0),
+    "atoi": lambda value: int(value) if str(value).lstrip("-").isdigit()
+    else 0,
+    "until": lambda count: list(range(count)),
+    "kindIs": lambda kind, value: _kind_of(value) == kind,
+    "kindOf": lambda value: _kind_of(value),
+    "typeOf": lambda value: _kind_of(value),
+    "regexMatch": lambda pattern, value: re.search(pattern, value)
+    is not None,
+    "regexReplaceAll": lambda pattern, value, repl:
+    re.sub(pattern, re.sub(r"\$\{?(\w+)\}?", r"\\g<\1>", repl), value),
+}
+
+
+def _kind_of(value: Any) -> str:
+    """
+    Get the Go reflect kind name for a value
+    """
+    if value is None:
+        return "invalid"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float64"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, dict):
+        return "map"
+    if isinstance(value, (list, tuple)):
+        return "slice"
+    return "struct"
@@ -0,0 +1,30 @@
+{{- define "base-http.autoscaled" -}}
+{{- if and (.Values.autoscaling | default dict).enabled .Values.replicaCount -}}
+true
+{{- end -}}
+{{- end -}}
+
+{{- define "base-http.autoscaling" -}}
+{{- $fullName := default .Chart.Name  .Values.serviceName -}}
+{{- $autoscaling := .Values.autoscaling | default dict -}}
+{{- if include "base-http.autoscaled" . }}
+apiVersion: autoscaling/v2
+kind: HorizontalPodAutoscaler
+metadata:
+  name: {{ $fullName }}
+spec:
+  scaleTargetRef:
+    apiVersion: apps/v1
+    kind: Deployment
+    name: {{ $fullName }}
+  minReplicas: {{ $autoscaling.minReplicas | default 1 }}
+  maxReplicas: {{ $autoscaling.maxReplicas | default 3 }}
+  metrics:
+    - type: Resource
+      resource:
+        name: cpu
+        target:
+          type: Utilization
+          averageUtilization: {{ $autoscaling.targetCPUUtilizationPercentage | default 70 }}
+{{- end }}
+{{- end -}}
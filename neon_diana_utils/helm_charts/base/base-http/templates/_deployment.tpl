@@ -5,7 +5,9 @@ kind: Deployment
 metadata:
   name: {{ $fullName }}
 spec:
+  {{- if not (include "base-http.autoscaled" .) }}
   replicas: {{ .Values.replicaCount }}
+  {{- end }}
   selector:
     matchLabels:
       neon.diana.service: {{ $fullName }}
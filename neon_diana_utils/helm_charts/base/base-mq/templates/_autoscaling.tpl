@@ -0,0 +1,53 @@
+{{- define "base-mq.autoscaled" -}}
+{{- if and (.Values.autoscaling | default dict).enabled .Values.replicaCount -}}
+true
+{{- end -}}
+{{- end -}}
+
+{{- define "base-mq.autoscaling" -}}
+{{- $fullName := default .Chart.Name  .Values.serviceName -}}
+{{- $autoscaling := .Values.autoscaling | default dict -}}
+{{- if include "base-mq.autoscaled" . }}
+{{- if $autoscaling.queue }}
+# Scale on the length of the service's input queue; requires KEDA
+apiVersion: keda.sh/v1alpha1
+kind: ScaledObject
+metadata:
+  name: {{ $fullName }}
+spec:
+  scaleTargetRef:
+    name: {{ $fullName }}
+  minReplicaCount: {{ $autoscaling.minReplicas | default 1 }}
+  maxReplicaCount: {{ $autoscaling.maxReplicas | default 3 }}
+  triggers:
+    - type: rabbitmq
+      metadata:
+        protocol: http
+        mode: QueueLength
+        value: {{ $autoscaling.targetQueueLength | default 5 | quote }}
+        queueName: {{ $autoscaling.queue | quote }}
+        vhostName: {{ $autoscaling.vhost | default "/" | quote }}
+      authenticationRef:
+        name: {{ $autoscaling.authenticationRef | default "diana-rabbitmq-keda" }}
+{{- else }}
+apiVersion: autoscaling/v2
+kind: HorizontalPodAutoscaler
+metadata:
+  name: {{ $fullName }}
+spec:
+  scaleTargetRef:
+    apiVersion: apps/v1
+    kind: Deployment
+    name: {{ $fullName }}
+  minReplicas: {{ $autoscaling.minReplicas | default 1 }}
+  maxReplicas: {{ $autoscaling.maxReplicas | default 3 }}
+  metrics:
+    - type: Resource
+      resource:
+        name: cpu
+        target:
+          type: Utilization
+          averageUtilization: {{ $autoscaling.targetCPUUtilizationPercentage | default 70 }}
+{{- end }}
+{{- end }}
+{{- end -}}
@@ -6,7 +6,9 @@ kind: Deployment
 metadata:
   name: {{ $fullName }}
 spec:
+  {{- if not (include "base-mq.autoscaled" .) }}
   replicas: {{ .Values.replicaCount }}
+  {{- end }}
   selector:
     matchLabels:
       neon.diana.service: {{ $fullName }}
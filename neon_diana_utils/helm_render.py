@@ -0,0 +1,415 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Render the bundled Helm charts in-process, without a `helm` binary.
+Templates are evaluated with `neon_diana_utils.go_template`, which implements
+the subset of Go template and Sprig functionality these charts use.
+"""
+
+from copy import deepcopy
+from datetime import datetime
+from functools import lru_cache
+from os import stat, walk
+from os.path import join, dirname, isdir, isfile, abspath, relpath, \
+    basename, normpath
+from typing import Any, Dict, Iterable, List, Optional
+
+from neon_diana_utils.go_template import Template, SPRIG_FUNCTIONS, \
+    TemplateError
+from neon_diana_utils.imports import LazyAttribute
+
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+
+CHART_DIR = join(dirname(__file__), "helm_charts")
+DEFAULT_KUBE_VERSION = "v1.28.0"
+# Chart repository published from this package; resolved from `CHART_DIR`
+LOCAL_REPOSITORY = "https://neongeckocom.github.io/neon-diana-utils"
+
+
+class Files:
+    def __init__(self, chart_path: str):
+        """
+        Non-template files in a chart, available to templates as `.Files`
+        :param chart_path: path to the chart directory
+        """
+        self._path = chart_path
+
+    def Get(self, name: str) -> str:
+        """
+        Get the contents of a file in the chart, or an empty string if the
+        file does not exist
+        """
+        file_path = join(self._path, name)
+        if not isfile(file_path):
+            return ""
+        with open(file_path) as f:
+            return f.read()
+
+
+def _load_yaml(file_path: str) -> Any:
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(file_path) as f:
+        return yaml.load(f, Loader=loader)
+
+
+def _chart_files(path: str) -> Dict[str, tuple]:
+    """
+    Get (mtime, size) of the files in a chart that are loaded by `Chart`
+    """
+    files = dict()
+    for file in ("Chart.yaml", "values.yaml"):
+        if isfile(join(path, file)):
+            stat_result = stat(join(path, file))
+            files[file] = (stat_result.st_mtime_ns, stat_result.st_size)
+    for root, _, names in walk(join(path, "templates")):
+        for name in sorted(names):
+            stat_result = stat(join(root, name))
+            files[relpath(join(root, name), path)] = \
+                (stat_result.st_mtime_ns, stat_result.st_size)
+    return files
+
+
+class Chart:
+    def __init__(self, path: str, name: Optional[str] = None):
+        """
+        A chart loaded from disk, without its dependencies
+        :param path: path to the chart directory
+        :param name: name to use for the chart (i.e. a dependency alias)
+        """
+        self.path = abspath(path)
+        self.files = _chart_files(self.path)
+        self.metadata = _load_yaml(join(self.path, "Chart.yaml")) or dict()
+        self.name = name or self.metadata["name"]
+        self.values = _load_yaml(join(self.path, "values.yaml")) or dict() \
+            if "values.yaml" in self.files else dict()
+        self.templates: Dict[str, str] = dict()
+        for file in self.files:
+            if file.startswith("templates"):
+                with open(join(self.path, file)) as f:
+                    self.templates[file] = f.read()
+        self.dependencies: List["Chart"] = list()
+
+    @property
+    def is_library(self) -> bool:
+        return self.metadata.get("type") == "library"
+
+    def to_context(self) -> dict:
+        """
+        Get chart metadata as exposed to templates as `.Chart`
+        """
+        return {"Name": self.name,
+                "Version": self.metadata.get("version"),
+                "AppVersion": self.metadata.get("appVersion"),
+                "Description": self.metadata.get("description"),
+                "Type": self.metadata.get("type", "application"),
+                "APIVersion": self.metadata.get("apiVersion"),
+                "Annotations": self.metadata.get("annotations")}
+
+
+_CHART_CACHE: Dict[tuple, Chart] = dict()
+
+
+@lru_cache()
+def _index_charts(chart_dir: str = CHART_DIR) -> Dict[str, str]:
+    """
+    Map chart names to chart directories under `chart_dir`
+    """
+    index = dict()
+    for root, dirs, files in walk(chart_dir):
+        dirs[:] = sorted(d for d in dirs if d != "charts")
+        if "Chart.yaml" in files:
+            index.setdefault(_load_yaml(join(root, "Chart.yaml"))["name"],
+                             root)
+    return index
+
+
+def _get_chart(path: str, name: Optional[str]) -> Chart:
+    """
+    Get a Chart, reusing a previously loaded Chart if its files are unchanged.
+    Charts are treated as read-only once loaded.
+    """
+    key = (abspath(path), name)
+    chart = _CHART_CACHE.get(key)
+    if chart is None or chart.files != _chart_files(key[0]):
+        chart = _CHART_CACHE[key] = Chart(path, name)
+    return chart
+
+
+def resolve_dependency(chart_path: str, dependency: dict,
+                       chart_index: Optional[Dict[str, str]] = None) -> \
+        Optional[str]:
+    """
+    Get the local path of a chart dependency. Dependencies are resolved from
+    `file://` repositories, an unpacked `charts/` directory, or by name from
+    the charts bundled with this package.
+    :param chart_path: path to the chart declaring the dependency
+    :param dependency: dependency spec from the chart's `Chart.yaml`
+    :param chart_index: dict of chart name to path for resolving dependencies
+        (default charts in `CHART_DIR`)
+    :returns: path to the dependency chart, or None if not available locally
+    """
+    dep_name = dependency["name"]
+    repository = dependency.get("repository") or ""
+    if repository.startswith("file://"):
+        dep_path = normpath(join(chart_path, repository[len("file://"):]))
+    elif isdir(join(chart_path, "charts", dep_name)):
+        dep_path = join(chart_path, "charts", dep_name)
+    elif repository.rstrip('/') == LOCAL_REPOSITORY:
+        dep_path = (chart_index or _index_charts()).get(dep_name)
+    else:
+        dep_path = None
+    if not dep_path or not isfile(join(dep_path, "Chart.yaml")):
+        return None
+    return dep_path
+
+
+def load_chart(path: str, name: Optional[str] = None,
+               chart_index: Optional[Dict[str, str]] = None) -> Chart:
+    """
+    Load a chart and resolve its dependencies with `resolve_dependency`.
+    Remote dependencies that are not available locally are skipped with a
+    warning.
+    :param path: path to the chart directory
+    :param name: name to use for the chart (i.e. a dependency alias)
+    :param chart_index: dict of chart name to path for resolving dependencies
+    :returns: loaded Chart
+    """
+    cached = _get_chart(path, name)
+    chart = Chart.__new__(Chart)
+    chart.__dict__.update(cached.__dict__, dependencies=list())
+    for dependency in chart.metadata.get("dependencies") or []:
+        dep_path = resolve_dependency(chart.path, dependency, chart_index)
+        if not dep_path:
+            LOG.warning(f"Skipping unavailable dependency of {chart.name}: "
+                        f"{dependency['name']} "
+                        f"({dependency.get('repository')})")
+            continue
+        chart.dependencies.append(load_chart(dep_path,
+                                             dependency.get("alias"),
+                                             chart_index))
+    return chart
+
+
+def coalesce_values(overrides: Optional[dict], defaults: dict) -> dict:
+    """
+    Merge chart default values with overrides, as Helm does. Values in
+    `overrides` take precedence and a `None` override removes a default.
+    :param overrides: values overriding defaults (not modified)
+    :param defaults: default values (not modified)
+    :returns: new dict of merged values
+    """
+    merged = deepcopy(defaults)
+    for key, value in (overrides or dict()).items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = coalesce_values(value, merged[key])
+        else:
+            merged[key] = deepcopy(value)
+    return merged
+
+
+def _coalesce_dependencies(chart: Chart, values: dict):
+    """
+    Populate subchart values in `values` from dependency defaults, parent
+    overrides, and parent globals. Subchart values are nested in their
+    parent's values so changes made while rendering (i.e. with `set`) are
+    visible to both, as in Helm.
+    """
+    values.setdefault("global", dict())
+    for dependency in chart.dependencies:
+        sub_values = coalesce_values(values.get(dependency.name),
+                                     dependency.values)
+        sub_values["global"] = coalesce_values(values["global"],
+                                               sub_values.get("global") or
+                                               dict())
+        values[dependency.name] = sub_values
+        _coalesce_dependencies(dependency, sub_values)
+
+
+def _helm_functions() -> Dict[str, Any]:
+    """
+    Get Helm-specific template functions
+    """
+    import json
+    import yaml
+
+    def include(template: Template, name: str, data: Any = None) -> str:
+        return template.execute(name, data)
+    include.needs_template = True
+
+    def tpl(template: Template, source: str, data: Any) -> str:
+        return template.render(source, data, "tpl")
+    tpl.needs_template = True
+
+    def to_yaml(value: Any) -> str:
+        if value is None:
+            return "null"
+        return yaml.safe_dump(value, default_flow_style=False,
+                              sort_keys=True, allow_unicode=True,
+                              width=float("inf")).rstrip("\n")
+
+    def required(message: str, value: Any) -> Any:
+        if value is None or value == "":
+            raise TemplateError(message)
+        return value
+
+    return {"include": include,
+            "tpl": tpl,
+            "toYaml": to_yaml,
+            "fromYaml": lambda value: yaml.safe_load(value) or dict(),
+            "toJson": lambda value: json.dumps(value, separators=(",", ":")),
+            "fromJson": lambda value: json.loads(value),
+            "required": required,
+            # No cluster is available to query
+            "lookup": lambda *_: dict()}
+
+
+def _collect(chart: Chart, values: dict, base_path: str,
+             top: dict) -> Iterable[tuple]:
+    """
+    Yield (template name, source, context, render) for each template in
+    `chart` and its dependencies, dependencies first
+    """
+    for dependency in chart.dependencies:
+        yield from _collect(dependency, values[dependency.name],
+                            f"{base_path}/charts/{dependency.name}", top)
+    context = {"Values": values,
+               "Chart": chart.to_context(),
+               "Release": top["Release"],
+               "Capabilities": top["Capabilities"],
+               "Files": Files(chart.path)}
+    for path, source in chart.templates.items():
+        name = f"{base_path}/{path}"
+        file_name = basename(path)
+        render = not chart.is_library and not file_name.startswith("_") \
+            and file_name != "NOTES.txt"
+        yield name, source, dict(context, Template={
+            "Name": name, "BasePath": f"{base_path}/templates"}), render
+
+
+def render_chart(chart_path: str, values: Optional[dict] = None,
+                 value_files: Iterable[str] = (),
+                 release_name: str = "release-name",
+                 namespace: str = "default",
+                 kube_version: str = DEFAULT_KUBE_VERSION,
+                 now: Optional[datetime] = None) -> Dict[str, str]:
+    """
+    Render a chart and its dependencies, equivalent to `helm template`.
+    :param chart_path: path to the chart directory
+    :param values: values overriding the chart's `values.yaml`
+    :param value_files: YAML values files to apply, in order, before `values`
+    :param release_name: release name to render with
+    :param namespace: release namespace to render with
+    :param kube_version: Kubernetes version to report in `.Capabilities`
+    :param now: time returned by the `now` function (default current time)
+    :returns: dict of template path to rendered manifest for each template
+        that produced non-whitespace output
+    """
+    import yaml
+    chart = load_chart(chart_path)
+    overrides = dict()
+    for value_file in value_files:
+        with open(value_file) as f:
+            overrides = coalesce_values(yaml.safe_load(f) or dict(),
+                                        overrides)
+    overrides = coalesce_values(values, overrides)
+    chart_values = coalesce_values(overrides, chart.values)
+    _coalesce_dependencies(chart, chart_values)
+
+    major, minor = kube_version.lstrip("v").split(".")[:2]
+    top = {"Release": {"Name": release_name, "Namespace": namespace,
+                       "Service": "Helm", "IsInstall": True,
+                       "IsUpgrade": False, "Revision": 1},
+           "Capabilities": {"KubeVersion": {"Version": kube_version,
+                                            "GitVersion": kube_version,
+                                            "Major": major,
+                                            "Minor": minor}}}
+    functions = dict(SPRIG_FUNCTIONS, **_helm_functions())
+    if now is not None:
+        functions["now"] = lambda: now
+    template = Template(functions)
+    to_render = list()
+    for name, source, context, render in _collect(chart, chart_values,
+                                                  chart.name, top):
+        template.add(source, name)
+        if render:
+            to_render.append((name, context))
+    manifests = dict()
+    for name, context in to_render:
+        rendered = template.execute(name, context)
+        if rendered.strip():
+            manifests[name] = rendered
+    return manifests
+
+
+def parse_set_values(set_values: Iterable[str]) -> dict:
+    """
+    Parse `helm --set` style values, i.e. `backend.domain=example.com`.
+    Values are parsed as YAML scalars.
+    :param set_values: `key=value` strings; nested keys are `.` separated
+    :returns: dict of values
+    """
+    values = dict()
+    for set_value in set_values:
+        key, sep, value = set_value.partition("=")
+        if not sep or not key:
+            raise ValueError(f"Expected `key=value`, got: {set_value}")
+        keys = key.split(".")
+        target = values
+        for part in keys[:-1]:
+            target = target.setdefault(part, dict())
+        target[keys[-1]] = _parse_scalar(value)
+    return values
+
+
+def _parse_scalar(value: str) -> Any:
+    import yaml
+    try:
+        parsed = yaml.safe_load(value)
+    except yaml.YAMLError:
+        return value
+    return value if isinstance(parsed, (dict, list)) else parsed
+
+
+def format_manifests(manifests: Dict[str, str]) -> str:
+    """
+    Format rendered manifests as a multi-document YAML stream, as printed by
+    `helm template`. Manifests are split into documents as Helm does, so a
+    `---` separator does not need to be followed by a newline.
+    :param manifests: dict of template path to rendered manifest
+    :returns: YAML string
+    """
+    import re
+    documents = list()
+    for name, manifest in manifests.items():
+        for document in re.split(r"(?:^|\s*\n)---\s*", manifest):
+            if document.strip():
+                documents.append(f"---\n# Source: {name}\n"
+                                 f"{document.strip(chr(10))}\n")
+    return "".join(documents)
@@ -0,0 +1,132 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+
+from importlib import import_module
+from importlib.util import find_spec, module_from_spec, LazyLoader
+from types import ModuleType
+from typing import Any, Iterable, List, Tuple
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Import a module that is only loaded when one of its attributes is first
+    accessed. If the module is already imported, it is returned as-is.
+    :param name: fully-qualified module name
+    :returns: module object
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    spec.loader = LazyLoader(spec.loader)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class LazyAttribute:
+    def __init__(self, module: str, attribute: str):
+        """
+        Proxy for a module attribute (i.e. a logger or function) that imports
+        the module on first use. This allows deferring imports of packages
+        whose parent modules are expensive to load.
+        :param module: fully-qualified module name
+        :param attribute: name of the attribute to proxy
+        """
+        self._module = module
+        self._attribute = attribute
+        self._target = None
+
+    @property
+    def target(self) -> Any:
+        """
+        The proxied attribute, imported on first access
+        """
+        if self._target is None:
+            self._target = getattr(import_module(self._module),
+                                   self._attribute)
+        return self._target
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self.target, item)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self.target(*args, **kwargs)
+
+
+def profile_imports(modules: Iterable[str]) -> List[Tuple[str, int, int]]:
+    """
+    Import modules in a new interpreter with `-X importtime` enabled.
+    :param modules: names of modules to import
+    :returns: list of (module name, self time, cumulative time) with times
+        in microseconds, in the order imports completed
+    """
+    import subprocess
+    statement = "; ".join(f"import {module}" for module in modules)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                           statement], stderr=subprocess.PIPE,
+                          stdout=subprocess.DEVNULL, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+    results = list()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumulative_us, name = line[12:].split("|")
+            results.append((name.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            # Header line
+            continue
+    return results
+
+
+def summarize_import_profile(results: List[Tuple[str, int, int]],
+                             top: int = 15) -> str:
+    """
+    Summarize output of `profile_imports` by top-level package
+    :param results: list of (module name, self time, cumulative time)
+    :param top: number of packages to include in the summary
+    :returns: multi-line string summary
+    """
+    packages = dict()
+    for name, self_us, _ in results:
+        package = name.split('.')[0]
+        count, total = packages.get(package, (0, 0))
+        packages[package] = (count + 1, total + self_us)
+    total_us = sum(total for _, total in packages.values())
+    lines = [f"{'package':<32}{'modules':>8}{'self ms':>10}{'share':>8}"]
+    for package, (count, self_us) in sorted(packages.items(),
+                                            key=lambda p: p[1][1],
+                                            reverse=True)[:top]:
+        lines.append(f"{package:<32}{count:>8}{self_us / 1000:>10.1f}"
+                     f"{100 * self_us / max(total_us, 1):>7.1f}%")
+    lines.append(f"Total: {len(results)} modules in {total_us / 1000:.1f} ms")
+    return "\n".join(lines)
@@ -24,16 +24,10 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import yaml
-
 from typing import Optional
 from os import getenv
 from os.path import join, expanduser
 
-from ovos_utils.log import log_deprecation
-
-from neon_diana_utils.configuration import validate_output_path
-
 
 def create_github_secret(username: str, token: str,
                          output_file: Optional[str] = None) -> str:
@@ -44,11 +38,15 @@ def create_github_secret(username: str, token: str,
     :param output_file: output file to write
     :returns: path to written Kubernetes config file
     """
+    from ovos_utils.log import log_deprecation
     log_deprecation("Secret specs are handled in Helm charts. Use "
                     "`get_github_encoded_auth` to get textual config value.",
                     "2.0.0")
     import json
+    import yaml
     from base64 import b64encode
+    from neon_diana_utils.atomic import atomic_write
+    from neon_diana_utils.configuration import validate_output_path
     output_file = output_file or join(getenv("NEON_CONFIG_PATH",
                                              "~/.config/neon"),
                                       f"k8s_secret_github.yml")
@@ -70,7 +68,7 @@ def create_github_secret(username: str, token: str,
             ".dockerconfigjson": encoded_config.decode()
         }
     }
-    with open(output_file, 'w+') as f:
+    with atomic_write(output_file) as f:
         yaml.dump(secret_spec, f)
     return output_file
 
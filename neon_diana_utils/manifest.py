@@ -0,0 +1,150 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+
+from hashlib import sha256
+from os.path import isdir, isfile, join, relpath
+from typing import Any, Dict, Iterable
+
+from neon_diana_utils.atomic import atomic_write
+from neon_diana_utils.version import __version__
+
+MANIFEST_FILE = ".diana-manifest.json"
+MANIFEST_FORMAT = 1
+
+
+def hash_inputs(inputs: Any) -> str:
+    """
+    Get a stable hash of JSON-serializable generation inputs
+    :param inputs: inputs used to generate a set of outputs
+    :returns: sha256 hex digest
+    """
+    serialized = json.dumps({"version": __version__, "inputs": inputs},
+                            sort_keys=True, default=str)
+    return sha256(serialized.encode()).hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Get the sha256 hex digest of a file's contents
+    """
+    digest = sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_outputs(root: str, paths: Iterable[str]) -> Dict[str, str]:
+    """
+    Hash all files in the specified output paths
+    :param root: output root directory
+    :param paths: files or directories relative to `root` to hash
+    :returns: dict path relative to `root` to sha256 hex digest
+    """
+    hashes = dict()
+    for path in paths:
+        path = join(root, path)
+        if isfile(path):
+            hashes[relpath(path, root)] = hash_file(path)
+            continue
+        for directory, _, files in os.walk(path):
+            for file in files:
+                file_path = join(directory, file)
+                rel_path = relpath(file_path, root)
+                if rel_path != MANIFEST_FILE:
+                    hashes[rel_path] = hash_file(file_path)
+    return hashes
+
+
+class Manifest:
+    def __init__(self, output_path: str):
+        """
+        Record of the inputs and outputs of each generated section of a
+        deployment, used to regenerate only sections whose inputs changed.
+        :param output_path: deployment output directory
+        """
+        self.output_path = output_path
+        self.manifest_file = join(output_path, MANIFEST_FILE)
+        self.sections: Dict[str, dict] = dict()
+        if isfile(self.manifest_file):
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+            if manifest.get("format") == MANIFEST_FORMAT:
+                self.sections = manifest.get("sections") or dict()
+
+    def is_current(self, section: str, inputs_hash: str) -> bool:
+        """
+        Check if a section was generated from the specified inputs and its
+        outputs have not since been modified
+        :param section: name of generated section
+        :param inputs_hash: hash of section inputs from `hash_inputs`
+        :returns: True if the section does not need to be regenerated
+        """
+        record = self.sections.get(section)
+        if not record or record.get("inputs") != inputs_hash:
+            return False
+        outputs = record.get("outputs") or dict()
+        for path, file_hash in outputs.items():
+            file_path = join(self.output_path, path)
+            if not isfile(file_path) or hash_file(file_path) != file_hash:
+                return False
+        return bool(outputs)
+
+    def record(self, section: str, inputs_hash: str, paths: Iterable[str]):
+        """
+        Record the inputs and outputs of a generated section
+        :param section: name of generated section
+        :param inputs_hash: hash of section inputs from `hash_inputs`
+        :param paths: output files or directories relative to `output_path`
+        """
+        self.sections[section] = {
+            "inputs": inputs_hash,
+            "outputs": hash_outputs(self.output_path, paths)}
+
+    def update_outputs(self, sections: Iterable[str], paths: Iterable[str]):
+        """
+        Record the current outputs of already recorded sections, i.e. for
+        sections that share output files that other sections may rewrite
+        :param sections: names of recorded sections to update
+        :param paths: output files or directories relative to `output_path`
+        """
+        outputs = hash_outputs(self.output_path, paths)
+        for section in sections:
+            if section in self.sections:
+                self.sections[section]["outputs"] = dict(outputs)
+
+    def save(self):
+        """
+        Write the manifest to the output directory
+        """
+        if not isdir(self.output_path):
+            os.makedirs(self.output_path)
+        with atomic_write(self.manifest_file) as f:
+            json.dump({"format": MANIFEST_FORMAT, "sections": self.sections},
+                      f, indent=2, sort_keys=True)
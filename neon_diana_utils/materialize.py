@@ -0,0 +1,136 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import errno
+import filecmp
+import os
+
+from enum import Enum
+from os.path import join, relpath
+from typing import Iterable
+
+from neon_diana_utils.imports import lazy_import, LazyAttribute
+
+shutil = lazy_import("shutil")
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+
+# `FICLONE` ioctl request; clones a file on copy-on-write filesystems
+# (i.e. btrfs, xfs) on Linux
+_FICLONE = 0x40049409
+# Errors indicating the filesystem does not support a link type, in which case
+# the link type is not attempted again for the rest of a tree
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY,
+                       errno.EOPNOTSUPP, errno.ENOSYS, errno.EMLINK}
+
+
+class LinkMode(Enum):
+    """
+    Enum representing how unmodified template files are materialized
+    """
+    COPY = "copy"
+    # Copy-on-write clone; equivalent to a copy, but shares storage until
+    # modified. Falls back to copy where unsupported
+    REFLINK = "reflink"
+    # Hard link; files share an inode with the installed package and MUST NOT
+    # be modified in place. Falls back to copy where unsupported
+    HARDLINK = "hardlink"
+    # Reflink where supported, else copy
+    AUTO = "auto"
+
+
+def _reflink(src: str, dst: str):
+    """
+    Clone `src` to `dst` with the `FICLONE` ioctl
+    """
+    import fcntl
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _matches(path: str, prefixes: Iterable[str]) -> bool:
+    """
+    Check if a relative path is any of `prefixes` or is contained in one
+    """
+    return any(path == p or path.startswith(f"{p}{os.sep}") for p in prefixes)
+
+
+def materialize_tree(src: str, dst: str, mode: LinkMode = LinkMode.AUTO,
+                     exclude: Iterable[str] = (),
+                     copy: Iterable[str] = ()) -> str:
+    """
+    Materialize a template directory, linking files where supported instead of
+    copying them. Files that will be written by the caller should be
+    `exclude`d and files that will be modified in place must be in `copy` so
+    that linked files are never modified.
+    :param src: template directory to materialize
+    :param dst: output directory; files that already exist in `dst` are
+        left in place if unchanged, else replaced
+    :param mode: how to materialize files that are not excluded or copied
+    :param exclude: paths relative to `src` that are not materialized
+    :param copy: paths relative to `src` that are always copied
+    :returns: path to materialized tree
+    """
+    if mode not in (LinkMode.HARDLINK, LinkMode.REFLINK, LinkMode.AUTO):
+        mode = LinkMode.COPY
+    exclude = tuple(exclude)
+    copy = tuple(copy)
+    for root, dirs, files in os.walk(src):
+        rel_root = relpath(root, src)
+        os.makedirs(join(dst, rel_root), exist_ok=True)
+        for file in files:
+            rel_file = os.path.normpath(join(rel_root, file))
+            if _matches(rel_file, exclude):
+                continue
+            src_file = join(root, file)
+            dst_file = join(dst, rel_file)
+            if os.path.lexists(dst_file):
+                if os.path.isfile(dst_file) and \
+                        filecmp.cmp(src_file, dst_file, shallow=False):
+                    # Leave unchanged files (and their mtimes) untouched
+                    continue
+                # Replace rather than write through an existing link
+                os.remove(dst_file)
+            if mode != LinkMode.COPY and not _matches(rel_file, copy):
+                try:
+                    if mode == LinkMode.HARDLINK:
+                        os.link(src_file, dst_file)
+                    else:
+                        _reflink(src_file, dst_file)
+                    continue
+                except (OSError, ImportError) as e:
+                    if isinstance(e, OSError) and \
+                            e.errno not in _UNSUPPORTED_ERRNOS:
+                        raise e
+                    LOG.debug(f"{mode.value} not supported for {dst}: {e}")
+                    mode = LinkMode.COPY
+            shutil.copy2(src_file, dst_file)
+    return dst
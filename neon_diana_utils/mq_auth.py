@@ -0,0 +1,278 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Index of MQ users, the services that authenticate as them, and their
+credentials. The user-to-service mapping (`mq_user_mapping.yml`) is compiled
+once and shared; each index only adds the users of one RabbitMQ
+configuration, so lookups and per-user updates take constant time regardless
+of how many services are mapped.
+"""
+
+from collections import OrderedDict
+from os import stat
+from os.path import isfile
+from threading import Lock
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+# Users whose services are configured by the chatbots deployment
+CHATBOT_USERS = ("neon_bot_submind", "neon_bot_facilitator")
+
+_COMPILED_LOCK = Lock()
+_COMPILED: Optional[tuple] = None
+# Most recently used indexes of RabbitMQ configuration files
+_FILE_CACHE: Dict[Tuple[str, Optional[str]],
+                  Tuple[tuple, "MQAuthIndex"]] = OrderedDict()
+_FILE_CACHE_SIZE = 8
+_FILE_CACHE_LOCK = Lock()
+
+
+def _compile_mapping(mapping: Mapping[str, Iterable[str]]) \
+        -> Tuple[Dict[str, Tuple[str, ...]], Dict[str, str]]:
+    """
+    Build user to services and service to user lookups from a mapping.
+    If a service is mapped to more than one user, the last user is used.
+    """
+    user_services = {user: tuple(services or ())
+                     for user, services in mapping.items()}
+    service_users = {service: user for user, services in user_services.items()
+                     for service in services}
+    return user_services, service_users
+
+
+def _default_mapping() -> Tuple[Dict[str, Tuple[str, ...]], Dict[str, str]]:
+    """
+    Get the compiled `mq_user_mapping.yml`, recompiling only if the template
+    changed
+    """
+    global _COMPILED
+    from neon_diana_utils.configuration import load_template
+    mapping = load_template("mq_user_mapping.yml", mutable=False)
+    with _COMPILED_LOCK:
+        if _COMPILED is None or _COMPILED[0] is not mapping:
+            _COMPILED = (mapping, *_compile_mapping(mapping))
+        return _COMPILED[1], _COMPILED[2]
+
+
+def clear_file_cache():
+    """
+    Drop all cached indexes of RabbitMQ configuration files, i.e. after
+    generating a deployment so its passwords are not kept in memory
+    """
+    with _FILE_CACHE_LOCK:
+        _FILE_CACHE.clear()
+
+
+class MQAuthIndex:
+    def __init__(self, mapping: Optional[Mapping[str, Iterable[str]]] = None):
+        """
+        Create an empty index of MQ users
+        :param mapping: optional dict of MQ username to service names;
+            defaults to `mq_user_mapping.yml`
+        """
+        if mapping is None:
+            self._user_services, self._service_users = _default_mapping()
+        else:
+            self._user_services, self._service_users = \
+                _compile_mapping(mapping)
+        # Compiled mappings may be shared; copy before modifying
+        self._shared_mapping = True
+        self._passwords: Dict[str, str] = dict()
+        self._tags: Dict[str, str] = dict()
+        self._auth: Dict[str, dict] = dict()
+
+    @classmethod
+    def from_definitions(cls, definitions: dict,
+                         mapping: Optional[Mapping[str,
+                                                   Iterable[str]]] = None) \
+            -> "MQAuthIndex":
+        """
+        Build an index of the users in RabbitMQ definitions
+        :param definitions: RabbitMQ definitions, i.e. from
+            `generate_rmq_config`
+        :param mapping: optional user to services mapping
+        """
+        index = cls(mapping)
+        for user in definitions.get('users') or []:
+            index.add_user(user)
+        return index
+
+    @classmethod
+    def from_file(cls, rmq_config: str,
+                  auth_config: Optional[str] = None) -> "MQAuthIndex":
+        """
+        Get an index of the users in a RabbitMQ configuration file. Indexes
+        of recently read files are cached until the file is modified, so the
+        returned index is shared and should not be modified; use `copy` to
+        get a private one.
+        :param rmq_config: path to RabbitMQ definitions
+        :param auth_config: optional path to a backend config (`diana.yaml`)
+            to read passwords of users with hashed passwords from
+        """
+        from neon_diana_utils.rabbitmq_definitions import \
+            iter_definitions_section
+        signature = tuple((st.st_mtime_ns, st.st_size, st.st_ino) for st in
+                          (stat(path) for path in (rmq_config, auth_config)
+                           if path and isfile(path)))
+        key = (rmq_config, auth_config)
+        with _FILE_CACHE_LOCK:
+            cached = _FILE_CACHE.get(key)
+            if cached and cached[0] == signature and \
+                    cached[1]._user_services is _default_mapping()[0]:
+                _FILE_CACHE.move_to_end(key)
+                return cached[1]
+        index = cls()
+        with open(rmq_config) as f:
+            for user in iter_definitions_section(f, 'users'):
+                index.add_user(user)
+        if auth_config and isfile(auth_config) and \
+                None in index._passwords.values():
+            import yaml
+            with open(auth_config) as f:
+                config = yaml.safe_load(f) or dict()
+            index.add_auth_config((config.get("MQ") or dict()).get("users")
+                                  or dict())
+        with _FILE_CACHE_LOCK:
+            _FILE_CACHE[key] = (signature, index)
+            _FILE_CACHE.move_to_end(key)
+            while len(_FILE_CACHE) > _FILE_CACHE_SIZE:
+                _FILE_CACHE.popitem(last=False)
+        return index
+
+    def copy(self) -> "MQAuthIndex":
+        """
+        Get a copy of this index that may be modified independently
+        """
+        index = MQAuthIndex.__new__(MQAuthIndex)
+        index._user_services = self._user_services
+        index._service_users = self._service_users
+        index._shared_mapping = True
+        self._shared_mapping = True
+        index._passwords = dict(self._passwords)
+        index._tags = dict(self._tags)
+        index._auth = dict(self._auth)
+        return index
+
+    def add_user(self, user: dict):
+        """
+        Add or update a user from RabbitMQ definitions
+        :param user: dict with `name`, `password`, and optional `tags`
+        """
+        name = user['name']
+        self._passwords[name] = user.get('password')
+        tags = user.get('tags') or ()
+        if isinstance(tags, str):
+            tags = tags.split(',')
+        for tag in tags:
+            self._tags.setdefault(tag.strip(), name)
+        credentials = {"user": name, "password": user.get('password')}
+        for service in self._user_services.get(name, ()):
+            self._auth[service] = credentials
+
+    def add_auth_config(self, auth_config: Mapping[str, dict]):
+        """
+        Fill in passwords of indexed users that have no plaintext password
+        (i.e. users with a `password_hash`) from an MQ auth config
+        :param auth_config: dict service name to `user` and `password`,
+            i.e. from `auth_config`
+        """
+        for credentials in auth_config.values():
+            name = (credentials or dict()).get("user")
+            password = credentials.get("password") if name else None
+            if not password or name not in self._passwords or \
+                    self._passwords[name] is not None:
+                continue
+            self._passwords[name] = password
+            for service in self._user_services.get(name, ()):
+                self._auth[service] = {"user": name, "password": password}
+
+    def map_service(self, user: str, service: str):
+        """
+        Map a service to authenticate as a user, i.e. for an added bot
+        :param user: MQ username
+        :param service: service name
+        """
+        if self._shared_mapping:
+            self._user_services = dict(self._user_services)
+            self._service_users = dict(self._service_users)
+            self._shared_mapping = False
+        previous = self._service_users.get(service)
+        if previous and previous != user:
+            self._user_services[previous] = tuple(
+                s for s in self._user_services[previous] if s != service)
+            self._auth.pop(service, None)
+        if service not in self._user_services.get(user, ()):
+            self._user_services[user] = \
+                (*self._user_services.get(user, ()), service)
+        self._service_users[service] = user
+        if user in self._passwords:
+            self._auth[service] = {"user": user,
+                                   "password": self._passwords[user]}
+
+    def services(self, user: str) -> Tuple[str, ...]:
+        """
+        Get the services that authenticate as a user
+        """
+        return self._user_services.get(user, ())
+
+    def user(self, service: str) -> Optional[str]:
+        """
+        Get the MQ username a service authenticates as
+        """
+        return self._service_users.get(service)
+
+    def password(self, user: str) -> Optional[str]:
+        """
+        Get a user's password, if the user is indexed
+        """
+        return self._passwords.get(user)
+
+    def credentials(self, service: str) -> Optional[dict]:
+        """
+        Get the MQ auth for a service
+        :returns: dict `user` and `password` if the service's user is
+            indexed, else None
+        """
+        credentials = self._auth.get(service)
+        return dict(credentials) if credentials else None
+
+    def find_tag(self, tag: str) -> Optional[dict]:
+        """
+        Get the first user with the specified tag
+        :returns: dict `user` and `password` if a matching user exists
+        """
+        user = self._tags.get(tag)
+        if user is None:
+            return None
+        return {"user": user, "password": self._passwords[user]}
+
+    def auth_config(self) -> Dict[str, dict]:
+        """
+        Get MQ auth for every service whose user is indexed
+        :returns: dict service name to `user` and `password`
+        """
+        return {service: dict(credentials)
+                for service, credentials in self._auth.items()}
@@ -0,0 +1,487 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure MQ round-trip latency and throughput for the vhost and permission
+layout generated by `generate_rmq_config`. Each benchmarked service user
+connects to its vhost, publishes requests to a queue, and an echo responder
+(also connected as that user) replies on a second queue, mirroring the
+request/response pattern used by DIANA MQ services.
+"""
+
+import json
+import re
+import secrets
+import threading
+import time
+
+from queue import Queue, Empty
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Optional
+
+from neon_diana_utils.imports import LazyAttribute
+
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+
+DEFAULT_EXCHANGE = "amq.default"
+BENCH_PREFIX = "bench_"
+
+
+class BenchTarget(NamedTuple):
+    """
+    A service user and vhost to benchmark
+    """
+    user: str
+    vhost: str
+    password: str
+    queue_prefix: str = ""
+
+    @property
+    def request_queue(self) -> str:
+        return f"{self.queue_prefix}{self.user}.bench.in"
+
+    @property
+    def reply_queue(self) -> str:
+        return f"{self.queue_prefix}{self.user}.bench.out"
+
+
+class BenchResult(NamedTuple):
+    """
+    Latency and throughput measured for one target. Latencies are in ms.
+    """
+    user: str
+    vhost: str
+    messages: int
+    errors: int
+    elapsed: float
+    p50: float
+    p95: float
+    p99: float
+    error: Optional[str] = None
+
+    @property
+    def rate(self) -> float:
+        """
+        Round trips completed per second
+        """
+        completed = self.messages - self.errors
+        return completed / self.elapsed if self.elapsed else 0.0
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    Get the nearest-rank percentile of sorted values
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-pct * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def bench_definitions(definitions: dict, prefix: str = BENCH_PREFIX) -> dict:
+    """
+    Copy RabbitMQ definitions with users and vhosts renamed so benchmarks do
+    not change the passwords of users on a live broker. Permissions are
+    preserved. Admin users are not included.
+    :param definitions: RabbitMQ definitions, i.e. from `generate_rmq_config`
+    :param prefix: prefix to add to user names and vhost names
+    :returns: dict definitions for benchmarking
+    """
+    def _user(name: str) -> str:
+        return f"{prefix}{name}"
+
+    def _vhost(name: str) -> str:
+        return f"/{prefix}{name.lstrip('/')}" if prefix else name
+
+    users = [{**user, "name": _user(user['name']),
+              "password": user.get('password') or secrets.token_urlsafe(16)}
+             for user in definitions.get('users') or []
+             if "administrator" not in (user.get('tags') or [])]
+    names = {user['name'] for user in users}
+    return {"users": users,
+            "vhosts": [{**vhost, "name": _vhost(vhost['name'])}
+                       for vhost in definitions.get('vhosts') or []],
+            "permissions": [{**perm, "user": _user(perm['user']),
+                             "vhost": _vhost(perm['vhost'])}
+                            for perm in definitions.get('permissions') or []
+                            if _user(perm['user']) in names]}
+
+
+def _queue_prefix(pattern: str) -> str:
+    """
+    Get the literal prefix of a permission pattern (i.e. `chat_gpt_` from
+    `chat_gpt_.*`) so benchmark queues are named within a user's permissions
+    """
+    pattern = pattern.split('|')[0].lstrip('^')
+    return re.match(r"(?:[\w\-]|\\.)*", pattern).group(0).replace("\\", "")
+
+
+def plan_targets(definitions: dict,
+                 services: Optional[Iterable[str]] = None,
+                 prefix: str = BENCH_PREFIX) -> List[BenchTarget]:
+    """
+    Get the (user, vhost) pairs to benchmark from definitions
+    :param definitions: definitions to benchmark, i.e. `bench_definitions`
+    :param services: optional user names (without `prefix`) to limit
+        benchmarks to
+    :param prefix: prefix added to user names by `bench_definitions`
+    :returns: list of BenchTarget
+    """
+    passwords = {user['name']: user['password']
+                 for user in definitions.get('users') or []}
+    users = {f"{prefix}{service}" for service in services or []}
+    return [BenchTarget(perm['user'], perm['vhost'], passwords[perm['user']],
+                        _queue_prefix(perm['configure']))
+            for perm in definitions.get('permissions') or []
+            if perm['user'] in passwords and
+            (not users or perm['user'] in users)]
+
+
+class _LocalChannel:
+    def __init__(self, broker: "LocalBroker", vhost: str, user: str):
+        self._broker = broker
+        self._vhost = vhost
+        self._user = user
+
+    def _check(self, access: str, resource: str):
+        if not self._broker.is_permitted(self._user, self._vhost, access,
+                                         resource):
+            raise PermissionError(f"{self._user} cannot {access} {resource} "
+                                  f"in {self._vhost}")
+
+    def declare_queue(self, name: str):
+        self._check("configure", name)
+        self._broker.queue(self._vhost, name)
+
+    def publish(self, queue: str, body: bytes):
+        self._check("write", DEFAULT_EXCHANGE)
+        self._broker.queue(self._vhost, queue).put(body)
+
+    def get(self, queue: str, timeout: float) -> Optional[bytes]:
+        self._check("read", queue)
+        try:
+            return self._broker.queue(self._vhost, queue).get(timeout=timeout)
+        except Empty:
+            return None
+
+    def delete_queue(self, name: str):
+        self._check("configure", name)
+        self._broker.delete_queue(self._vhost, name)
+
+    def close(self):
+        pass
+
+
+class LocalBroker:
+    def __init__(self):
+        """
+        In-memory stand-in for a RabbitMQ broker. Definitions are applied with
+        the same `import_definitions` interface as `RabbitMQAPI`, and
+        connections enforce the configure/write/read permission patterns,
+        so benchmark layouts can be validated without a running server.
+        """
+        self._lock = threading.Lock()
+        self.users: Dict[str, dict] = dict()
+        self.vhosts: Dict[str, dict] = dict()
+        self.permissions: Dict[tuple, dict] = dict()
+        self._queues: Dict[tuple, Queue] = dict()
+
+    def import_definitions(self, definitions: dict, batch_size=None) \
+            -> Dict[str, Dict[Hashable, bool]]:
+        """
+        Apply users, vhosts, and permissions from definitions
+        :param definitions: RabbitMQ definitions
+        :param batch_size: ignored; accepted for RabbitMQAPI compatibility
+        :returns: dict of section name to dict of object key to True
+        """
+        from neon_diana_utils.rabbitmq_definitions import definition_key
+        report = dict()
+        with self._lock:
+            for vhost in definitions.get('vhosts') or []:
+                self.vhosts[vhost['name']] = vhost
+            for user in definitions.get('users') or []:
+                self.users[user['name']] = user
+            for perm in definitions.get('permissions') or []:
+                self.permissions[(perm['user'], perm['vhost'])] = perm
+        for section in ("vhosts", "users", "permissions"):
+            for obj in definitions.get(section) or []:
+                report.setdefault(section,
+                                  dict())[definition_key(section, obj)] = True
+        return report
+
+    def delete_user(self, user: str) -> bool:
+        with self._lock:
+            self.permissions = {k: v for k, v in self.permissions.items()
+                                if k[0] != user}
+            return self.users.pop(user, None) is not None
+
+    def delete_vhost(self, vhost: str) -> bool:
+        with self._lock:
+            self.permissions = {k: v for k, v in self.permissions.items()
+                                if k[1] != vhost}
+            self._queues = {k: v for k, v in self._queues.items()
+                            if k[0] != vhost}
+            return self.vhosts.pop(vhost, None) is not None
+
+    def is_permitted(self, user: str, vhost: str, access: str,
+                     resource: str) -> bool:
+        """
+        Check if a user may access a resource, matching permission patterns
+        unanchored as RabbitMQ does
+        :param access: `configure`, `write`, or `read`
+        """
+        perm = self.permissions.get((user, vhost))
+        return bool(perm and re.search(perm[access], resource))
+
+    def queue(self, vhost: str, name: str) -> Queue:
+        with self._lock:
+            return self._queues.setdefault((vhost, name), Queue())
+
+    def delete_queue(self, vhost: str, name: str):
+        with self._lock:
+            self._queues.pop((vhost, name), None)
+
+    def connect(self, vhost: str, user: str, password: str) -> _LocalChannel:
+        """
+        Open a channel on a vhost as a user
+        :raises PermissionError: if the login or vhost access is refused
+        """
+        account = self.users.get(user)
+        if not account or account.get('password') != password:
+            raise PermissionError(f"Login refused for {user}")
+        if (user, vhost) not in self.permissions:
+            raise PermissionError(f"{user} has no access to {vhost}")
+        return _LocalChannel(self, vhost, user)
+
+
+class _PikaChannel:
+    def __init__(self, connection):
+        self._connection = connection
+        self._channel = connection.channel()
+        self._consumers = dict()
+
+    def declare_queue(self, name: str):
+        self._channel.queue_declare(name, auto_delete=True)
+
+    def publish(self, queue: str, body: bytes):
+        self._channel.basic_publish("", queue, body)
+
+    def get(self, queue: str, timeout: float) -> Optional[bytes]:
+        if queue not in self._consumers:
+            self._consumers[queue] = self._channel.consume(
+                queue, auto_ack=True, inactivity_timeout=timeout)
+        method, _, body = next(self._consumers[queue])
+        return None if method is None else body
+
+    def delete_queue(self, name: str):
+        self._channel.queue_delete(name)
+
+    def close(self):
+        self._connection.close()
+
+
+class PikaConnector:
+    def __init__(self, host: str = "localhost", port: int = 5672):
+        """
+        Opens AMQP connections to a RabbitMQ broker. Requires `pika`.
+        :param host: broker hostname
+        :param port: broker AMQP port
+        """
+        self.host = host
+        self.port = port
+
+    def connect(self, vhost: str, user: str, password: str) -> _PikaChannel:
+        import pika
+        params = pika.ConnectionParameters(
+            host=self.host, port=self.port, virtual_host=vhost,
+            credentials=pika.PlainCredentials(user, password))
+        return _PikaChannel(pika.BlockingConnection(params))
+
+
+def _respond(channel, target: BenchTarget, stop: threading.Event,
+             timeout: float):
+    while not stop.is_set():
+        body = channel.get(target.request_queue, timeout)
+        if body is not None:
+            channel.publish(target.reply_queue, body)
+
+
+def bench_target(connector, target: BenchTarget, messages: int = 1000,
+                 in_flight: int = 1, message_size: int = 256,
+                 timeout: float = 5.0) -> BenchResult:
+    """
+    Measure round-trip latency between a requester and an echo responder
+    connected to the target vhost as the target user.
+    :param connector: object with `connect(vhost, user, password)`, i.e.
+        LocalBroker or PikaConnector
+    :param target: user and vhost to benchmark
+    :param messages: number of round trips to measure
+    :param in_flight: max number of requests awaiting a reply
+    :param message_size: request body size in bytes
+    :param timeout: seconds to wait for a reply before giving up
+    :returns: BenchResult
+    """
+    stop = threading.Event()
+    channels = list()
+    responder = None
+    sent = [0.0] * messages
+    latencies = list()
+    start = time.perf_counter()
+    try:
+        requester = connector.connect(target.vhost, target.user,
+                                      target.password)
+        channels.append(requester)
+        for queue in (target.request_queue, target.reply_queue):
+            requester.declare_queue(queue)
+        channels.append(connector.connect(target.vhost, target.user,
+                                          target.password))
+        responder = threading.Thread(target=_respond, args=(
+            channels[-1], target, stop, min(timeout, 0.1)), daemon=True)
+        responder.start()
+
+        padding = b"\0" * max(0, message_size - 8)
+        start = time.perf_counter()
+        next_seq = 0
+        while next_seq < min(in_flight, messages):
+            sent[next_seq] = time.perf_counter()
+            requester.publish(target.request_queue,
+                              next_seq.to_bytes(8, "big") + padding)
+            next_seq += 1
+        while len(latencies) < messages:
+            body = requester.get(target.reply_queue, timeout)
+            if body is None:
+                break
+            now = time.perf_counter()
+            latencies.append(now - sent[int.from_bytes(body[:8], "big")])
+            if next_seq < messages:
+                sent[next_seq] = time.perf_counter()
+                requester.publish(target.request_queue,
+                                  next_seq.to_bytes(8, "big") + padding)
+                next_seq += 1
+        error = None
+    except Exception as e:
+        LOG.error(f"Benchmark failed for {target.user} in {target.vhost}: "
+                  f"{e}")
+        error = str(e)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if responder:
+        responder.join()
+    if channels:
+        try:
+            for queue in (target.request_queue, target.reply_queue):
+                channels[0].delete_queue(queue)
+        except Exception as e:
+            LOG.debug(f"Failed to remove benchmark queues: {e}")
+    for channel in channels:
+        channel.close()
+    latencies = sorted(latency * 1000 for latency in latencies)
+    return BenchResult(target.user, target.vhost, messages,
+                       messages - len(latencies), elapsed,
+                       percentile(latencies, 50), percentile(latencies, 95),
+                       percentile(latencies, 99), error)
+
+
+def run_benchmark(connector, targets: List[BenchTarget], messages: int = 1000,
+                  in_flight: int = 1, message_size: int = 256,
+                  timeout: float = 5.0, concurrency: int = 1) \
+        -> List[BenchResult]:
+    """
+    Benchmark each target, running up to `concurrency` targets at a time
+    :returns: list of BenchResult in the order of `targets`
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max(1, concurrency)) as executor:
+        return list(executor.map(
+            lambda t: bench_target(connector, t, messages, in_flight,
+                                   message_size, timeout), targets))
+
+
+def cleanup_definitions(api, definitions: dict):
+    """
+    Remove users and vhosts created for a benchmark
+    :param api: RabbitMQAPI or LocalBroker the definitions were applied to
+    :param definitions: definitions from `bench_definitions`
+    """
+    for user in definitions.get('users') or []:
+        api.delete_user(user['name'])
+    for vhost in definitions.get('vhosts') or []:
+        api.delete_vhost(vhost['name'])
+
+
+def format_bench_report(results: List[BenchResult]) -> str:
+    """
+    Format benchmark results as a table
+    """
+    lines = [f"{'user':<32}{'vhost':<28}{'msg/s':>10}{'p50 ms':>9}"
+             f"{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"]
+    for result in results:
+        lines.append(f"{result.user:<32}{result.vhost:<28}"
+                     f"{result.rate:>10.1f}{result.p50:>9.2f}"
+                     f"{result.p95:>9.2f}{result.p99:>9.2f}"
+                     f"{result.errors:>8}")
+        if result.error:
+            lines.append(f"  {result.error}")
+    return "\n".join(lines)
+
+
+def report_to_dict(results: List[BenchResult], **metadata) -> dict:
+    """
+    Serialize results as a baseline document
+    :param metadata: additional values to record, i.e. `version`
+    """
+    return {**metadata,
+            "results": [{**result._asdict(), "rate": result.rate}
+                        for result in results]}
+
+
+def compare_reports(baseline: dict, current: dict,
+                    tolerance: float = 0.2) -> List[str]:
+    """
+    Find regressions relative to a baseline report
+    :param baseline: dict from `report_to_dict`
+    :param current: dict from `report_to_dict`
+    :param tolerance: allowed fractional increase in p95 latency or decrease
+        in throughput
+    :returns: list of regression descriptions
+    """
+    previous = {(r['user'], r['vhost']): r for r in baseline['results']}
+    regressions = list()
+    for result in current['results']:
+        old = previous.get((result['user'], result['vhost']))
+        if not old:
+            continue
+        name = f"{result['user']} ({result['vhost']})"
+        if result['errors'] > old['errors']:
+            regressions.append(f"{name}: {result['errors']} errors "
+                               f"(was {old['errors']})")
+        if old['p95'] and result['p95'] > old['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95']:.2f}ms "
+                               f"(was {old['p95']:.2f}ms)")
+        if result['rate'] < old['rate'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['rate']:.1f} msg/s "
+                               f"(was {old['rate']:.1f} msg/s)")
+    return regressions
+
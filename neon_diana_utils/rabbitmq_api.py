@@ -27,20 +27,82 @@
 import json
 import requests
 
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, \
+    Tuple, Union
 from urllib.parse import quote_plus
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+from neon_diana_utils.imports import LazyAttribute
+from neon_diana_utils.rabbitmq_definitions import DEFINITION_SECTIONS, \
+    definition_key, iter_definitions_section
+
+LOG = LazyAttribute("ovos_utils.log", "LOG")
 
 
 class RabbitMQAPI:
-    def __init__(self, url: str, verify_ssl: bool = False):
+    def __init__(self, url: str, verify_ssl: bool = False,
+                 pool_size: int = 10, max_retries: int = 3,
+                 backoff_factor: float = 0.3,
+                 timeout: Union[float, Tuple[float, float]] = (5.0, 30.0)):
         """
-        Creates an object used to interface with a RabbitMQ server
+        Creates an object used to interface with a RabbitMQ server. Requests
+        are made through a pooled, keep-alive session; call `close` or use
+        this object as a context manager to release pooled connections.
         :param url: Management URL (usually IP:port)
+        :param verify_ssl: if True, verify the server's SSL certificate
+        :param pool_size: max number of connections kept alive in the pool
+        :param max_retries: number of times to retry a failed request
+        :param backoff_factor: exponential backoff factor between retries
+        :param timeout: request timeout in seconds or (connect, read) tuple
         """
         self._verify_ssl = verify_ssl
         self.console_url = url
         self._username = None
         self._password = None
+        self._pool_size = pool_size
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+        self._timeout = timeout
+        self._session: Optional[requests.Session] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Pooled HTTP session used for all requests to the management API.
+        """
+        if self._session is None:
+            retry = Retry(total=self._max_retries,
+                          backoff_factor=self._backoff_factor,
+                          status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=("GET", "PUT", "DELETE"),
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=self._pool_size,
+                                  pool_maxsize=self._pool_size,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            session.verify = self._verify_ssl
+            session.auth = self.auth
+            self._session = session
+        return self._session
+
+    def close(self):
+        """
+        Close the HTTP session and release any pooled connections
+        """
+        if self._session is not None:
+            self._session.close()
+            self._session = None
 
     def login(self, username: str, password: str):
         """
@@ -50,8 +112,17 @@ class RabbitMQAPI:
         """
         self._username = username
         self._password = password
+        if self._session is not None:
+            self._session.auth = self.auth
         # TODO: Check auth and return DM
 
+    @property
+    def username(self) -> Optional[str]:
+        """
+        Name of the user requests are authenticated as
+        """
+        return self._username
+
     @property
     def auth(self):
         """
@@ -59,30 +130,49 @@ class RabbitMQAPI:
         """
         return HTTPBasicAuth(self._username, self._password)
 
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Make a request to the management API with the pooled session
+        :param method: HTTP method
+        :param path: API path, i.e. `/api/vhosts`
+        :returns: Response object
+        """
+        kwargs.setdefault("timeout", self._timeout)
+        return self.session.request(method, f"{self.console_url}{path}",
+                                    **kwargs)
+
     def add_vhost(self, vhost: str) -> bool:
         """
         Add a vhost to the server
         :param vhost: vhost to add
         :return: True if request was successful
         """
-        status = requests.put(
-            f"{self.console_url}/api/vhosts/{quote_plus(vhost)}",
-            auth=self.auth, verify=self._verify_ssl)
+        status = self._request("PUT", f"/api/vhosts/{quote_plus(vhost)}")
         return status.ok
 
-    def add_user(self, user: str, password: str, tags: str = "") -> bool:
+    def add_user(self, user: str, password: Optional[str], tags: str = "",
+                 password_hash: Optional[str] = None,
+                 hashing_algorithm: Optional[str] = None) -> bool:
         """
         Add a user to the server
         :param user: username to add
         :param password: password for user
         :param tags: comma-delimited list of tags to assign to new user
+        :param password_hash: optional password hash to set instead of
+            `password`, i.e. from `hash_password`
+        :param hashing_algorithm: RabbitMQ algorithm `password_hash` was
+            computed with
         :return: True if request was successful
         """
         tags = tags or ""
-        body = {"password": password, "tags": tags}
-        status = requests.put(
-            f"{self.console_url}/api/users/{quote_plus(user)}",
-            data=json.dumps(body), auth=self.auth, verify=self._verify_ssl)
+        if password_hash:
+            body = {"password_hash": password_hash, "tags": tags,
+                    "hashing_algorithm": hashing_algorithm or
+                    "rabbit_password_hashing_sha256"}
+        else:
+            body = {"password": password, "tags": tags}
+        status = self._request("PUT", f"/api/users/{quote_plus(user)}",
+                               data=json.dumps(body))
         return status.ok
 
     def delete_user(self, user: str) -> bool:
@@ -90,9 +180,7 @@ class RabbitMQAPI:
         Delete a user from the server
         :param user: username to remove
         """
-        status = requests.delete(
-            f"{self.console_url}/api/users/{quote_plus(user)}",
-            auth=self.auth, verify=self._verify_ssl)
+        status = self._request("DELETE", f"/api/users/{quote_plus(user)}")
         return status.ok
 
     def configure_vhost_user_permissions(self, vhost: str, user: str,
@@ -109,13 +197,32 @@ class RabbitMQAPI:
         :param read: regex read permissions
         :return: True if request was successful
         """
-        url = f"{self.console_url}/api/permissions/{quote_plus(vhost)}/" \
-              f"{quote_plus(user)}"
+        path = f"/api/permissions/{quote_plus(vhost)}/{quote_plus(user)}"
         body = {"configure": configure,
                 "write": write,
                 "read": read}
-        status = requests.put(url, data=json.dumps(body), auth=self.auth,
-                              verify=self._verify_ssl)
+        status = self._request("PUT", path, data=json.dumps(body))
+        return status.ok
+
+    def delete_vhost(self, vhost: str) -> bool:
+        """
+        Delete a vhost from the server
+        :param vhost: vhost to remove
+        :return: True if request was successful
+        """
+        status = self._request("DELETE", f"/api/vhosts/{quote_plus(vhost)}")
+        return status.ok
+
+    def delete_vhost_user_permissions(self, vhost: str, user: str) -> bool:
+        """
+        Remove a user's access to a vhost
+        :param vhost: vhost to remove permissions for
+        :param user: user to remove permissions of
+        :return: True if request was successful
+        """
+        status = self._request(
+            "DELETE", f"/api/permissions/{quote_plus(vhost)}/"
+                      f"{quote_plus(user)}")
         return status.ok
 
     def get_definitions(self):
@@ -123,11 +230,164 @@ class RabbitMQAPI:
         Get the server definitions for RabbitMQ; these are used to persist
         configuration between container restarts
         """
-        resp = requests.get(f"{self.console_url}/api/definitions",
-                            auth=self.auth, verify=self._verify_ssl)
+        resp = self._request("GET", "/api/definitions")
         data = json.loads(resp.content)
         return data
 
+    def _get_json(self, path: str, columns: Optional[Iterable[str]] = None,
+                  **params) -> Union[dict, list]:
+        """
+        GET a management API resource, optionally limited to some columns
+        :param path: API path, i.e. `/api/overview`
+        :param columns: dotted field names to include in the response,
+            i.e. `message_stats.publish_details.rate`
+        :param params: additional query parameters
+        :returns: parsed JSON response
+        """
+        if columns:
+            params['columns'] = ",".join(columns)
+        resp = self._request("GET", path, params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    def iter_pages(self, path: str, columns: Optional[Iterable[str]] = None,
+                   page_size: int = 500, **params) -> Iterator[dict]:
+        """
+        Iterate over the items of a paginated list endpoint one page at a time
+        so large brokers are never read in a single response.
+        :param path: API path, i.e. `/api/queues`
+        :param columns: dotted field names to include for each item
+        :param page_size: number of items to request per page (max 500)
+        :param params: additional query parameters, i.e. `name` filter
+        :returns: iterator of items
+        """
+        page = 1
+        while True:
+            data = self._get_json(path, columns, page=page,
+                                  page_size=page_size, **params)
+            yield from data.get('items') or []
+            if page >= data.get('page_count', 0):
+                break
+            page += 1
+
+    def get_overview(self, columns: Optional[Iterable[str]] = None) -> dict:
+        """
+        Get cluster-wide message totals, rates, and object counts
+        :param columns: dotted field names to include in the response
+        :returns: dict overview
+        """
+        return self._get_json("/api/overview", columns)
+
+    def get_nodes(self, columns: Optional[Iterable[str]] = None) -> List[dict]:
+        """
+        Get resource usage of each node in the cluster
+        :param columns: dotted field names to include for each node
+        :returns: list of node dicts
+        """
+        return self._get_json("/api/nodes", columns)
+
+    def iter_queues(self, vhost: Optional[str] = None,
+                    columns: Optional[Iterable[str]] = None,
+                    page_size: int = 500) -> Iterator[dict]:
+        """
+        Iterate over queues on the server, or in a single vhost
+        :param vhost: optional vhost to list queues in
+        :param columns: dotted field names to include for each queue
+        :param page_size: number of queues to request at a time
+        :returns: iterator of queue dicts
+        """
+        path = f"/api/queues/{quote_plus(vhost)}" if vhost else "/api/queues"
+        return self.iter_pages(path, columns, page_size)
+
+    def iter_connections(self, columns: Optional[Iterable[str]] = None,
+                         page_size: int = 500) -> Iterator[dict]:
+        """
+        Iterate over client connections to the server
+        :param columns: dotted field names to include for each connection
+        :param page_size: number of connections to request at a time
+        :returns: iterator of connection dicts
+        """
+        return self.iter_pages("/api/connections", columns, page_size)
+
+    def get_consumers(self, vhost: Optional[str] = None,
+                      columns: Optional[Iterable[str]] = None) -> List[dict]:
+        """
+        Get queue consumers on the server, or in a single vhost
+        :param vhost: optional vhost to list consumers in
+        :param columns: dotted field names to include for each consumer
+        :returns: list of consumer dicts
+        """
+        path = f"/api/consumers/{quote_plus(vhost)}" if vhost else \
+            "/api/consumers"
+        return self._get_json(path, columns)
+
+    def download_definitions(self, output_file: str,
+                             chunk_size: int = 1024 * 1024) -> str:
+        """
+        Stream the server definitions to a file without buffering the whole
+        response in memory
+        :param output_file: path to write definitions to
+        :param chunk_size: number of bytes to write at a time
+        :returns: path to the written file
+        """
+        with self._request("GET", "/api/definitions", stream=True) as resp:
+            resp.raise_for_status()
+            with open(output_file, 'wb') as f:
+                for chunk in resp.iter_content(chunk_size):
+                    f.write(chunk)
+        return output_file
+
+    def iter_definitions_section(self, section: str) -> Iterator[dict]:
+        """
+        Iterate over objects in one section of the server definitions as the
+        response is received, i.e. to read `users` from a large export.
+        :param section: definitions section name, i.e. `users`
+        :returns: iterator of section objects
+        """
+        from io import TextIOWrapper
+        with self._request("GET", "/api/definitions", stream=True) as resp:
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            yield from iter_definitions_section(
+                TextIOWrapper(resp.raw, encoding="utf-8"), section)
+
+    def import_definitions(self, definitions: dict,
+                           batch_size: Optional[int] = None) \
+            -> Dict[str, Dict[Hashable, bool]]:
+        """
+        Apply a definitions document (i.e. from `generate_rmq_config`) to the
+        server with `POST /api/definitions`. By default, everything is sent in
+        a single request; if `batch_size` is specified, each section is sent
+        in chunks of at most `batch_size` objects, in dependency order.
+        :param definitions: RabbitMQ definitions to apply
+        :param batch_size: max number of objects to include per request
+        :returns: dict of section name to dict of object key to True if the
+            request containing that object was successful
+        """
+        batches = list()
+        if batch_size:
+            for section in DEFINITION_SECTIONS:
+                objects = definitions.get(section) or []
+                for idx in range(0, len(objects), batch_size):
+                    batches.append({section: objects[idx:idx + batch_size]})
+        else:
+            batches.append({section: definitions[section]
+                            for section in DEFINITION_SECTIONS
+                            if definitions.get(section)})
+
+        report = dict()
+        for batch in batches:
+            resp = self._request("POST", "/api/definitions",
+                                 data=json.dumps(batch))
+            if not resp.ok:
+                LOG.error(f"Failed to import definitions ({resp.status_code}):"
+                          f" {resp.text}")
+            for section, objects in batch.items():
+                results = report.setdefault(section, dict())
+                for obj in objects:
+                    results[definition_key(section, obj)] = resp.ok
+        return report
+
     def create_default_users(self, users: list) -> dict:
         """
         Creates the passed list of users with random passwords and returns a
@@ -135,12 +395,12 @@ class RabbitMQAPI:
         :param users: list of usernames to create
         :return: Dict of created usernames and associated passwords
         """
-        import secrets
-        credentials = dict()
-        for user in users:
-            passwd = secrets.token_urlsafe(32)
-            credentials[user] = passwd
-            self.add_user(user, passwd)
+        from neon_diana_utils.credentials import generate_secrets
+        credentials = generate_secrets(users)
+        self.import_definitions({"users": [{"name": user, "password": passwd,
+                                            "tags": ""}
+                                           for user, passwd in
+                                           credentials.items()]})
         return credentials
 
     def configure_admin_account(self, username: str, password: str) -> bool:
@@ -155,3 +415,299 @@ class RabbitMQAPI:
         self.login(username, password)
         delete = self.delete_user("guest")
         return create and delete
+
+
+class AsyncRabbitMQAPI:
+    def __init__(self, url: str, verify_ssl: bool = False,
+                 max_concurrency: int = 10, max_retries: int = 3,
+                 backoff_factor: float = 0.3, timeout: float = 30.0):
+        """
+        Creates an object used to interface with a RabbitMQ server from an
+        asyncio event loop. Requires `aiohttp` (`neon-diana-utils[async]`).
+        At most `max_concurrency` requests are in flight at any time.
+        :param url: Management URL (usually IP:port)
+        :param verify_ssl: if True, verify the server's SSL certificate
+        :param max_concurrency: max number of concurrent requests
+        :param max_retries: number of times to retry a failed request
+        :param backoff_factor: exponential backoff factor between retries
+        :param timeout: total request timeout in seconds
+        """
+        self._verify_ssl = verify_ssl
+        self.console_url = url
+        self._username = None
+        self._password = None
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+        self._timeout = timeout
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def session(self):
+        """
+        Pooled aiohttp.ClientSession used for all requests to the management
+        API. This must be accessed from within a running event loop.
+        """
+        if self._session is None:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency,
+                                             ssl=None if self._verify_ssl
+                                             else False)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Content-Type": "application/json"},
+                timeout=aiohttp.ClientTimeout(total=self._timeout))
+        return self._session
+
+    async def close(self):
+        """
+        Close the HTTP session and release any pooled connections
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._semaphore = None
+
+    def login(self, username: str, password: str):
+        """
+        Sets internal username/password parameters used to generate HTTP auth
+        :param username: user to authenticate as
+        :param password: plaintext password to authenticate with
+        """
+        self._username = username
+        self._password = password
+
+    @property
+    def auth_headers(self) -> Dict[str, str]:
+        """
+        HTTP Basic Authorization header to include with requests.
+        """
+        from base64 import b64encode
+        credentials = f"{self._username or ''}:{self._password or ''}"
+        return {"Authorization":
+                f"Basic {b64encode(credentials.encode()).decode()}"}
+
+    async def _request(self, method: str, path: str,
+                       data: Optional[str] = None) -> Tuple[bool, bytes]:
+        """
+        Make a request to the management API, retrying idempotent requests
+        on connection errors and transient server errors.
+        :param method: HTTP method
+        :param path: API path, i.e. `/api/vhosts`
+        :param data: optional serialized request body
+        :returns: True if the request was successful, response body
+        """
+        import asyncio
+        import aiohttp
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        retries = self._max_retries if method != "POST" else 0
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                try:
+                    async with self.session.request(
+                            method, f"{self.console_url}{path}",
+                            data=data, headers=self.auth_headers) as resp:
+                        body = await resp.read()
+                        if resp.status not in (429, 500, 502, 503, 504) or \
+                                attempt >= retries:
+                            return 200 <= resp.status < 400, body
+                except aiohttp.ClientConnectionError:
+                    if attempt >= retries:
+                        raise
+                await asyncio.sleep(self._backoff_factor * (2 ** attempt))
+                attempt += 1
+
+    async def add_vhost(self, vhost: str) -> bool:
+        """
+        Add a vhost to the server
+        :param vhost: vhost to add
+        :return: True if request was successful
+        """
+        ok, _ = await self._request("PUT", f"/api/vhosts/{quote_plus(vhost)}")
+        return ok
+
+    async def add_user(self, user: str, password: Optional[str],
+                       tags: str = "", password_hash: Optional[str] = None,
+                       hashing_algorithm: Optional[str] = None) -> bool:
+        """
+        Add a user to the server
+        :param user: username to add
+        :param password: password for user
+        :param tags: comma-delimited list of tags to assign to new user
+        :param password_hash: optional password hash to set instead of
+            `password`, i.e. from `hash_password`
+        :param hashing_algorithm: RabbitMQ algorithm `password_hash` was
+            computed with
+        :return: True if request was successful
+        """
+        tags = tags or ""
+        if password_hash:
+            body = {"password_hash": password_hash, "tags": tags,
+                    "hashing_algorithm": hashing_algorithm or
+                    "rabbit_password_hashing_sha256"}
+        else:
+            body = {"password": password, "tags": tags}
+        ok, _ = await self._request("PUT", f"/api/users/{quote_plus(user)}",
+                                    json.dumps(body))
+        return ok
+
+    async def delete_user(self, user: str) -> bool:
+        """
+        Delete a user from the server
+        :param user: username to remove
+        """
+        ok, _ = await self._request("DELETE",
+                                    f"/api/users/{quote_plus(user)}")
+        return ok
+
+    async def configure_vhost_user_permissions(self, vhost: str, user: str,
+                                               configure: str = ".*",
+                                               write: str = ".*",
+                                               read: str = ".*") -> bool:
+        """
+        Configure user's access to vhost. See RabbitMQ docs:
+        https://www.rabbitmq.com/access-control.html#authorisation
+        :param vhost: vhost to set/modify permissions for
+        :param user: user to set/modify permissions of
+        :param configure: regex configure permissions
+        :param write: regex write permissions
+        :param read: regex read permissions
+        :return: True if request was successful
+        """
+        path = f"/api/permissions/{quote_plus(vhost)}/{quote_plus(user)}"
+        body = {"configure": configure,
+                "write": write,
+                "read": read}
+        ok, _ = await self._request("PUT", path, json.dumps(body))
+        return ok
+
+    async def get_definitions(self) -> dict:
+        """
+        Get the server definitions for RabbitMQ; these are used to persist
+        configuration between container restarts
+        """
+        _, body = await self._request("GET", "/api/definitions")
+        return json.loads(body)
+
+    async def import_definitions(self, definitions: dict,
+                                 batch_size: Optional[int] = None) \
+            -> Dict[str, Dict[Hashable, bool]]:
+        """
+        Apply a definitions document with `POST /api/definitions`. If
+        `batch_size` is specified, batches within a section are sent
+        concurrently and sections are applied in dependency order.
+        :param definitions: RabbitMQ definitions to apply
+        :param batch_size: max number of objects to include per request
+        :returns: dict of section name to dict of object key to True if the
+            request containing that object was successful
+        """
+        import asyncio
+        if not batch_size:
+            stages = [[{section: definitions[section]
+                        for section in DEFINITION_SECTIONS
+                        if definitions.get(section)}]]
+        else:
+            stages = list()
+            for section in DEFINITION_SECTIONS:
+                objects = definitions.get(section) or []
+                stages.append([{section: objects[idx:idx + batch_size]}
+                               for idx in range(0, len(objects), batch_size)])
+        report = dict()
+        for batches in stages:
+            results = await asyncio.gather(
+                *(self._request("POST", "/api/definitions", json.dumps(batch))
+                  for batch in batches))
+            for batch, (ok, body) in zip(batches, results):
+                if not ok:
+                    LOG.error(f"Failed to import definitions: {body}")
+                for section, objects in batch.items():
+                    section_report = report.setdefault(section, dict())
+                    for obj in objects:
+                        section_report[definition_key(section, obj)] = ok
+        return report
+
+    async def provision(self, definitions: dict) \
+            -> Dict[str, Dict[Hashable, bool]]:
+        """
+        Create the vhosts, users, and permissions in `definitions` with
+        concurrent per-object requests. Vhosts and users are created before
+        any permissions that reference them.
+        :param definitions: RabbitMQ definitions to apply
+        :returns: dict of section name to dict of object key to True if the
+            object was created/updated successfully
+        """
+        import asyncio
+
+        async def _add_user(user: dict) -> bool:
+            tags = user.get('tags') or ""
+            if not isinstance(tags, str):
+                tags = ",".join(tags)
+            if user.get('password') is None:
+                if user.get('password_hash'):
+                    return await self.add_user(
+                        user['name'], None, tags,
+                        password_hash=user['password_hash'],
+                        hashing_algorithm=user.get(
+                            'hashing_algorithm',
+                            "rabbit_password_hashing_sha256"))
+                LOG.warning(f"Skipping user without a password: "
+                            f"{user['name']}")
+                return False
+            return await self.add_user(user['name'], user['password'], tags)
+
+        def _add_permission(perm: dict):
+            return self.configure_vhost_user_permissions(
+                perm['vhost'], perm['user'], perm['configure'],
+                perm['write'], perm['read'])
+
+        stages = ((("vhosts", lambda v: self.add_vhost(v['name'])),
+                   ("users", _add_user)),
+                  (("permissions", _add_permission),))
+        report = dict()
+        for stage in stages:
+            calls = [(section, obj, func(obj)) for section, func in stage
+                     for obj in definitions.get(section) or []]
+            results = await asyncio.gather(*(c[2] for c in calls))
+            for (section, obj, _), ok in zip(calls, results):
+                report.setdefault(section,
+                                  dict())[definition_key(section, obj)] = ok
+        return report
+
+    async def create_default_users(self, users: list) -> dict:
+        """
+        Creates the passed list of users with random passwords and returns a
+        dict of users to passwords
+        :param users: list of usernames to create
+        :return: Dict of created usernames and associated passwords
+        """
+        from neon_diana_utils.credentials import generate_secrets
+        credentials = generate_secrets(users)
+        await self.import_definitions({"users": [{"name": user,
+                                                  "password": passwd,
+                                                  "tags": ""}
+                                                 for user, passwd in
+                                                 credentials.items()]})
+        return credentials
+
+    async def configure_admin_account(self, username: str,
+                                      password: str) -> bool:
+        """
+        Configures an administrator with the passed credentials and removes
+        the default account
+        :param username: New administrator's username
+        :param password: New administrator's password
+        :return: True if action was successful
+        """
+        create = await self.add_user(username, password, "administrator")
+        self.login(username, password)
+        delete = await self.delete_user("guest")
+        return create and delete
@@ -0,0 +1,674 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+
+from base64 import b64decode, b64encode
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, \
+    TextIO, Tuple
+
+from neon_diana_utils.imports import LazyAttribute
+
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+
+# Definitions sections in the order they must be applied so that objects are
+# created before anything that references them
+DEFINITION_SECTIONS = ("vhosts", "users", "permissions", "topic_permissions",
+                       "parameters", "global_parameters", "policies",
+                       "exchanges", "queues", "bindings")
+
+
+def definition_key(section: str, obj: dict) -> Hashable:
+    """
+    Get the identifying key for an object in a RabbitMQ definitions section
+    :param section: definitions section name, i.e. `users`
+    :param obj: object from the definitions section
+    :returns: name for named objects, else a tuple of identifying fields
+    """
+    if section in ("vhosts", "users", "global_parameters"):
+        return obj["name"]
+    if section == "permissions":
+        return obj["user"], obj["vhost"]
+    if section == "topic_permissions":
+        return obj["user"], obj["vhost"], obj["exchange"]
+    if section == "parameters":
+        return obj["vhost"], obj["component"], obj["name"]
+    if section == "bindings":
+        return (obj["vhost"], obj["source"], obj["destination"],
+                obj["destination_type"], obj["routing_key"])
+    # policies, queues, exchanges
+    return obj["vhost"], obj["name"]
+
+
+# Sections managed by the reconciler, in the order they are created
+RECONCILED_SECTIONS = ("vhosts", "users", "permissions")
+
+_HASHING_ALGORITHMS = {
+    "rabbit_password_hashing_sha256": hashlib.sha256,
+    "rabbit_password_hashing_sha512": hashlib.sha512,
+    "rabbit_password_hashing_md5": hashlib.md5
+}
+
+
+def check_password_hash(password: str, password_hash: str,
+                        hashing_algorithm: str =
+                        "rabbit_password_hashing_sha256") -> bool:
+    """
+    Check if a plaintext password matches a RabbitMQ password hash
+    :param password: plaintext password
+    :param password_hash: base64-encoded salted hash from RabbitMQ definitions
+    :param hashing_algorithm: RabbitMQ hashing algorithm name
+    :returns: True if `password` matches `password_hash`
+    """
+    hash_func = _HASHING_ALGORITHMS.get(hashing_algorithm)
+    if not hash_func or not password_hash:
+        return False
+    salted_hash = b64decode(password_hash)
+    salt = salted_hash[:4]
+    return salt + hash_func(salt + password.encode()).digest() == salted_hash
+
+
+def hash_password(password: str,
+                  hashing_algorithm: str = "rabbit_password_hashing_sha256",
+                  salt: Optional[bytes] = None) -> str:
+    """
+    Hash a password the way RabbitMQ does, so definitions can include
+    `password_hash` instead of a plaintext `password`
+    :param password: plaintext password
+    :param hashing_algorithm: RabbitMQ hashing algorithm name
+    :param salt: optional 4-byte salt (default random)
+    :returns: base64-encoded salted hash
+    """
+    hash_func = _HASHING_ALGORITHMS.get(hashing_algorithm)
+    if not hash_func:
+        raise ValueError(f"Unsupported hashing algorithm: {hashing_algorithm}")
+    if salt is None:
+        from neon_diana_utils.credentials import SecretGenerator
+        salt = SecretGenerator(4).token_bytes(4)
+    if len(salt) != 4:
+        raise ValueError(f"Expected a 4-byte salt, got {len(salt)} bytes")
+    return b64encode(salt + hash_func(salt + password.encode()).digest()
+                     ).decode("ascii")
+
+
+def _hash_passwords(passwords: List[str], salts: bytes,
+                    hashing_algorithm: str) -> List[str]:
+    """
+    Hash passwords with consecutive 4-byte salts from `salts`
+    """
+    hash_func = _HASHING_ALGORITHMS[hashing_algorithm]
+    hashes = []
+    append = hashes.append
+    for idx, password in enumerate(passwords):
+        salt = salts[idx * 4:idx * 4 + 4]
+        append(b64encode(salt + hash_func(salt + password.encode()).digest()
+                         ).decode("ascii"))
+    return hashes
+
+
+def hash_user_passwords(definitions: dict,
+                        hashing_algorithm: str =
+                        "rabbit_password_hashing_sha256",
+                        existing: Optional[Iterable[dict]] = None,
+                        max_workers: Optional[int] = None,
+                        chunk_size: int = 20000) -> dict:
+    """
+    Replace plaintext user passwords in RabbitMQ definitions with
+    `password_hash` and `hashing_algorithm`, so RabbitMQ does not hash every
+    password when definitions are imported and plaintext passwords are not
+    stored in the definitions file. Salts for all users are read at once.
+    :param definitions: RabbitMQ definitions, i.e. from `generate_rmq_config`
+    :param hashing_algorithm: `rabbit_password_hashing_sha256` or
+        `rabbit_password_hashing_sha512`
+    :param existing: optional hashed users from previously written
+        definitions; hashes that still match a user's password are reused so
+        unchanged passwords do not produce a different file
+    :param max_workers: if greater than 1, hash in this many processes.
+        Each hash takes about a microsecond, so this only helps for very
+        large user sets
+    :param chunk_size: number of users hashed per process task
+    :returns: copy of `definitions` with hashed user passwords
+    """
+    if hashing_algorithm not in _HASHING_ALGORITHMS:
+        raise ValueError(f"Unsupported hashing algorithm: {hashing_algorithm}")
+    previous = {user['name']: user for user in existing or []
+                if user.get('password_hash')}
+    users = []
+    pending = []
+    for user in definitions.get('users') or []:
+        user = dict(user)
+        password = user.pop('password', None)
+        users.append(user)
+        if password is None:
+            continue
+        old = previous.get(user['name'])
+        if old and old.get('hashing_algorithm', hashing_algorithm) == \
+                hashing_algorithm and \
+                check_password_hash(password, old['password_hash'],
+                                    hashing_algorithm):
+            user['password_hash'] = old['password_hash']
+            user['hashing_algorithm'] = hashing_algorithm
+        else:
+            pending.append((user, password))
+    if pending:
+        from neon_diana_utils.credentials import SecretGenerator
+        passwords = [password for _, password in pending]
+        salts = SecretGenerator(4 * len(pending)).token_bytes(
+            4 * len(pending))
+        if max_workers and max_workers > 1 and len(pending) > chunk_size:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers) as executor:
+                futures = [executor.submit(
+                    _hash_passwords, passwords[idx:idx + chunk_size],
+                    salts[idx * 4:(idx + chunk_size) * 4], hashing_algorithm)
+                    for idx in range(0, len(passwords), chunk_size)]
+                hashes = [h for future in futures for h in future.result()]
+        else:
+            hashes = _hash_passwords(passwords, salts, hashing_algorithm)
+        for (user, _), password_hash in zip(pending, hashes):
+            user['password_hash'] = password_hash
+            user['hashing_algorithm'] = hashing_algorithm
+    return {**definitions, 'users': users}
+
+
+def _normalize_tags(tags) -> List[str]:
+    """
+    Normalize user tags from a list or comma-delimited string
+    """
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return sorted(t.strip() for t in tags if t.strip())
+
+
+def _object_changed(section: str, desired: dict, current: dict) -> bool:
+    """
+    Check if an existing object differs from its desired state
+    :param section: definitions section name
+    :param desired: desired object definition
+    :param current: object definition read from the server
+    :returns: True if `current` needs to be updated
+    """
+    if section == "users":
+        if _normalize_tags(desired.get('tags')) != \
+                _normalize_tags(current.get('tags')):
+            return True
+        if desired.get('password_hash'):
+            return desired['password_hash'] != current.get('password_hash')
+        if desired.get('password') is None:
+            return False
+        return not check_password_hash(
+            desired['password'], current.get('password_hash'),
+            current.get('hashing_algorithm',
+                        "rabbit_password_hashing_sha256"))
+    if section == "permissions":
+        return any(desired.get(k) != current.get(k)
+                   for k in ("configure", "write", "read"))
+    return False
+
+
+def index_definitions(definitions: dict,
+                      sections: Iterable[str] = DEFINITION_SECTIONS) \
+        -> Dict[str, Dict[Hashable, dict]]:
+    """
+    Build order-preserving indexes of definitions objects by key; users and
+    vhosts by name, permissions by (user, vhost), queues by (vhost, name), etc.
+    :param definitions: RabbitMQ definitions to index
+    :param sections: definitions sections to index
+    :returns: dict of section name to dict of object key to object
+    """
+    return {section: {definition_key(section, obj): obj
+                      for obj in definitions.get(section) or []}
+            for section in sections}
+
+
+def _merge_section(section: str, current_objects: Dict[Hashable, dict],
+                   desired_objects: Dict[Hashable, dict],
+                   base_objects: Dict[Hashable, dict],
+                   keep_current: bool) -> List[dict]:
+    """
+    Merge indexed objects for one definitions section.
+    See `merge_definitions` for merge rules.
+    :returns: list of merged objects
+    """
+    result = dict()
+    for key, obj in current_objects.items():
+        modified = key in base_objects and obj != base_objects[key]
+        if key in desired_objects:
+            if keep_current or modified:
+                result[key] = obj
+            else:
+                result[key] = desired_objects[key]
+        elif key in base_objects and not modified:
+            LOG.debug(f"Removing {section} object: {key}")
+        else:
+            result[key] = obj
+    for key, obj in desired_objects.items():
+        if key in current_objects:
+            continue
+        if key in base_objects:
+            # Object was removed from `current` by an operator
+            continue
+        LOG.debug(f"Adding {section} object: {key}")
+        result[key] = obj
+    return list(result.values())
+
+
+def merge_definitions(current: dict, desired: dict,
+                      base: Optional[dict] = None,
+                      keep_current: Iterable[str] = ("users",)) -> dict:
+    """
+    Merge `desired` definitions into `current` definitions in linear time.
+    Objects are matched by key (see `definition_key`) and the order of
+    `current` is preserved, with new objects appended in `desired` order.
+    If `base` (the definitions `current` was originally generated from) is
+    provided, this is a three-way merge: objects modified in `current` since
+    `base` are kept as-is and objects removed from `desired` since `base`
+    are removed unless they were modified in `current`. Objects that exist
+    only in `current` (i.e. operator additions) are always kept.
+    :param current: existing definitions, possibly modified by an operator
+    :param desired: newly generated definitions
+    :param base: optional definitions `current` was generated from
+    :param keep_current: sections where existing objects are never replaced
+        by `desired` objects (i.e. to preserve existing user passwords)
+    :returns: merged definitions
+    """
+    keep_current = set(keep_current)
+    base_index = index_definitions(base or {})
+    current_index = index_definitions(current)
+    desired_index = index_definitions(desired)
+    merged = {key: val for key, val in current.items()
+              if key not in DEFINITION_SECTIONS}
+    for key, val in desired.items():
+        if key not in DEFINITION_SECTIONS:
+            merged.setdefault(key, val)
+    for section in DEFINITION_SECTIONS:
+        if section not in current and section not in desired:
+            continue
+        merged[section] = _merge_section(section, current_index[section],
+                                         desired_index[section],
+                                         base_index[section],
+                                         section in keep_current)
+    return merged
+
+
+class DefinitionsReader:
+    def __init__(self, fp: TextIO, chunk_size: int = 65536):
+        """
+        Incrementally parses a JSON definitions document so that sections
+        can be iterated object-by-object without loading the whole document.
+        :param fp: text file-like object to read from
+        :param chunk_size: number of characters to read at a time
+        """
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """
+        Read another chunk into the buffer, discarding consumed data
+        :returns: False if the end of the file was reached
+        """
+        if self._eof:
+            return False
+        chunk = self._fp.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """
+        Skip whitespace and get the next character without consuming it
+        :returns: next character or an empty string at the end of the file
+        """
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars: str) -> str:
+        """
+        Consume the next character, which must be one of `chars`
+        """
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of `{chars}` at position "
+                             f"{self._pos}, got: `{char}`")
+        self._pos += 1
+        return char
+
+    def _decode(self):
+        """
+        Decode the next complete JSON value
+        """
+        self._peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A value ending at the buffer boundary may be truncated
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _iter_array(self) -> Iterator:
+        """
+        Iterate over values in an array; the opening bracket must already be
+        consumed.
+        """
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._decode()
+            if self._expect(",]") == "]":
+                return
+
+    def sections(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate over top-level keys in the document. Array values are
+        returned as iterators that must be consumed before advancing to the
+        next section; unconsumed values are skipped.
+        :returns: iterator of (key, value)
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._decode()
+            self._expect(":")
+            if self._peek() == "[":
+                self._pos += 1
+                values = self._iter_array()
+                yield key, values
+                for _ in values:
+                    pass
+            else:
+                yield key, self._decode()
+            if self._expect(",}") == "}":
+                return
+
+
+class DefinitionsWriter:
+    def __init__(self, fp: TextIO):
+        """
+        Incrementally writes a JSON definitions document. Output is identical
+        to `json.dump(definitions, fp, indent=2)`.
+        :param fp: text file-like object to write to
+        """
+        self._fp = fp
+        self._empty = True
+
+    def __enter__(self):
+        self._fp.write("{")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._fp.write("}" if self._empty else "\n}")
+
+    def _write_key(self, key: str):
+        self._fp.write(f"\n  {json.dumps(key)}: " if self._empty else
+                       f",\n  {json.dumps(key)}: ")
+        self._empty = False
+
+    def write_value(self, key: str, value):
+        """
+        Write a top-level key and value
+        """
+        self._write_key(key)
+        self._fp.write(json.dumps(value, indent=2).replace("\n", "\n  "))
+
+    def write_section(self, key: str, objects: Iterable):
+        """
+        Write a top-level key and array, one object at a time
+        """
+        self._write_key(key)
+        self._fp.write("[")
+        empty = True
+        for obj in objects:
+            self._fp.write("\n    " if empty else ",\n    ")
+            self._fp.write(json.dumps(obj, indent=2).replace("\n", "\n    "))
+            empty = False
+        self._fp.write("]" if empty else "\n  ]")
+
+
+def iter_definitions_section(fp: TextIO, section: str) -> Iterator[dict]:
+    """
+    Iterate over the objects in one section of a definitions document
+    without loading other sections into memory.
+    :param fp: text file-like object to read from
+    :param section: definitions section name, i.e. `users`
+    :returns: iterator of section objects
+    """
+    for key, value in DefinitionsReader(fp).sections():
+        if key == section:
+            if isinstance(value, Iterator):
+                yield from value
+            return
+
+
+def stream_merge_definitions(src: TextIO, dst: TextIO, desired: dict,
+                             keep_current: Iterable[str] = ("users",)):
+    """
+    Merge `desired` definitions into the definitions read from `src` and
+    write the result to `dst` section by section. Only sections present in
+    `desired` are loaded into memory; other sections (i.e. queues, bindings)
+    are streamed through unchanged. See `merge_definitions`.
+    :param src: text file-like object to read existing definitions from
+    :param dst: text file-like object to write merged definitions to
+    :param desired: newly generated definitions
+    :param keep_current: sections where existing objects are kept as-is
+    """
+    keep_current = set(keep_current)
+    handled = set()
+    with DefinitionsWriter(dst) as writer:
+        for key, value in DefinitionsReader(src).sections():
+            handled.add(key)
+            if not isinstance(value, Iterator):
+                writer.write_value(key, value)
+            elif key in desired and key in DEFINITION_SECTIONS:
+                current = index_definitions({key: list(value)}, (key,))[key]
+                writer.write_section(key, _merge_section(
+                    key, current, index_definitions(desired, (key,))[key],
+                    dict(), key in keep_current))
+            else:
+                writer.write_section(key, value)
+        for key, value in desired.items():
+            if key not in handled:
+                writer.write_value(key, value)
+
+
+def diff_definitions(desired: dict, current: dict,
+                     sections: Iterable[str] = RECONCILED_SECTIONS,
+                     prune: bool = False,
+                     protected_users: Iterable[str] = ()) \
+        -> Dict[str, Dict[str, list]]:
+    """
+    Compute the minimal set of changes required to bring `current`
+    definitions in line with `desired` definitions.
+    :param desired: desired definitions, i.e. from `generate_rmq_config`
+    :param current: current definitions, i.e. from `get_definitions`
+    :param sections: definitions sections to compare
+    :param prune: if True, objects not in `desired` are marked for deletion
+    :param protected_users: users whose accounts and permissions are never
+        marked for deletion
+    :returns: dict of section to dict of `create`, `update`, and `delete`
+        lists of object definitions
+    """
+    protected_users = set(protected_users)
+    plan = dict()
+    for section in sections:
+        existing = {definition_key(section, obj): obj
+                    for obj in current.get(section) or []}
+        wanted = set()
+        changes = {"create": [], "update": [], "delete": []}
+        for obj in desired.get(section) or []:
+            key = definition_key(section, obj)
+            wanted.add(key)
+            if key not in existing:
+                changes['create'].append(obj)
+            elif _object_changed(section, obj, existing[key]):
+                changes['update'].append(obj)
+        if prune:
+            changes['delete'] = [obj for key, obj in existing.items()
+                                 if key not in wanted and
+                                 obj.get('name' if section == "users" else
+                                         'user') not in protected_users]
+        plan[section] = changes
+    return plan
+
+
+def plan_is_empty(plan: dict) -> bool:
+    """
+    Check if a plan from `diff_definitions` contains no changes
+    """
+    return not any(objects for changes in plan.values()
+                   for objects in changes.values())
+
+
+def format_plan(plan: dict) -> str:
+    """
+    Format a plan from `diff_definitions` as human-readable text
+    :param plan: plan to format
+    :returns: multi-line string describing planned changes
+    """
+    symbols = {"create": "+", "update": "~", "delete": "-"}
+    lines = list()
+    for section, changes in plan.items():
+        for action in ("create", "update", "delete"):
+            for obj in changes.get(action, []):
+                key = definition_key(section, obj)
+                if isinstance(key, tuple):
+                    key = " @ ".join(key)
+                lines.append(f"{symbols[action]} {section}: {key}")
+    counts = {action: sum(len(changes.get(action, []))
+                          for changes in plan.values())
+              for action in symbols}
+    lines.append(f"Plan: {counts['create']} to create, {counts['update']} to "
+                 f"update, {counts['delete']} to delete")
+    return "\n".join(lines)
+
+
+def apply_plan(api, plan: dict) -> Dict[str, Dict[Hashable, bool]]:
+    """
+    Apply a plan from `diff_definitions` to a RabbitMQ server. Objects are
+    created/updated in dependency order and deleted in reverse order.
+    :param api: RabbitMQAPI object authenticated to the target server
+    :param plan: plan to apply
+    :returns: dict of section name to dict of object key to True if the
+        change was applied successfully
+    """
+    def _put(section: str, obj: dict) -> bool:
+        if section == "vhosts":
+            return api.add_vhost(obj['name'])
+        if section == "users":
+            tags = ",".join(_normalize_tags(obj.get('tags')))
+            if obj.get('password') is None:
+                if obj.get('password_hash'):
+                    return api.add_user(
+                        obj['name'], None, tags,
+                        password_hash=obj['password_hash'],
+                        hashing_algorithm=obj.get(
+                            'hashing_algorithm',
+                            "rabbit_password_hashing_sha256"))
+                LOG.warning(f"Skipping user without a password: "
+                            f"{obj['name']}")
+                return False
+            return api.add_user(obj['name'], obj['password'], tags)
+        if section == "permissions":
+            return api.configure_vhost_user_permissions(
+                obj['vhost'], obj['user'], obj['configure'], obj['write'],
+                obj['read'])
+        raise ValueError(f"Unsupported section: {section}")
+
+    def _delete(section: str, obj: dict) -> bool:
+        if section == "vhosts":
+            return api.delete_vhost(obj['name'])
+        if section == "users":
+            return api.delete_user(obj['name'])
+        if section == "permissions":
+            return api.delete_vhost_user_permissions(obj['vhost'],
+                                                     obj['user'])
+        raise ValueError(f"Unsupported section: {section}")
+
+    report = {section: dict() for section in plan}
+    ordered = [s for s in RECONCILED_SECTIONS if s in plan]
+    for section in ordered:
+        for obj in plan[section]['create'] + plan[section]['update']:
+            report[section][definition_key(section, obj)] = _put(section, obj)
+    for section in reversed(ordered):
+        for obj in plan[section]['delete']:
+            report[section][definition_key(section, obj)] = \
+                _delete(section, obj)
+    return report
+
+
+def reconcile_definitions(api, desired: dict, dry_run: bool = False,
+                          prune: bool = False,
+                          prune_admins: bool = False) -> dict:
+    """
+    Compare desired definitions with a running RabbitMQ server and apply only
+    the objects that changed.
+    :param api: RabbitMQAPI object authenticated to the target server
+    :param desired: desired definitions, i.e. from `generate_rmq_config`
+    :param dry_run: if True, compute the plan without applying it
+    :param prune: if True, delete objects on the server not in `desired`
+    :param prune_admins: if True, also prune users tagged `administrator`.
+        The user `api` is authenticated as is never pruned
+    :returns: dict plan from `diff_definitions`
+    """
+    current = api.get_definitions()
+    protected = {getattr(api, "username", None)}
+    if not prune_admins:
+        protected.update(user['name'] for user in current.get('users') or []
+                         if "administrator" in
+                         _normalize_tags(user.get('tags')))
+    plan = diff_definitions(desired, current, prune=prune,
+                            protected_users=protected)
+    LOG.info(format_plan(plan))
+    if not dry_run and not plan_is_empty(plan):
+        report = apply_plan(api, plan)
+        failed = [(section, key) for section, results in report.items()
+                  for key, ok in results.items() if not ok]
+        if failed:
+            LOG.error(f"Failed to apply changes: {failed}")
+    return plan
@@ -0,0 +1,310 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Poll queue, connection, and node metrics from the RabbitMQ management API
+into a compact in-memory time series. Only the columns needed for DIANA
+backlog and throughput metrics are requested, and list endpoints are read a
+page at a time so polling stays cheap on large brokers.
+"""
+
+import time
+
+from array import array
+from threading import Event
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from neon_diana_utils.imports import LazyAttribute
+from neon_diana_utils.rabbitmq_api import RabbitMQAPI
+
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+
+OVERVIEW_COLUMNS = ("queue_totals.messages", "queue_totals.messages_ready",
+                    "queue_totals.messages_unacknowledged",
+                    "message_stats.publish_details.rate",
+                    "message_stats.deliver_get_details.rate",
+                    "object_totals.connections", "object_totals.consumers",
+                    "object_totals.queues")
+QUEUE_COLUMNS = ("name", "vhost", "messages", "messages_ready",
+                 "messages_unacknowledged", "consumers",
+                 "message_stats.publish_details.rate",
+                 "message_stats.deliver_get_details.rate")
+CONSUMER_COLUMNS = ("queue.name", "queue.vhost", "channel_details.user")
+CONNECTION_COLUMNS = ("user", "vhost")
+NODE_COLUMNS = ("name", "running", "mem_used", "mem_limit", "fd_used",
+                "fd_total", "disk_free", "disk_free_limit")
+
+# Metric name to column for overview, queue, and node objects
+_OVERVIEW_METRICS = {
+    "messages": "queue_totals.messages",
+    "messages_ready": "queue_totals.messages_ready",
+    "messages_unacknowledged": "queue_totals.messages_unacknowledged",
+    "publish_rate": "message_stats.publish_details.rate",
+    "deliver_rate": "message_stats.deliver_get_details.rate",
+    "connections": "object_totals.connections",
+    "consumers": "object_totals.consumers",
+    "queues": "object_totals.queues"}
+_QUEUE_METRICS = {
+    "messages": "messages",
+    "messages_ready": "messages_ready",
+    "messages_unacknowledged": "messages_unacknowledged",
+    "consumers": "consumers",
+    "publish_rate": "message_stats.publish_details.rate",
+    "deliver_rate": "message_stats.deliver_get_details.rate"}
+_NODE_METRICS = ("running", "mem_used", "mem_limit", "fd_used", "fd_total",
+                 "disk_free", "disk_free_limit")
+
+SeriesKey = Tuple[str, str, str]
+
+
+def get_column(obj: dict, column: str, default=0):
+    """
+    Get a dotted column (i.e. `message_stats.publish_details.rate`) from an
+    API object; stats are omitted by the server until they are non-zero.
+    """
+    for key in column.split('.'):
+        if not isinstance(obj, dict) or obj.get(key) is None:
+            return default
+        obj = obj[key]
+    return obj
+
+
+def get_diana_services() -> Dict[str, Set[str]]:
+    """
+    Get the DIANA vhosts and the service users permitted on each from
+    `rmq_backend_config.yml`
+    :returns: dict of vhost name to set of usernames
+    """
+    from neon_diana_utils.configuration import load_template
+    config = load_template("rmq_backend_config.yml", mutable=False)
+    services = {vhost['name']: set() for vhost in config['vhosts']}
+    for permission in config['permissions']:
+        services.setdefault(permission['vhost'],
+                            set()).add(permission['user'])
+    return services
+
+
+class TimeSeries:
+    def __init__(self, capacity: int = 360):
+        """
+        Fixed-size ring buffer of samples. Each metric is stored as a column
+        of doubles, so memory is bounded by `capacity` regardless of how long
+        a collector runs.
+        :param capacity: number of samples to retain
+        """
+        if capacity < 1:
+            raise ValueError(f"capacity must be positive: {capacity}")
+        self.capacity = capacity
+        self._timestamps = array('d')
+        self._columns: Dict[SeriesKey, array] = dict()
+        self._next = 0
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def __contains__(self, key: SeriesKey):
+        return key in self._columns
+
+    def keys(self) -> List[SeriesKey]:
+        """
+        Get the keys of all recorded metrics
+        """
+        return list(self._columns)
+
+    def append(self, timestamp: float, values: Dict[SeriesKey, float]):
+        """
+        Record a sample, replacing the oldest one if the buffer is full.
+        Metrics missing from a sample are recorded as NaN.
+        :param timestamp: epoch time of the sample
+        :param values: dict of metric key to value
+        """
+        size = len(self._timestamps)
+        for key in values:
+            if key not in self._columns:
+                self._columns[key] = array('d', [float('nan')] * size)
+        if size < self.capacity:
+            self._timestamps.append(timestamp)
+            for key, column in self._columns.items():
+                column.append(values.get(key, float('nan')))
+        else:
+            idx = self._next
+            self._timestamps[idx] = timestamp
+            for key, column in self._columns.items():
+                column[idx] = values.get(key, float('nan'))
+            self._next = (idx + 1) % self.capacity
+
+    def _ordered(self, column: array) -> List[float]:
+        return column[self._next:].tolist() + column[:self._next].tolist()
+
+    def timestamps(self) -> List[float]:
+        """
+        Get sample timestamps, oldest first
+        """
+        return self._ordered(self._timestamps)
+
+    def values(self, key: SeriesKey, since: Optional[float] = None) \
+            -> List[Tuple[float, float]]:
+        """
+        Get recorded values of a metric, oldest first
+        :param key: metric key, i.e. `("vhost", "/llm", "messages")`
+        :param since: if set, only return samples at or after this time
+        :returns: list of (timestamp, value) tuples
+        """
+        if key not in self._columns:
+            return []
+        samples = zip(self.timestamps(), self._ordered(self._columns[key]))
+        return [(ts, val) for ts, val in samples
+                if since is None or ts >= since]
+
+    def latest(self, key: SeriesKey, default: Optional[float] = None) \
+            -> Optional[float]:
+        """
+        Get the most recently recorded value of a metric
+        """
+        if key not in self._columns or not self._timestamps:
+            return default
+        return self._columns[key][self._next - 1]
+
+
+class MetricsCollector:
+    def __init__(self, api: RabbitMQAPI,
+                 services: Optional[Dict[str, Iterable[str]]] = None,
+                 capacity: int = 360, page_size: int = 500,
+                 include_nodes: bool = True):
+        """
+        Collects per-vhost and per-service metrics for DIANA vhosts.
+        Queues are attributed to the service users consuming from them; a
+        queue keeps its last known service when its consumers go away so
+        the backlog of a stopped service is still reported.
+        :param api: logged-in RabbitMQAPI
+        :param services: dict of vhost to service users; defaults to the
+            vhosts and permissions in `rmq_backend_config.yml`
+        :param capacity: number of samples to retain
+        :param page_size: number of objects to request per page
+        :param include_nodes: if True, collect node resource usage
+        """
+        self.api = api
+        services = get_diana_services() if services is None else services
+        self.services = {vhost: set(users)
+                         for vhost, users in services.items()}
+        self.series = TimeSeries(capacity)
+        self.page_size = page_size
+        self.include_nodes = include_nodes
+        self._queue_services: Dict[Tuple[str, str], Set[str]] = dict()
+
+    def collect(self) -> dict:
+        """
+        Read current metrics from the server
+        :returns: dict with `overview`, `vhosts`, `services`, and `nodes`
+            metrics
+        """
+        overview = self.api.get_overview(OVERVIEW_COLUMNS)
+        snapshot = {"overview": {metric: get_column(overview, column)
+                                 for metric, column in
+                                 _OVERVIEW_METRICS.items()},
+                    "vhosts": dict(), "services": dict(), "nodes": dict()}
+        users = set().union(*self.services.values())
+        empty = dict.fromkeys(("connections", *_QUEUE_METRICS), 0)
+        vhosts = {vhost: dict(empty) for vhost in self.services}
+        services = {user: dict(empty) for user in users}
+
+        consuming = dict()
+        for consumer in self.api.get_consumers(columns=CONSUMER_COLUMNS):
+            key = (get_column(consumer, "queue.vhost", None),
+                   get_column(consumer, "queue.name", None))
+            user = get_column(consumer, "channel_details.user", None)
+            if key[0] in vhosts and user in services:
+                consuming.setdefault(key, set()).add(user)
+        self._queue_services.update(consuming)
+
+        for vhost, totals in vhosts.items():
+            for queue in self.api.iter_queues(vhost, QUEUE_COLUMNS,
+                                              self.page_size):
+                values = {metric: get_column(queue, column)
+                          for metric, column in _QUEUE_METRICS.items()}
+                for metric, value in values.items():
+                    totals[metric] += value
+                for user in self._queue_services.get((vhost, queue['name']),
+                                                     ()):
+                    for metric, value in values.items():
+                        services[user][metric] += value
+
+        for connection in self.api.iter_connections(CONNECTION_COLUMNS,
+                                                    self.page_size):
+            if connection.get('vhost') in vhosts:
+                vhosts[connection['vhost']]['connections'] += 1
+            if connection.get('user') in services:
+                services[connection['user']]['connections'] += 1
+
+        if self.include_nodes:
+            for node in self.api.get_nodes(NODE_COLUMNS):
+                snapshot['nodes'][node['name']] = \
+                    {metric: float(get_column(node, metric))
+                     for metric in _NODE_METRICS}
+        snapshot['vhosts'] = vhosts
+        snapshot['services'] = services
+        return snapshot
+
+    def poll(self, timestamp: Optional[float] = None) -> dict:
+        """
+        Collect metrics and record them in `series`. Series keys are
+        (`overview`|`vhost`|`service`|`node`, name, metric) tuples.
+        :param timestamp: epoch time of the sample; defaults to now
+        :returns: collected metrics
+        """
+        snapshot = self.collect()
+        values = {("overview", "", metric): value
+                  for metric, value in snapshot['overview'].items()}
+        for kind, group in (("vhost", "vhosts"), ("service", "services"),
+                            ("node", "nodes")):
+            for name, metrics in snapshot[group].items():
+                for metric, value in metrics.items():
+                    values[(kind, name, metric)] = value
+        self.series.append(time.time() if timestamp is None else timestamp,
+                           values)
+        return snapshot
+
+    def run(self, interval: float = 30.0, stop_event: Optional[Event] = None,
+            count: Optional[int] = None):
+        """
+        Poll metrics on an interval until `stop_event` is set or `count`
+        samples are collected. Failed polls are logged and skipped.
+        :param interval: seconds between polls
+        :param stop_event: Event to stop polling
+        :param count: optional max number of polls
+        """
+        stop_event = stop_event or Event()
+        polls = 0
+        while not stop_event.is_set() and (count is None or polls < count):
+            start = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                LOG.error(f"Failed to collect metrics: {e}")
+            polls += 1
+            if count is not None and polls >= count:
+                break
+            stop_event.wait(max(0.0, interval - (time.monotonic() - start)))
@@ -0,0 +1,230 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Size backend service deployments for an expected load, using the per-replica
+capacities in `templates/service_capacity.yml`.
+"""
+
+import re
+
+from math import ceil
+from typing import Dict, NamedTuple, Optional
+
+SERVICE_GROUPS = ("diana-mq", "diana-http")
+_CPU = re.compile(r"^(\d+(?:\.\d+)?)(m?)$")
+_MEMORY = re.compile(r"^(\d+(?:\.\d+)?)([KMGT]i?)?$")
+_MEMORY_UNITS = {None: 1 / 2 ** 20, "K": 1e3 / 2 ** 20, "M": 1e6 / 2 ** 20,
+                 "G": 1e9 / 2 ** 20, "T": 1e12 / 2 ** 20, "Ki": 1 / 1024,
+                 "Mi": 1, "Gi": 1024, "Ti": 1024 ** 2}
+
+
+class LoadProfile(NamedTuple):
+    """
+    Expected peak load for a service
+    """
+    requests_per_second: float = 0.0
+    sessions: int = 0
+
+
+def parse_cpu(cpu: str) -> float:
+    """
+    Parse a Kubernetes CPU quantity (i.e. `0.01`, `250m`) to cores
+    """
+    match = _CPU.match(str(cpu).strip())
+    if not match:
+        raise ValueError(f"Invalid CPU quantity: {cpu}")
+    return float(match.group(1)) / (1000 if match.group(2) else 1)
+
+
+def parse_memory(memory: str) -> float:
+    """
+    Parse a Kubernetes memory quantity (i.e. `600Mi`, `4Gi`) to MiB
+    """
+    match = _MEMORY.match(str(memory).strip())
+    if not match:
+        raise ValueError(f"Invalid memory quantity: {memory}")
+    return float(match.group(1)) * _MEMORY_UNITS[match.group(2)]
+
+
+def format_cpu(cores: float) -> str:
+    """
+    Format cores as a Kubernetes CPU quantity in millicores
+    """
+    return f"{max(1, ceil(round(cores * 1000, 6)))}m"
+
+
+def format_memory(mib: float) -> str:
+    """
+    Format MiB as a Kubernetes memory quantity
+    """
+    mib = max(1, ceil(round(mib, 6)))
+    if mib % 1024 == 0:
+        return f"{mib // 1024}Gi"
+    return f"{mib}Mi"
+
+
+def get_service_capacity(service: str) -> dict:
+    """
+    Get the per-replica capacity of a backend service
+    :param service: service name as configured in `diana-backend` values
+        (i.e. `neon-llm-chatgpt`, `endpoint-hana`)
+    :returns: dict capacity with defaults applied
+    """
+    from neon_diana_utils.configuration import load_template
+    capacities = load_template("service_capacity.yml", mutable=False)
+    for group in SERVICE_GROUPS:
+        if service in capacities[group]:
+            return {**capacities["defaults"], **capacities[group][service]}
+    raise ValueError(f"Unknown backend service: {service}")
+
+
+def get_service_group(service: str) -> str:
+    """
+    Get the `diana-backend` values group (`diana-mq` or `diana-http`) for a
+    service
+    """
+    from neon_diana_utils.configuration import load_template
+    capacities = load_template("service_capacity.yml", mutable=False)
+    for group in SERVICE_GROUPS:
+        if service in capacities[group]:
+            return group
+    raise ValueError(f"Unknown backend service: {service}")
+
+
+def size_service(capacity: dict, load: LoadProfile, headroom: float = 0.25,
+                 autoscale: bool = False) -> dict:
+    """
+    Compute replicas and resources for a service
+    :param capacity: per-replica capacity, i.e. from `get_service_capacity`
+    :param load: expected peak load
+    :param headroom: fraction of capacity to keep free at peak load
+    :param autoscale: if True, include `autoscaling` values. Charts render
+        these as a CPU HorizontalPodAutoscaler, except for MQ charts that
+        define an input queue (`autoscaling.queue`, i.e. the LLM charts),
+        which render a KEDA ScaledObject on queue length with the same
+        replica range
+    :returns: dict Helm values for the service
+    """
+    if headroom < 0:
+        raise ValueError(f"headroom must not be negative: {headroom}")
+    rps = max(0.0, float(load.requests_per_second))
+    sessions = max(0, int(load.sessions))
+    replicas = max(int(capacity["min_replicas"]),
+                   ceil(rps * (1 + headroom) / capacity["rps"]),
+                   ceil(sessions * (1 + headroom) / capacity["sessions"]))
+    replicas = max(replicas, 1)
+    cpu = capacity["cpu"] + capacity["cpu_per_rps"] * rps / replicas
+    memory = capacity["memory"] + \
+        capacity["memory_per_session"] * sessions / replicas
+    values = {"replicaCount": replicas,
+              "resources": {
+                  "requests": {"cpu": format_cpu(cpu),
+                               "memory": format_memory(memory)},
+                  "limits": {
+                      "cpu": format_cpu(cpu * capacity["cpu_limit_ratio"]),
+                      "memory": format_memory(
+                          memory * capacity["memory_limit_ratio"])}}}
+    if autoscale:
+        values["autoscaling"] = {
+            "enabled": True,
+            "minReplicas": replicas,
+            "maxReplicas": max(replicas + 1, ceil(
+                replicas * capacity["max_replica_ratio"])),
+            "targetCPUUtilizationPercentage":
+                capacity["target_cpu_utilization"]}
+    return values
+
+
+def size_backend(loads: Dict[str, LoadProfile], headroom: float = 0.25,
+                 autoscale: bool = False) -> Dict[str, Dict[str, dict]]:
+    """
+    Size backend services for expected loads
+    :param loads: dict service name to expected peak load
+    :param headroom: fraction of capacity to keep free at peak load
+    :param autoscale: if True, include `autoscaling` values (see
+        `size_service`)
+    :returns: dict values group to service name to Helm values, to merge into
+        `backend` values of `diana-backend`
+    """
+    sizing = dict()
+    for service, load in loads.items():
+        if not isinstance(load, LoadProfile):
+            try:
+                load = LoadProfile(**(load or dict()))
+            except TypeError as e:
+                raise ValueError(f"Invalid load for {service}: {e}") from e
+        sizing.setdefault(get_service_group(service), dict())[service] = \
+            size_service(get_service_capacity(service), load, headroom,
+                         autoscale)
+    return sizing
+
+
+def queue_autoscaling(min_replicas: int = 1, max_replicas: int = 3,
+                      target_queue_length: int = 5) -> dict:
+    """
+    Get Helm values to autoscale an MQ service on the length of its input
+    queue. Services without a default input queue (`autoscaling.queue`) are
+    scaled on CPU utilization instead.
+    :param min_replicas: minimum number of replicas
+    :param max_replicas: maximum number of replicas
+    :param target_queue_length: queued messages per replica to scale at
+    :returns: dict Helm values for the service
+    """
+    if not 0 < min_replicas <= max_replicas:
+        raise ValueError(f"Invalid replica range: {min_replicas}-"
+                         f"{max_replicas}")
+    if target_queue_length < 1:
+        raise ValueError(f"Invalid target queue length: "
+                         f"{target_queue_length}")
+    return {"autoscaling": {"enabled": True,
+                            "minReplicas": int(min_replicas),
+                            "maxReplicas": int(max_replicas),
+                            "targetQueueLength": int(target_queue_length)}}
+
+
+def apply_sizing(backend_values: dict,
+                 sizing: Optional[Dict[str, Dict[str, dict]]]) -> dict:
+    """
+    Merge sizing into `diana-backend` values. Services that are disabled
+    (`replicaCount: 0`) are left disabled.
+    :param backend_values: `backend` section of `diana-backend` values
+    :param sizing: sizing from `size_backend`
+    :returns: updated `backend_values`
+    """
+    for group, services in (sizing or dict()).items():
+        group_values = backend_values.setdefault(group, dict())
+        for service, values in services.items():
+            service_values = group_values.setdefault(service, dict())
+            if service_values.get("replicaCount") == 0:
+                continue
+            for key, value in values.items():
+                if isinstance(value, dict) and \
+                        isinstance(service_values.get(key), dict):
+                    service_values[key] = {**service_values[key], **value}
+                else:
+                    service_values[key] = value
+    return backend_values
@@ -0,0 +1,419 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+from os.path import expanduser, isfile, join
+from typing import Any, Callable, List, Optional, Tuple
+
+from neon_diana_utils.configuration import KEDA_MQ_USER, Orchestrator, \
+    build_keys_config, build_llm_bot_config, find_mq_service_user, \
+    load_template, update_rmq_config, validate_output_path, \
+    write_backend_config, write_chatbots_config, write_klat_config, \
+    write_neon_core_config, _get_diana_config_path, _get_rmq_config_path
+from neon_diana_utils.imports import lazy_import, LazyAttribute
+from neon_diana_utils.manifest import Manifest, hash_file, hash_inputs
+from neon_diana_utils.materialize import LinkMode
+from neon_diana_utils.mq_auth import MQAuthIndex
+from neon_diana_utils.rabbitmq_definitions import iter_definitions_section
+
+yaml = lazy_import("yaml")
+LOG = LazyAttribute("ovos_utils.log", "LOG")
+xdg_config_home = LazyAttribute("ovos_utils.xdg_utils", "xdg_config_home")
+
+# Top-level spec sections, in the order they are applied
+SPEC_SECTIONS = ("backend", "neon_core", "chatbots", "klat")
+# Output directory of each section for Kubernetes deployments
+_SECTION_DIRECTORIES = {"backend": "diana-backend", "neon_core": "neon-core",
+                        "chatbots": "chatbots", "klat": "klat-chat"}
+
+
+def load_spec(spec_file: str) -> dict:
+    """
+    Load a deployment spec from a YAML or JSON file
+    :param spec_file: path to spec file; `.json` files are parsed as JSON and
+        anything else as YAML
+    :returns: dict deployment spec
+    """
+    spec_file = expanduser(spec_file)
+    with open(spec_file) as f:
+        if spec_file.endswith(".json"):
+            spec = json.load(f)
+        else:
+            spec = yaml.safe_load(f)
+    if not isinstance(spec, dict):
+        raise ValueError(f"Expected a mapping in {spec_file}")
+    return spec
+
+
+def _get_section(spec: dict, section: str) -> Optional[dict]:
+    """
+    Get a section of a spec, validating its type
+    :param spec: deployment spec
+    :param section: name of section to get
+    :returns: dict section config, or None if the section is not defined
+    """
+    config = spec.get(section)
+    if config is None:
+        return None
+    if config is True:
+        return dict()
+    if not isinstance(config, dict):
+        raise ValueError(f"Expected a mapping for `{section}`, got: {config}")
+    return config
+
+
+def _validate_output_path(output_path: str):
+    """
+    Raise an exception if the requested output path is not available
+    :param output_path: path to validate
+    """
+    if not validate_output_path(output_path):
+        raise FileExistsError(output_path)
+
+
+def _get_existing_secrets(output_path: str,
+                          orchestrator: Orchestrator) -> Tuple[dict, dict]:
+    """
+    Read generated secrets from an existing backend deployment so they are
+    preserved when the backend is regenerated
+    :returns: dict RabbitMQ username to password, dict HANA token secrets
+    """
+    passwords = dict()
+    rmq_config = _get_rmq_config_path(output_path, orchestrator)
+    if isfile(rmq_config):
+        with open(rmq_config) as f:
+            passwords = {user['name']: user.get('password') for user in
+                         iter_definitions_section(f, 'users')}
+    diana_config = _get_diana_config_path(output_path, orchestrator)
+    config = dict()
+    if isfile(diana_config):
+        with open(diana_config) as f:
+            config = yaml.safe_load(f) or dict()
+    # Passwords of hashed users are only in the MQ auth config
+    for auth in ((config.get("MQ") or dict()).get("users") or
+                 dict()).values():
+        if auth.get("user") in passwords and not passwords[auth["user"]]:
+            passwords[auth["user"]] = auth.get("password")
+    values_file = join(output_path, "diana-backend", "values.yaml")
+    if orchestrator == Orchestrator.KUBERNETES and \
+            not passwords.get(KEDA_MQ_USER) and isfile(values_file):
+        # The KEDA password is only in its management API URL
+        from urllib.parse import unquote, urlsplit
+        with open(values_file) as f:
+            values = yaml.safe_load(f) or dict()
+        keda_url = urlsplit((values.get("backend") or dict()).get(
+            "kedaRabbitMQHost") or "")
+        if keda_url.username == KEDA_MQ_USER and keda_url.password:
+            passwords[KEDA_MQ_USER] = unquote(keda_url.password)
+    generated = {user['name'] for user in
+                 load_template("rmq_backend_config.yml",
+                               mutable=False)['users']
+                 if not user['password']}
+    unrecoverable = [user for user, password in passwords.items()
+                     if not password and user in generated]
+    if unrecoverable:
+        LOG.warning(f"Passwords for hashed users will be regenerated: "
+                    f"{unrecoverable}. Configure `backend.credentials` to "
+                    f"keep them stable")
+    return {user: password for user, password in passwords.items()
+            if password}, config.get("hana") or dict()
+
+
+def _get_credentials(config: Optional[dict]):
+    """
+    Build a CredentialService from the `backend.credentials` spec section.
+    With a `master_key_file`, secrets are derived from the key (and optional
+    `context`) so regenerating a deployment yields the same secrets.
+    Generated secrets are persisted if a `store` (`file` or `sqlite`) and
+    `store_path` are specified, namespaced by `context` so deployments may
+    share a store.
+    :returns: CredentialService, or None if no section is specified
+    """
+    if not config:
+        return None
+    from neon_diana_utils.credentials import CredentialService, \
+        DerivedSecretGenerator, FileSecretStore, SQLiteSecretStore, \
+        load_master_key
+    unknown = set(config) - {"master_key_file", "create_master_key",
+                             "context", "store", "store_path"}
+    if unknown:
+        raise ValueError(f"Unknown `backend.credentials` options: "
+                         f"{sorted(unknown)}")
+    key = None
+    if config.get("master_key_file"):
+        key = load_master_key(config["master_key_file"],
+                              config.get("create_master_key", False))
+    context = str(config.get("context", ""))
+    generator = DerivedSecretGenerator(key, context) if key else None
+    store = None
+    if config.get("store"):
+        if not config.get("store_path"):
+            raise ValueError("`backend.credentials.store` requires "
+                             "`store_path`")
+        if config["store"] == "file":
+            store = FileSecretStore(config["store_path"])
+        elif config["store"] == "sqlite":
+            if key is None:
+                raise ValueError("An encrypted `sqlite` store requires "
+                                 "`master_key_file`")
+            store = SQLiteSecretStore(config["store_path"], key)
+        else:
+            raise ValueError(f"Unknown credential store: {config['store']}")
+    return CredentialService(generator, store, context)
+
+
+def _apply_backend(config: dict, output_path: str, orchestrator: Orchestrator,
+                   link_mode: LinkMode, incremental: bool):
+    """
+    Write backend definitions from the `backend` spec section
+    """
+    rabbitmq = config.get("rabbitmq") or dict()
+    if not all((rabbitmq.get("username"), rabbitmq.get("password"))):
+        raise ValueError("`backend.rabbitmq` requires a username and password")
+    hashing_algorithm = rabbitmq.get("hashing_algorithm")
+    if hashing_algorithm not in (None, "rabbit_password_hashing_sha256",
+                                 "rabbit_password_hashing_sha512"):
+        raise ValueError(f"Unsupported `backend.rabbitmq.hashing_algorithm`: "
+                         f"{hashing_algorithm}")
+    keys = dict(config.get("keys") or dict())
+    rmq_passwords = None
+    if incremental:
+        rmq_passwords, hana = _get_existing_secrets(output_path, orchestrator)
+        keys.setdefault("hana", hana or None)
+    llm_personas = config.get("llm_personas")
+    llm_config = build_llm_bot_config(llm_personas) if llm_personas else None
+    github = config.get("github") or dict()
+    sizing = config.get("sizing") or dict()
+    service_sizing = None
+    if sizing.get("services"):
+        from neon_diana_utils.sizing import size_backend
+        service_sizing = size_backend(sizing["services"],
+                                      sizing.get("headroom", 0.25),
+                                      sizing.get("autoscale", False))
+    autoscaling = config.get("autoscaling") or dict()
+    for service, options in autoscaling.items():
+        from neon_diana_utils.sizing import get_service_group, \
+            queue_autoscaling
+        if get_service_group(service) != "diana-mq":
+            raise ValueError(f"Only MQ services can autoscale: {service}")
+        try:
+            queue_autoscaling(**(options or dict()))
+        except TypeError as e:
+            raise ValueError(f"Invalid `backend.autoscaling.{service}`: "
+                             f"{e}") from e
+    credentials = _get_credentials(config.get("credentials"))
+    try:
+        try:
+            keys_config = build_keys_config(**keys, credentials=credentials)
+        except TypeError as e:
+            raise ValueError(f"Invalid `backend.keys`: {e}") from e
+        write_backend_config(
+            output_path, keys_config, rabbitmq["username"],
+            rabbitmq["password"], orchestrator,
+            github_username=github.get("username", ""),
+            github_token=github.get("token", ""),
+            email=config.get("email", ""),
+            domain=config.get("domain", ""),
+            tag=config.get("image_tag", "latest"),
+            disable_optional_http=config.get("disable_optional_http",
+                                             False),
+            llm_config=llm_config,
+            google_credential=config.get("google_credential"),
+            link_mode=link_mode,
+            rmq_passwords=rmq_passwords,
+            service_sizing=service_sizing,
+            autoscaling={service: options or dict()
+                         for service, options in autoscaling.items()},
+            credentials=credentials,
+            hashing_algorithm=hashing_algorithm)
+    finally:
+        if credentials and credentials.store:
+            credentials.store.close()
+
+
+def _get_mq_user(config: dict, mq_tag: str, rmq_config: str,
+                 auth_config: Optional[str] = None) -> dict:
+    """
+    Get the MQ user for a service from its spec section, falling back to the
+    user tagged `mq_tag` in an existing RabbitMQ configuration
+    :returns: dict `user` and `password`
+    """
+    user_config = {"user": config.get("mq_user"),
+                   "password": config.get("mq_password")}
+    if not all(user_config.values()) and isfile(rmq_config):
+        user_config = find_mq_service_user(mq_tag, rmq_config,
+                                           auth_config) or user_config
+    return user_config
+
+
+def _apply_klat(config: dict, output_path: str, orchestrator: Orchestrator,
+                mq_user_config: dict, link_mode: LinkMode) -> str:
+    """
+    Write Klat definitions from the `klat` spec section
+    :returns: path to written Klat configuration
+    """
+    external_url = config.get("url")
+    if not external_url:
+        raise ValueError("`klat.url` is required")
+    if not external_url.startswith("http"):
+        external_url = f"https://{external_url}"
+    subdomain = external_url.split('://', 1)[1].split('.', 1)[0]
+    api_url = config.get("api_url") or \
+        external_url.replace(subdomain, "klatapi", 1)
+    mongo_config = {"port": 27017, **(config.get("mongo") or dict())}
+    sftp_config = {"PORT": 22, "ROOT_PATH": "/files/klat/",
+                   **(config.get("sftp") or dict())}
+    return write_klat_config(
+        output_path, external_url, api_url, mongo_config, sftp_config,
+        mq_user_config, config.get("forward_www", False),
+        config.get("libretranslate_url", "https://libretranslate.2022.us"),
+        orchestrator, link_mode)
+
+
+def _section_outputs(section: str, orchestrator: Orchestrator) -> List[str]:
+    """
+    Get the output paths written by a spec section, relative to the output
+    directory
+    """
+    if orchestrator == Orchestrator.COMPOSE:
+        return ["."]
+    return [_SECTION_DIRECTORIES[section]]
+
+
+def _run_section(manifest: Optional[Manifest], section: str, inputs: dict,
+                 orchestrator: Orchestrator, generate: Callable[[], Any]):
+    """
+    Generate a spec section. If a manifest is specified, the section is only
+    generated if its inputs or outputs changed since it was last generated.
+    """
+    if manifest is None:
+        generate()
+        return
+    inputs_hash = hash_inputs({**inputs, "orchestrator": orchestrator.value})
+    if manifest.is_current(section, inputs_hash):
+        LOG.info(f"{section} is up to date")
+        return
+    generate()
+    manifest.record(section, inputs_hash,
+                    _section_outputs(section, orchestrator))
+
+
+def apply_spec(spec: dict, output_path: Optional[str] = None,
+               link_mode: LinkMode = LinkMode.AUTO,
+               incremental: bool = False) -> str:
+    """
+    Generate deployment definitions from a spec without prompting for any
+    input. Each of the `backend`, `neon_core`, `chatbots`, and `klat` sections
+    is optional and is applied in that order, so later sections may reference
+    the RabbitMQ configuration generated by `backend`.
+    :param spec: dict deployment spec, i.e. from `load_spec`
+    :param output_path: directory to write output definitions to; overrides
+        `output_path` in the spec
+    :param link_mode: how to materialize unmodified template files
+    :param incremental: if True, update existing outputs, regenerating only
+        sections whose inputs changed since the last run. Generated secrets
+        are preserved and unchanged files are not modified
+    :returns: path to generated definitions
+    """
+    unknown = set(spec) - {"orchestrator", "output_path", *SPEC_SECTIONS}
+    if unknown:
+        raise ValueError(f"Unknown spec sections: {sorted(unknown)}")
+    orchestrator = Orchestrator(spec.get("orchestrator", "kubernetes"))
+    output_path = expanduser(output_path or spec.get("output_path") or
+                             join(xdg_config_home(), "diana"))
+    rmq_config = _get_rmq_config_path(output_path, orchestrator)
+    diana_config = _get_diana_config_path(output_path, orchestrator)
+    manifest = Manifest(output_path) if incremental else None
+
+    if not incremental and orchestrator == Orchestrator.COMPOSE:
+        # docker-compose sections are all written to `output_path`
+        _validate_output_path(output_path)
+
+    def _check_output_path(section: str):
+        if not incremental and orchestrator == Orchestrator.KUBERNETES:
+            _validate_output_path(join(output_path,
+                                       _SECTION_DIRECTORIES[section]))
+
+    backend = _get_section(spec, "backend")
+    if backend is not None:
+        _check_output_path("backend")
+        _run_section(manifest, "backend", {"backend": backend}, orchestrator,
+                     lambda: _apply_backend(backend, output_path, orchestrator,
+                                            link_mode, incremental))
+
+    neon_core = _get_section(spec, "neon_core")
+    if neon_core is not None:
+        _check_output_path("neon_core")
+        if backend is not None and not neon_core.get("mq_user"):
+            user_config = MQAuthIndex.from_file(
+                rmq_config, diana_config).credentials("chat_api_proxy")
+        else:
+            user_config = _get_mq_user(neon_core, "core", rmq_config,
+                                       diana_config)
+        _run_section(manifest, "neon_core",
+                     {"neon_core": neon_core, "mq_user": user_config},
+                     orchestrator,
+                     lambda: write_neon_core_config(
+                         output_path, user_config["user"],
+                         user_config["password"], orchestrator,
+                         neon_core.get("image_tag", "latest"),
+                         neon_core.get("iris_domain"), link_mode))
+
+    chatbots = _get_section(spec, "chatbots")
+    if chatbots is not None:
+        _check_output_path("chatbots")
+        if chatbots.get("update_rabbitmq"):
+            update_rmq_config(rmq_config)
+        rmq_hash = hash_file(rmq_config) if isfile(rmq_config) else None
+        _run_section(manifest, "chatbots",
+                     {"chatbots": chatbots, "rabbitmq": rmq_hash},
+                     orchestrator,
+                     lambda: write_chatbots_config(
+                         output_path, rmq_config, orchestrator, False,
+                         chatbots.get("import_users", True), link_mode))
+
+    klat = _get_section(spec, "klat")
+    if klat is not None:
+        _check_output_path("klat")
+        if klat.get("update_rabbitmq"):
+            update_rmq_config(rmq_config)
+        user_config = _get_mq_user(klat, "klat", rmq_config, diana_config)
+        _run_section(manifest, "klat", {"klat": klat, "mq_user": user_config},
+                     orchestrator,
+                     lambda: _apply_klat(klat, output_path, orchestrator,
+                                         user_config, link_mode))
+
+    if manifest is not None:
+        if orchestrator == Orchestrator.COMPOSE:
+            # Compose sections share an output directory and files (i.e.
+            # `.env`), so each section is checked against the merged outputs
+            manifest.update_outputs(
+                [section for section in SPEC_SECTIONS
+                 if _get_section(spec, section) is not None], ["."])
+        manifest.save()
+    LOG.info(f"Outputs generated in {output_path}")
+    return output_path
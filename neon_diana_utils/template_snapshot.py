@@ -0,0 +1,128 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pickle
+
+from glob import glob
+from hashlib import sha256
+from os import stat
+from os.path import join, dirname, relpath, isfile
+from typing import Any, Dict, Optional
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_FILE = "template_snapshot.pickle"
+# Bundled YAML templates to include in the snapshot
+SNAPSHOT_TEMPLATES = ("*.yml", join("*", "values.yaml"))
+TEMPLATE_DIR = join(dirname(__file__), "templates")
+
+
+def _file_hash(file_path: str) -> str:
+    """
+    Get the sha256 hex digest of a file's contents
+    """
+    with open(file_path, 'rb') as f:
+        return sha256(f.read()).hexdigest()
+
+
+def build_template_snapshot(template_dir: str = TEMPLATE_DIR,
+                            output_file: Optional[str] = None) -> str:
+    """
+    Parse bundled YAML templates and serialize them to a snapshot that can be
+    loaded much faster than the YAML sources. This is run when the package is
+    built, or may be run manually with
+    `python -m neon_diana_utils.template_snapshot`.
+    :param template_dir: directory containing templates to snapshot
+    :param output_file: snapshot file to write (default in `template_dir`)
+    :returns: path to the written snapshot
+    """
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    output_file = output_file or join(template_dir, SNAPSHOT_FILE)
+    templates = dict()
+    for pattern in SNAPSHOT_TEMPLATES:
+        for file_path in sorted(glob(join(template_dir, pattern))):
+            with open(file_path, 'rb') as f:
+                contents = f.read()
+            templates[relpath(file_path, template_dir)] = {
+                "mtime": stat(file_path).st_mtime_ns,
+                "sha256": sha256(contents).hexdigest(),
+                "data": yaml.load(contents, Loader=loader)}
+    with open(output_file, 'wb') as f:
+        # Protocol 4 is supported by all targeted Python versions
+        pickle.dump({"format": SNAPSHOT_FORMAT, "templates": templates}, f,
+                    protocol=4)
+    return output_file
+
+
+class TemplateSnapshot:
+    def __init__(self, template_dir: str = TEMPLATE_DIR):
+        """
+        Read-only access to a snapshot written by `build_template_snapshot`.
+        The snapshot is loaded on first access; a snapshot entry is only used
+        if its source file is unchanged since the snapshot was built.
+        :param template_dir: directory containing templates and snapshot
+        """
+        self._template_dir = template_dir
+        self._templates: Optional[Dict[str, dict]] = None
+
+    @property
+    def templates(self) -> Dict[str, dict]:
+        """
+        Snapshot entries by template path relative to the template directory
+        """
+        if self._templates is None:
+            self._templates = dict()
+            snapshot_file = join(self._template_dir, SNAPSHOT_FILE)
+            if isfile(snapshot_file):
+                try:
+                    with open(snapshot_file, 'rb') as f:
+                        snapshot = pickle.load(f)
+                    if snapshot.get("format") == SNAPSHOT_FORMAT:
+                        self._templates = snapshot['templates']
+                except Exception:
+                    # An unreadable snapshot is equivalent to no snapshot
+                    pass
+        return self._templates
+
+    def get(self, template_file: str, mtime: int) -> Optional[Any]:
+        """
+        Get parsed template contents from the snapshot
+        :param template_file: absolute path to the template file
+        :param mtime: current modification time (ns) of `template_file`
+        :returns: parsed contents if the snapshot is current, else None
+        """
+        entry = self.templates.get(relpath(template_file, self._template_dir))
+        if entry is None:
+            return None
+        if mtime > entry['mtime'] and \
+                _file_hash(template_file) != entry['sha256']:
+            # Source is newer than the snapshot and contents changed
+            return None
+        return entry['data']
+
+
+if __name__ == "__main__":
+    print(f"Wrote {build_template_snapshot()}")
@@ -24,32 +24,48 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from sys import argv
-from os import walk
-from os.path import join, dirname
 
+import sys
 
-def sync_app_version(version: str):
+from argparse import ArgumentParser
+from os.path import dirname, relpath
+
+sys.path.insert(0, dirname(dirname(__file__)))
+
+from neon_diana_utils.chart_graph import ChartGraph, BUMP_PARTS
+
+
+def sync_app_version(version: str, bump: str = None, check: bool = False):
     """
-    Synchronize current Diana package version with bundled Helm charts
+    Synchronize current Diana package version with bundled Helm charts and
+    update dependency version pins to match
+    :param version: package version to set as `appVersion`
+    :param bump: part of chart versions to bump for changed charts
+    :param check: if True, report charts that are out of sync without
+        writing changes
+    :returns: list of changed (or out of sync) `Chart.yaml` paths
     """
-    chart_dir = join(dirname(dirname(__file__)),
-                     "neon_diana_utils", "helm_charts")
-    for root, _, files in walk(chart_dir):
-        for file in files:
-            if file == "Chart.yaml":
-                file_path = join(root, file)
-                print(f"Updating {file_path}")
-                with open(file_path, 'r') as f:
-                    lines = f.readlines()
-                for idx, line in enumerate(lines):
-                    if line.startswith("appVersion: "):
-                        lines[idx] = f"appVersion: \"{version}\"\n"
-                with open(file_path, 'w') as f:
-                    f.writelines(lines)
-                break
+    graph = ChartGraph.load()
+    if check:
+        changed = list(graph.plan_sync(version, bump))
+    else:
+        changed = graph.sync(version, bump)
+    root = dirname(dirname(__file__))
+    for file_path in changed:
+        print(f"{'Out of sync' if check else 'Updated'}: "
+              f"{relpath(file_path, root)}")
+    return changed
 
 
 if __name__ == "__main__":
-    ver = argv[1]
-    sync_app_version(ver)
+    parser = ArgumentParser(description="Sync bundled Helm chart versions")
+    parser.add_argument("version", help="Package version to set as "
+                                        "`appVersion`")
+    parser.add_argument("--bump", choices=BUMP_PARTS, default=None,
+                        help="Bump the version of changed charts and their "
+                             "dependents")
+    parser.add_argument("--check", action="store_true",
+                        help="Exit with an error if any chart is out of sync")
+    args = parser.parse_args()
+    if sync_app_version(args.version, args.bump, args.check) and args.check:
+        sys.exit(1)
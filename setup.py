@@ -27,6 +27,7 @@
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 from os import getenv, path, walk
 
 BASE_PATH = path.abspath(path.dirname(__file__))
@@ -76,6 +77,27 @@ def find_resource_files():
     return package_data
 
 
+class BuildPyCommand(build_py):
+    def run(self):
+        """
+        Build the package and include a snapshot of parsed YAML templates
+        """
+        super().run()
+        from importlib.util import spec_from_file_location, module_from_spec
+        spec = spec_from_file_location(
+            "template_snapshot", path.join(BASE_PATH, "neon_diana_utils",
+                                           "template_snapshot.py"))
+        snapshot = module_from_spec(spec)
+        spec.loader.exec_module(snapshot)
+        template_dir = path.join(self.build_lib, "neon_diana_utils",
+                                 "templates")
+        try:
+            print(f"Wrote {snapshot.build_template_snapshot(template_dir)}")
+        except ImportError as e:
+            # Templates will be parsed from YAML at runtime
+            print(f"Skipping template snapshot: {e}")
+
+
 setup(
     name='neon-diana-utils',
     version=version,
@@ -90,7 +112,10 @@ setup(
     package_data={'neon_diana_utils': find_resource_files()},
     include_package_data=True,
     install_requires=get_requirements("requirements.txt"),
+    extras_require={"async": get_requirements("async_requirements.txt"),
+                    "crypto": get_requirements("crypto_requirements.txt")},
     zip_safe=True,
+    cmdclass={"build_py": BuildPyCommand},
     classifiers=[
         'Intended Audience :: Developers',
         'Programming Language :: Python :: 3.6',
@@ -0,0 +1,215 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Development System
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2021 Neongecko.com Inc.
+# BSD-3
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Performance benchmarks for the configuration generators. These are skipped
+unless `pytest-benchmark` is installed
+(`requirements/benchmark_requirements.txt`).
+Save a baseline and compare later runs against it on the same machine, i.e.:
+    pytest tests/test_benchmarks.py --benchmark-autosave
+    pytest tests/test_benchmarks.py --benchmark-compare \
+        --benchmark-compare-fail=min:50%
+Some benchmarks vary by more than 25% between runs, so compare on `min` with
+a wide threshold.
+"""
+
+import json
+import pickle
+import shutil
+
+import pytest
+
+from os.path import join
+from unittest.mock import patch
+
+pytest.importorskip("pytest_benchmark")
+
+SCALE_USERS = 10000
+SCALE_VHOSTS = 1000
+SCALE_PERMISSIONS = 50000
+SCALE_SERVICES_PER_USER = 5
+
+
+@pytest.fixture(scope="module")
+def scale_definitions() -> dict:
+    """
+    Synthetic RabbitMQ base config with unconfigured user passwords
+    """
+    users = [{"name": f"user_{i}", "password": None,
+              "tags": ["backend", "service"]} for i in range(SCALE_USERS)]
+    # Chatbot users are last so lookups read the whole `users` section
+    users.extend({"name": name, "password": None, "tags": ["chatbots"]}
+                 for name in ("neon_bot_submind", "neon_bot_facilitator"))
+    vhosts = [{"name": f"/vhost_{i}"} for i in range(SCALE_VHOSTS)]
+    # Each user has permissions on consecutive vhosts
+    permissions = [{"user": f"user_{i % SCALE_USERS}",
+                    "vhost": f"/vhost_{(i + i // SCALE_USERS) % SCALE_VHOSTS}",
+                    "configure": ".*", "write": ".*", "read": ".*"}
+                   for i in range(SCALE_PERMISSIONS)]
+    return {"users": users, "vhosts": vhosts, "permissions": permissions}
+
+
+@pytest.fixture(scope="module")
+def scale_mapping() -> dict:
+    """
+    Synthetic `mq_user_mapping.yml` with several services per user
+    """
+    mapping = {f"user_{i}": [f"service_{i}_{j}"
+                             for j in range(SCALE_SERVICES_PER_USER)]
+               for i in range(SCALE_USERS)}
+    mapping['neon_bot_submind'] = [f"submind_{i}" for i in range(1000)]
+    mapping['neon_bot_facilitator'] = [f"facilitator_{i}"
+                                       for i in range(100)]
+    return mapping
+
+
+@pytest.fixture
+def scale_rmq_file(tmp_path, scale_definitions) -> str:
+    definitions = {**scale_definitions,
+                   "users": [{**user, "password": "password"}
+                             for user in scale_definitions['users']]}
+    rmq_file = join(tmp_path, "rabbitmq.json")
+    with open(rmq_file, 'w') as f:
+        json.dump(definitions, f, indent=2)
+    return rmq_file
+
+
+def _patch_templates(**templates):
+    """
+    Patch `load_template` to return synthetic templates. As with the
+    template cache, mutable templates are unpickled for each call and
+    read-only templates are the same object for every call.
+    """
+    from neon_diana_utils.configuration import load_template
+    serialized = {name: pickle.dumps(data)
+                  for name, data in templates.items()}
+
+    def _load(template: str, mutable: bool = True):
+        if template not in serialized:
+            return load_template(template, mutable)
+        if not mutable:
+            return templates[template]
+        return pickle.loads(serialized[template])
+    return patch("neon_diana_utils.configuration.load_template", _load)
+
+
+def test_generate_rmq_config(benchmark):
+    from neon_diana_utils.configuration import generate_rmq_config
+    config = benchmark(generate_rmq_config, "admin", "password")
+    assert config['users'][-1]['name'] == "admin"
+
+
+def test_generate_rmq_config_scale(benchmark, scale_definitions):
+    from neon_diana_utils.configuration import generate_rmq_config
+    with _patch_templates(**{"rmq_backend_config.yml": scale_definitions}):
+        config = benchmark(generate_rmq_config, "admin", "password")
+    assert len(config['users']) == SCALE_USERS + 3
+    assert all(user['password'] for user in config['users'])
+
+
+def test_hash_user_passwords_scale(benchmark, scale_definitions):
+    from neon_diana_utils.rabbitmq_definitions import hash_user_passwords
+    definitions = {**scale_definitions,
+                   "users": [{**user, "password": "password"}
+                             for user in scale_definitions['users']]}
+    hashed = benchmark(hash_user_passwords, definitions)
+    assert all(user['password_hash'] for user in hashed['users'])
+
+
+def test_hash_user_passwords_unchanged_scale(benchmark, scale_definitions):
+    from neon_diana_utils.rabbitmq_definitions import hash_user_passwords
+    definitions = {**scale_definitions,
+                   "users": [{**user, "password": "password"}
+                             for user in scale_definitions['users']]}
+    existing = hash_user_passwords(definitions)['users']
+    hashed = benchmark(hash_user_passwords, definitions, existing=existing)
+    assert hashed['users'] == existing
+
+
+def test_update_rmq_config(benchmark, tmp_path):
+    from neon_diana_utils.configuration import generate_rmq_config, \
+        update_rmq_config
+    rmq_file = join(tmp_path, "rabbitmq.json")
+    generate_rmq_config("admin", "password", rmq_file)
+    benchmark(update_rmq_config, rmq_file)
+
+
+def test_update_rmq_config_scale(benchmark, scale_rmq_file):
+    from neon_diana_utils.configuration import update_rmq_config
+    benchmark(update_rmq_config, scale_rmq_file)
+    with open(scale_rmq_file) as f:
+        config = json.load(f)
+    assert len(config['permissions']) >= SCALE_PERMISSIONS
+
+
+def test_generate_mq_auth_config(benchmark):
+    from neon_diana_utils.configuration import generate_rmq_config, \
+        generate_mq_auth_config
+    config = generate_rmq_config("admin", "password")
+    assert benchmark(generate_mq_auth_config, config)
+
+
+def test_generate_mq_auth_config_scale(benchmark, scale_definitions,
+                                       scale_mapping):
+    from neon_diana_utils.configuration import generate_mq_auth_config
+    config = {**scale_definitions,
+              "users": [{**user, "password": "password"}
+                        for user in scale_definitions['users']]}
+    with _patch_templates(**{"mq_user_mapping.yml": scale_mapping}):
+        auth = benchmark(generate_mq_auth_config, config)
+    assert len(auth) == SCALE_USERS * SCALE_SERVICES_PER_USER + 1100
+
+
+@patch("click.confirm", lambda *_, **__: True)
+def test_get_chatbots_mq_config_scale(benchmark, scale_rmq_file,
+                                      scale_mapping):
+    from neon_diana_utils.configuration import _get_chatbots_mq_config
+    with _patch_templates(**{"mq_user_mapping.yml": scale_mapping}):
+        config = benchmark(_get_chatbots_mq_config, scale_rmq_file)
+    assert len(config['MQ']['users']) == 1100
+    assert config['MQ']['users']['submind_0']['password'] == "password"
+
+
+@patch("click.prompt", lambda text, **kwargs: kwargs.get("default") or "key")
+@patch("click.confirm", lambda *_, **__: True)
+def test_make_keys_config(benchmark):
+    from neon_diana_utils.configuration import make_keys_config
+    config = benchmark(make_keys_config, False)
+    assert config['keys']['api_services']
+
+
+@patch("click.prompt", lambda text, **kwargs: kwargs.get("default") or
+       "diana.test")
+@patch("click.confirm", lambda text, **_: "correct" in text)
+def test_configure_backend(benchmark, tmp_path):
+    from neon_diana_utils.configuration import configure_backend
+    output_path = join(tmp_path, "diana")
+
+    def _setup():
+        shutil.rmtree(output_path, ignore_errors=True)
+        return ("admin", "password", output_path), dict()
+
+    benchmark.pedantic(configure_backend, setup=_setup, rounds=5)
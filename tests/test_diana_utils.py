@@ -31,7 +31,7 @@ import unittest
 import yaml
 
 from unittest.mock import patch
-from os.path import join, dirname, isdir, isfile
+from os.path import join, dirname, isdir, isfile, basename
 
 
 class TestConfiguration(unittest.TestCase):
@@ -53,6 +53,68 @@ class TestConfiguration(unittest.TestCase):
                                                   'test.txt')))
         shutil.rmtree(valid_output_path)
 
+    def test_load_template(self):
+        from neon_diana_utils.configuration import load_template
+        mapping = load_template("mq_user_mapping.yml")
+        self.assertIsInstance(mapping, dict)
+        self.assertEqual(mapping['neon_core'], ['chat_api_proxy'])
+
+        # Mutable copies are independent
+        mapping['neon_core'].append("modified")
+        self.assertEqual(load_template("mq_user_mapping.yml")['neon_core'],
+                         ['chat_api_proxy'])
+
+        # Read-only views are shared
+        frozen = load_template("mq_user_mapping.yml", False)
+        self.assertIs(frozen, load_template("mq_user_mapping.yml", False))
+        self.assertEqual(frozen['neon_core'], ('chat_api_proxy',))
+        with self.assertRaises(TypeError):
+            frozen['neon_core'] = []
+
+        # Modified files are re-parsed
+        test_file = join(dirname(__file__), "test_template.yml")
+        with open(test_file, 'w') as f:
+            f.write("key: value")
+        self.assertEqual(load_template(test_file), {"key": "value"})
+        with open(test_file, 'w') as f:
+            f.write("key: new_value")
+        os.utime(test_file, ns=(0, os.stat(test_file).st_mtime_ns + 1))
+        self.assertEqual(load_template(test_file), {"key": "new_value"})
+        os.remove(test_file)
+
+    def test_template_snapshot(self):
+        from tempfile import mkdtemp
+        from neon_diana_utils.template_snapshot import TemplateSnapshot, \
+            build_template_snapshot, TEMPLATE_DIR
+        from neon_diana_utils.configuration import load_template
+        template_dir = join(mkdtemp(), "templates")
+        shutil.copytree(TEMPLATE_DIR, template_dir)
+        snapshot_file = build_template_snapshot(template_dir)
+        self.assertTrue(isfile(snapshot_file))
+
+        snapshot = TemplateSnapshot(template_dir)
+        self.assertEqual(set(snapshot.templates),
+                         {"llm_personas.yml", "mq_user_mapping.yml",
+                          "rmq_backend_config.yml", "service_capacity.yml",
+                          join("backend", "values.yaml"),
+                          join("chatbots", "values.yaml"),
+                          join("klat", "values.yaml"),
+                          join("neon", "values.yaml")})
+        mapping_file = join(template_dir, "mq_user_mapping.yml")
+        mtime = os.stat(mapping_file).st_mtime_ns
+        self.assertEqual(snapshot.get(mapping_file, mtime),
+                         load_template("mq_user_mapping.yml"))
+
+        # Newer source files with unchanged contents use the snapshot
+        self.assertIsNotNone(snapshot.get(mapping_file, mtime + 1))
+
+        # Modified source files are not read from the snapshot
+        with open(mapping_file, 'a') as f:
+            f.write("\nnew_user:\n  - new_service\n")
+        self.assertIsNone(snapshot.get(mapping_file, mtime + 1))
+        self.assertIsNone(snapshot.get(join(template_dir, "other.yml"), 0))
+        shutil.rmtree(dirname(template_dir))
+
     @patch("click.confirm")
     def test_make_llm_bot_config(self, confirm):
         from neon_diana_utils.configuration import make_llm_bot_config
@@ -117,6 +179,27 @@ class TestConfiguration(unittest.TestCase):
         os.remove(test_file)
         shutil.move(f"{test_file}.old", test_file)
 
+    def test_update_rmq_config_hashed(self):
+        from neon_diana_utils.configuration import generate_rmq_config, \
+            update_rmq_config
+        from neon_diana_utils.rabbitmq_definitions import hash_user_passwords
+        test_file = join(dirname(__file__), "test_hashed_rabbitmq.json")
+        config = hash_user_passwords(generate_rmq_config("admin", "pass"),
+                                     "rabbit_password_hashing_sha512")
+        added = config['users'].pop(0)['name']
+        with open(test_file, 'w') as f:
+            json.dump(config, f)
+        update_rmq_config(test_file)
+        with open(test_file) as f:
+            users = json.load(f)['users']
+        self.assertIn(added, [user['name'] for user in users])
+        for user in users:
+            self.assertNotIn('password', user)
+            self.assertEqual(user['hashing_algorithm'],
+                             "rabbit_password_hashing_sha512")
+        os.remove(test_file)
+        os.remove(f"{test_file}.old")
+
     def test_generate_rmq_config(self):
         from neon_diana_utils.configuration import generate_rmq_config
         test_output_file = join(dirname(__file__), "test_rmq.json")
@@ -186,6 +269,57 @@ class TestConfiguration(unittest.TestCase):
             self.assertEqual(user['name'], service_auth['user'])
             self.assertEqual(user['password'], service_auth['password'])
 
+    def test_mq_auth_index(self):
+        from neon_diana_utils.mq_auth import MQAuthIndex
+        definitions = {"users": [{"name": "bots", "password": "pass",
+                                  "tags": ["chatbots"]},
+                                 {"name": "api", "password": "api_pass",
+                                  "tags": "backend,service"}]}
+        index = MQAuthIndex.from_definitions(definitions, {
+            "bots": ["alice", "eliza"], "api": ["api_proxy"],
+            "missing": ["orphan"]})
+        self.assertEqual(index.services("bots"), ("alice", "eliza"))
+        self.assertEqual(index.user("eliza"), "bots")
+        self.assertEqual(index.credentials("api_proxy"),
+                         {"user": "api", "password": "api_pass"})
+        self.assertIsNone(index.credentials("orphan"))
+        self.assertEqual(index.find_tag("service")['user'], "api")
+        self.assertIsNone(index.find_tag("unknown"))
+        self.assertEqual(set(index.auth_config()),
+                         {"alice", "eliza", "api_proxy"})
+
+        # Incremental updates
+        copy = index.copy()
+        copy.add_user({"name": "missing", "password": "new"})
+        copy.map_service("bots", "grant")
+        copy.map_service("bots", "api_proxy")
+        self.assertEqual(copy.credentials("orphan")['password'], "new")
+        self.assertEqual(copy.credentials("grant")['user'], "bots")
+        self.assertEqual(copy.credentials("api_proxy")['user'], "bots")
+        self.assertEqual(copy.services("api"), ())
+        self.assertIsNone(index.credentials("grant"))
+        self.assertEqual(index.user("api_proxy"), "api")
+
+        # Default mapping is compiled once and shared
+        self.assertIs(MQAuthIndex()._service_users,
+                      MQAuthIndex()._service_users)
+
+        # File indexes are cached until the file changes
+        rmq_config = join(dirname(__file__), "test_rabbitmq.json")
+        file_index = MQAuthIndex.from_file(rmq_config)
+        self.assertIs(MQAuthIndex.from_file(rmq_config), file_index)
+        self.assertEqual(file_index.find_tag("test")['user'], "neon_test")
+
+        # Cached file indexes are bounded and may be cleared
+        from neon_diana_utils.mq_auth import clear_file_cache, _FILE_CACHE, \
+            _FILE_CACHE_SIZE
+        for idx in range(_FILE_CACHE_SIZE + 2):
+            MQAuthIndex.from_file(rmq_config, f"missing_{idx}.yaml")
+        self.assertEqual(len(_FILE_CACHE), _FILE_CACHE_SIZE)
+        self.assertIsNot(MQAuthIndex.from_file(rmq_config), file_index)
+        clear_file_cache()
+        self.assertEqual(len(_FILE_CACHE), 0)
+
     def test_update_env_file(self):
         from neon_diana_utils.configuration import update_env_file
         test_file = join(dirname(__file__), "test.env")
@@ -311,6 +445,1062 @@ class TestConfiguration(unittest.TestCase):
         # TODO
 
 
+class TestSpec(unittest.TestCase):
+    @staticmethod
+    def _read_tree(root: str) -> dict:
+        contents = dict()
+        for path, _, files in os.walk(root):
+            for file in files:
+                with open(join(path, file), 'rb') as f:
+                    contents[os.path.relpath(join(path, file), root)] = \
+                        f.read()
+        return contents
+
+    @staticmethod
+    def _stat_tree(root: str) -> dict:
+        stats = dict()
+        for path, _, files in os.walk(root):
+            for file in files:
+                file_stat = os.stat(join(path, file))
+                stats[os.path.relpath(join(path, file), root)] = \
+                    (file_stat.st_ino, file_stat.st_mtime_ns)
+        return stats
+
+    def test_load_spec(self):
+        from neon_diana_utils.spec import load_spec
+        spec = {"backend": {"rabbitmq": {"username": "admin",
+                                         "password": "pass"}}}
+        spec_file = join(dirname(__file__), "test_spec.json")
+        with open(spec_file, 'w') as f:
+            json.dump(spec, f)
+        self.assertEqual(load_spec(spec_file), spec)
+        with open(spec_file, 'w') as f:
+            yaml.safe_dump(["not", "a", "spec"], f)
+        with self.assertRaises(ValueError):
+            load_spec(spec_file)
+        os.remove(spec_file)
+
+    @patch("neon_diana_utils.credentials.SecretGenerator.token_bytes")
+    @patch("click.prompt")
+    @patch("click.confirm")
+    def test_apply_spec(self, confirm, prompt, token_bytes):
+        from neon_diana_utils.configuration import configure_backend, \
+            configure_neon_core, configure_chatbots, configure_klat_chat
+        from neon_diana_utils.spec import apply_spec
+        token_bytes.side_effect = lambda n=32: b"\0" * n
+        answers = {"Root domain for HTTP services": "diana.test",
+                   "Email address for SSL Certificates": "test@diana.test",
+                   "Klat Client URL": "https://chat.diana.test",
+                   "MongoDB host address": "mongo:27017",
+                   "MongoDB username": "mongo_user",
+                   "MongoDB password": "mongo_pass",
+                   "MongoDB database": "klat",
+                   "SFTP host URL/IP address": "sftp",
+                   "SFTP auth username": "sftp_user",
+                   "SFTP auth password": "sftp_pass"}
+        prompt.side_effect = \
+            lambda text, **kwargs: answers.get(text, kwargs.get("default"))
+        confirm.side_effect = \
+            lambda text, **_: "correct" in text or text.startswith("Import")
+
+        interactive_path = join(dirname(__file__), "interactive_output")
+        configure_backend("admin", "admin_pass", interactive_path)
+        configure_neon_core(None, None, interactive_path)
+        configure_chatbots(output_path=interactive_path)
+        configure_klat_chat(output_path=interactive_path)
+
+        spec = {"backend": {"rabbitmq": {"username": "admin",
+                                         "password": "admin_pass"},
+                            "email": "test@diana.test",
+                            "domain": "diana.test"},
+                "neon_core": {},
+                "chatbots": {},
+                "klat": {"url": "https://chat.diana.test",
+                         "mongo": {"host": "mongo",
+                                   "username": "mongo_user",
+                                   "password": "mongo_pass",
+                                   "database": "klat"},
+                         "sftp": {"HOST": "sftp",
+                                  "USERNAME": "sftp_user",
+                                  "PASSWORD": "sftp_pass"}}}
+        spec_path = join(dirname(__file__), "spec_output")
+        prompt.reset_mock()
+        confirm.reset_mock()
+        self.assertEqual(apply_spec(spec, spec_path), spec_path)
+        prompt.assert_not_called()
+        confirm.assert_not_called()
+
+        self.assertEqual(self._read_tree(spec_path),
+                         self._read_tree(interactive_path))
+
+        # Existing outputs are not overwritten
+        with self.assertRaises(FileExistsError):
+            apply_spec({"neon_core": {}}, spec_path)
+        with self.assertRaises(ValueError):
+            apply_spec({"invalid": {}}, spec_path)
+        shutil.rmtree(interactive_path)
+        shutil.rmtree(spec_path)
+
+    def test_apply_spec_incremental(self):
+        from neon_diana_utils.spec import apply_spec
+        from neon_diana_utils.manifest import MANIFEST_FILE
+        output_path = join(dirname(__file__), "incremental_output")
+        spec = {"backend": {"rabbitmq": {"username": "admin",
+                                         "password": "pass"},
+                            "domain": "diana.test"},
+                "neon_core": {"image_tag": "latest"},
+                "chatbots": {}}
+        apply_spec(spec, output_path, incremental=True)
+        self.assertTrue(isfile(join(output_path, MANIFEST_FILE)))
+        initial = self._stat_tree(output_path)
+        initial_contents = TestSpec._read_tree(output_path)
+
+        # Unchanged inputs do not modify any files
+        apply_spec(spec, output_path, incremental=True)
+        self.assertEqual(self._stat_tree(output_path), initial)
+        with self.assertRaises(FileExistsError):
+            apply_spec(spec, output_path)
+
+        # Only changed outputs are written
+        spec["neon_core"]["image_tag"] = "dev"
+        apply_spec(spec, output_path, incremental=True)
+        changed = {file for file, stat in self._stat_tree(output_path).items()
+                   if initial[file] != stat}
+        self.assertEqual(changed, {join("neon-core", "values.yaml"),
+                                   MANIFEST_FILE})
+
+        # Generated secrets are preserved
+        spec["backend"]["domain"] = "updated.test"
+        apply_spec(spec, output_path, incremental=True)
+        contents = TestSpec._read_tree(output_path)
+        for file in (join("diana-backend", "rabbitmq.json"),
+                     join("diana-backend", "diana.yaml"),
+                     join("chatbots", "chatbots.yaml")):
+            self.assertEqual(contents[file], initial_contents[file])
+        self.assertNotEqual(contents[join("diana-backend", "values.yaml")],
+                            initial_contents[join("diana-backend",
+                                                  "values.yaml")])
+
+        # Modified outputs are regenerated
+        os.remove(join(output_path, "neon-core", "neon.yaml"))
+        apply_spec(spec, output_path, incremental=True)
+        self.assertTrue(isfile(join(output_path, "neon-core", "neon.yaml")))
+        shutil.rmtree(output_path)
+
+    def test_apply_spec_incremental_compose(self):
+        from neon_diana_utils.spec import apply_spec
+        output_path = join(dirname(__file__), "compose_output")
+        spec = {"orchestrator": "docker-compose",
+                "backend": {"rabbitmq": {"username": "admin",
+                                         "password": "pass"}},
+                "neon_core": {}}
+        apply_spec(spec, output_path, incremental=True)
+        initial = self._stat_tree(output_path)
+
+        # Sections sharing files (i.e. `.env`) do not regenerate each other
+        apply_spec(spec, output_path, incremental=True)
+        self.assertEqual(self._stat_tree(output_path), initial)
+
+        # Regenerating one section settles after one run
+        spec["backend"]["domain"] = "updated.test"
+        apply_spec(spec, output_path, incremental=True)
+        updated = self._stat_tree(output_path)
+        apply_spec(spec, output_path, incremental=True)
+        self.assertEqual(self._stat_tree(output_path), updated)
+
+        # Existing output is not overwritten
+        with self.assertRaises(FileExistsError):
+            apply_spec(spec, output_path)
+        self.assertEqual(self._stat_tree(output_path), updated)
+        shutil.rmtree(output_path)
+
+    def test_apply_spec_hashed_passwords(self):
+        from neon_diana_utils.rabbitmq_definitions import check_password_hash
+        from neon_diana_utils.spec import apply_spec
+        output_path = join(dirname(__file__), "hashed_output")
+        spec = {"backend": {"rabbitmq": {
+            "username": "admin", "password": "pass",
+            "hashing_algorithm": "rabbit_password_hashing_sha512"}},
+            "neon_core": {},
+            "chatbots": {}}
+        apply_spec(spec, output_path, incremental=True)
+        contents = self._read_tree(output_path)
+        rabbitmq = join("diana-backend", "rabbitmq.json")
+        users = {user['name']: user
+                 for user in json.loads(contents[rabbitmq])['users']}
+        self.assertTrue(all("password" not in user and
+                            user['hashing_algorithm'] ==
+                            "rabbit_password_hashing_sha512"
+                            for user in users.values()))
+        self.assertTrue(check_password_hash("pass",
+                                            users["admin"]['password_hash'],
+                                            "rabbit_password_hashing_sha512"))
+
+        # Auth config is generated from plaintext passwords
+        diana = yaml.safe_load(contents[join("diana-backend", "diana.yaml")])
+        mq_users = diana["MQ"]["users"]
+        for auth in mq_users.values():
+            self.assertTrue(check_password_hash(
+                auth["password"], users[auth["user"]]['password_hash'],
+                "rabbit_password_hashing_sha512"))
+
+        # Consumers read hashed users' passwords from the auth config
+        neon = yaml.safe_load(contents[join("neon-core", "neon.yaml")])
+        self.assertEqual(neon["MQ"]["users"]["neon_chat_api"]["password"],
+                         mq_users["chat_api_proxy"]["password"])
+        chatbots = yaml.safe_load(contents[join("chatbots",
+                                                "chatbots.yaml")])
+        self.assertEqual(chatbots["MQ"]["users"]["proctor"],
+                         mq_users["proctor"])
+
+        # Regenerating preserves passwords and hashes
+        spec["backend"]["domain"] = "updated.test"
+        apply_spec(spec, output_path, incremental=True)
+        self.assertEqual(self._read_tree(output_path)[rabbitmq],
+                         contents[rabbitmq])
+
+        spec["backend"]["rabbitmq"]["hashing_algorithm"] = "md5"
+        with self.assertRaises(ValueError):
+            apply_spec(spec, output_path, incremental=True)
+        shutil.rmtree(output_path)
+
+
+class TestFleet(unittest.TestCase):
+    def test_load_fleet(self):
+        from neon_diana_utils.fleet import load_fleet
+        fleet_file = join(dirname(__file__), "test_fleet.yaml")
+        with open(fleet_file, 'w') as f:
+            yaml.safe_dump({"defaults": {"backend": {"domain": "diana.test",
+                                                     "image_tag": "dev"}},
+                            "tenants": {"one": {"backend": {"domain":
+                                                            "one.test"}},
+                                        "two": None}}, f)
+        tenants = load_fleet(fleet_file)
+        self.assertEqual(tenants["one"], {"backend": {"domain": "one.test",
+                                                      "image_tag": "dev"}})
+        self.assertEqual(tenants["two"], {"backend": {"domain": "diana.test",
+                                                      "image_tag": "dev"}})
+        with open(fleet_file, 'w') as f:
+            yaml.safe_dump({"defaults": {"backend": {"credentials": {
+                "master_key_file": "master.key"}}},
+                "tenants": {"one": None,
+                            "two": {"backend": {"credentials": {
+                                "context": "shared"}}}}}, f)
+        tenants = load_fleet(fleet_file)
+        self.assertEqual(tenants["one"]["backend"]["credentials"],
+                         {"master_key_file": "master.key", "context": "one"})
+        self.assertEqual(tenants["two"]["backend"]["credentials"]["context"],
+                         "shared")
+        with open(fleet_file, 'w') as f:
+            yaml.safe_dump({"defaults": {"backend": {"credentials": {
+                "context": "fleet"}}}, "tenants": {"one": None}}, f)
+        self.assertEqual(load_fleet(fleet_file)["one"]["backend"][
+            "credentials"]["context"], "fleet/one")
+        with open(fleet_file, 'w') as f:
+            yaml.safe_dump({"defaults": {}}, f)
+        with self.assertRaises(ValueError):
+            load_fleet(fleet_file)
+        for name in ("../escape", "/abs", "..", ".", "a/b", ""):
+            with open(fleet_file, 'w') as f:
+                yaml.safe_dump({"tenants": {name: None}}, f)
+            with self.assertRaises(ValueError):
+                load_fleet(fleet_file)
+        os.remove(fleet_file)
+
+    def test_generate_fleet(self):
+        from neon_diana_utils.fleet import generate_fleet, format_fleet_report
+        output_path = join(dirname(__file__), "fleet_output")
+        spec = {"backend": {"rabbitmq": {"username": "admin",
+                                         "password": "pass"}},
+                "neon_core": {}}
+        tenants = {"one": spec, "two": spec, "invalid": {"backend": {}}}
+        results = generate_fleet(tenants, output_path, 2)
+        self.assertEqual([r.name for r in results], list(tenants))
+        for result in results[:2]:
+            self.assertIsNone(result.error)
+            self.assertEqual(result.output_path, join(output_path,
+                                                      result.name))
+            self.assertTrue(isfile(join(result.output_path, "neon-core",
+                                        "neon.yaml")))
+        self.assertIn("ValueError", results[2].error)
+        with self.assertRaises(ValueError):
+            generate_fleet({"../escape": spec}, output_path, 1)
+
+        report = format_fleet_report(results, 1.0).splitlines()
+        self.assertEqual(len(report), len(tenants) + 2)
+        self.assertEqual(report[-1], "Generated 2/3 tenants in 1.00s")
+        shutil.rmtree(output_path)
+
+    def test_generate_fleet_shared_store(self):
+        from neon_diana_utils.fleet import generate_fleet, load_fleet
+        output_path = join(dirname(__file__), "fleet_output")
+        store_path = join(output_path, "secrets.json")
+        fleet_file = join(dirname(__file__), "test_fleet.yaml")
+        with open(fleet_file, 'w') as f:
+            yaml.safe_dump({"defaults": {"backend": {
+                "rabbitmq": {"username": "admin", "password": "pass"},
+                "credentials": {"store": "file", "store_path": store_path}}},
+                "tenants": {"one": None, "two": None, "three": None}}, f)
+        tenants = load_fleet(fleet_file)
+        os.remove(fleet_file)
+
+        def _passwords():
+            passwords = dict()
+            for tenant in tenants:
+                with open(join(output_path, tenant, "diana-backend",
+                               "rabbitmq.json")) as f:
+                    passwords[tenant] = {u['name']: u['password'] for u in
+                                         json.load(f)['users']}
+            return passwords
+
+        results = generate_fleet(tenants, output_path, 3)
+        self.assertFalse(any(result.error for result in results), results)
+        passwords = _passwords()
+        self.assertEqual(len({p["neon_api"] for p in passwords.values()}),
+                         len(tenants))
+
+        # Every tenant's secrets were stored without losing updates
+        with open(store_path) as f:
+            stored = json.load(f)
+        for tenant in tenants:
+            self.assertEqual(stored[f"{tenant}/rabbitmq/neon_api"],
+                             passwords[tenant]["neon_api"])
+        shutil.rmtree(join(output_path, "one"))
+        generate_fleet({"one": tenants["one"]}, output_path, 1)
+        self.assertEqual(_passwords()["one"], passwords["one"])
+        shutil.rmtree(output_path)
+
+    def test_template_cache_export(self):
+        from neon_diana_utils.configuration import export_template_cache, \
+            import_template_cache, load_template, _TEMPLATE_CACHE
+        cache = export_template_cache()
+        template = join(dirname(dirname(__file__)), "neon_diana_utils",
+                        "templates", "mq_user_mapping.yml")
+        self.assertIn(template, cache)
+        _TEMPLATE_CACHE.clear()
+        import_template_cache(cache)
+        self.assertEqual(set(_TEMPLATE_CACHE), set(cache))
+        self.assertEqual(load_template("mq_user_mapping.yml")['neon_core'],
+                         ['chat_api_proxy'])
+
+
+class TestMaterialize(unittest.TestCase):
+    def test_materialize_tree(self):
+        from neon_diana_utils.materialize import materialize_tree, LinkMode
+        src = join(dirname(dirname(__file__)), "neon_diana_utils", "docker",
+                   "backend")
+        output_path = join(dirname(__file__), "materialize_output")
+        for mode in LinkMode:
+            dst = join(output_path, mode.value)
+            self.assertEqual(materialize_tree(src, dst, mode,
+                                              exclude=("rabbitmq.conf",),
+                                              copy=(".env", "xdg")), dst)
+            self.assertFalse(isfile(join(dst, "rabbitmq.conf")))
+            self.assertTrue(isfile(join(dst, "xdg", "config", "neon",
+                                        ".keep")))
+            for file in ("docker-compose.yml", ".env"):
+                with open(join(src, file)) as s, open(join(dst, file)) as d:
+                    self.assertEqual(s.read(), d.read())
+            self.assertFalse(os.path.samefile(join(src, ".env"),
+                                              join(dst, ".env")))
+            self.assertEqual(os.path.samefile(join(src, "docker-compose.yml"),
+                                              join(dst, "docker-compose.yml")),
+                             mode == LinkMode.HARDLINK)
+        shutil.rmtree(output_path)
+
+    def test_write_config_hardlink(self):
+        from neon_diana_utils.configuration import write_neon_core_config
+        from neon_diana_utils.materialize import LinkMode
+        template_dir = join(dirname(dirname(__file__)), "neon_diana_utils",
+                            "templates", "neon")
+        with open(join(template_dir, "values.yaml")) as f:
+            values = f.read()
+        output_path = join(dirname(__file__), "hardlink_output")
+        write_neon_core_config(output_path, "user", "pass",
+                               link_mode=LinkMode.HARDLINK)
+        self.assertTrue(os.path.samefile(
+            join(template_dir, "Chart.yaml"),
+            join(output_path, "neon-core", "Chart.yaml")))
+        # Written files are never linked to templates
+        self.assertFalse(os.path.samefile(
+            join(template_dir, "values.yaml"),
+            join(output_path, "neon-core", "values.yaml")))
+        with open(join(template_dir, "values.yaml")) as f:
+            self.assertEqual(f.read(), values)
+        shutil.rmtree(output_path)
+
+
+class TestAtomic(unittest.TestCase):
+    def test_atomic_write(self):
+        from neon_diana_utils.atomic import atomic_write, Durability
+        output_path = join(dirname(__file__), "atomic_output")
+        os.makedirs(output_path)
+        test_file = join(output_path, "test.yaml")
+        with atomic_write(test_file) as f:
+            f.write("original")
+        os.chmod(test_file, 0o600)
+
+        # Failed writes leave the original file in place
+        with self.assertRaises(RuntimeError):
+            with atomic_write(test_file, durability=Durability.NONE) as f:
+                f.write("partial")
+                raise RuntimeError("Interrupted")
+        self.assertEqual(os.listdir(output_path), ["test.yaml"])
+        with open(test_file) as f:
+            self.assertEqual(f.read(), "original")
+
+        # Permissions are preserved
+        with atomic_write(test_file, 'wb') as f:
+            f.write(b"updated")
+        with open(test_file) as f:
+            self.assertEqual(f.read(), "updated")
+        self.assertEqual(os.stat(test_file).st_mode & 0o777, 0o600)
+        with self.assertRaises(ValueError):
+            with atomic_write(test_file, 'a'):
+                pass
+        shutil.rmtree(output_path)
+
+    def test_atomic_batch(self):
+        from neon_diana_utils.atomic import AtomicBatch, Durability, \
+            atomic_write, default_durability, get_durability
+        output_path = join(dirname(__file__), "atomic_output")
+        os.makedirs(output_path)
+        files = [join(output_path, f"{i}.yaml") for i in range(3)]
+
+        with default_durability(Durability.DEFERRED):
+            self.assertEqual(get_durability(), Durability.DEFERRED)
+            with AtomicBatch() as batch:
+                self.assertEqual(batch.durability, Durability.DEFERRED)
+                for file in files:
+                    with atomic_write(file) as f:
+                        f.write(file)
+                # Nothing is replaced until the batch is committed
+                self.assertFalse(any(isfile(file) for file in files))
+        self.assertEqual(get_durability(), Durability.FILE)
+        for file in files:
+            with open(file) as f:
+                self.assertEqual(f.read(), file)
+
+        # A failed batch does not replace any files
+        with self.assertRaises(RuntimeError):
+            with AtomicBatch() as batch:
+                for file in files:
+                    with batch.open(file) as f:
+                        f.write("modified")
+                raise RuntimeError("Interrupted")
+        self.assertEqual(sorted(os.listdir(output_path)),
+                         ["0.yaml", "1.yaml", "2.yaml"])
+        for file in files:
+            with open(file) as f:
+                self.assertEqual(f.read(), file)
+        shutil.rmtree(output_path)
+
+
+    @patch("neon_diana_utils.atomic._fsync_path")
+    def test_sync_paths(self, fsync_path):
+        from neon_diana_utils.atomic import sync_paths
+        output_path = join(dirname(__file__), "atomic_output")
+        os.makedirs(join(output_path, "tenant", "sub"))
+        files = [join(output_path, "tenant", "a.yaml"),
+                 join(output_path, "tenant", "sub", "b.yaml"),
+                 join(output_path, "c.yaml")]
+        for file in files:
+            with open(file, 'w') as f:
+                f.write(file)
+        with patch("os.sync") as sync:
+            sync_paths([join(output_path, "tenant"), files[2]])
+            sync.assert_not_called()
+        synced = [call.args[0] for call in fsync_path.call_args_list]
+        self.assertEqual(len(synced), len(set(synced)))
+        self.assertEqual(set(synced), {*files, output_path,
+                                       join(output_path, "tenant"),
+                                       join(output_path, "tenant", "sub")})
+        shutil.rmtree(output_path)
+
+
+class TestHelmRender(unittest.TestCase):
+    def test_go_template(self):
+        from neon_diana_utils.go_template import Template, SPRIG_FUNCTIONS, \
+            TemplateError
+        template = Template(SPRIG_FUNCTIONS)
+        source = ('{{- define "greeting" }}hi {{ . }}{{ end -}}\n'
+                  '{{/* {{ ignored }} */}}'
+                  '{{- range $k, $v := .items }}'
+                  '{{ $k }}={{ $v | quote }};{{ end }}\n'
+                  '{{ if .missing }}a{{ else if not .flag }}b{{ else }}c'
+                  '{{ end }}\n'
+                  '{{- $name := .name | default "anon" | upper }}\n'
+                  '{{ template "greeting" $name }} {{ "abcdef" | trunc 3 }} '
+                  '{{ .flag | b64enc }} '
+                  '{{ semverCompare ">=1.19-0" .version }} '
+                  '{{ $_ := set .items "c" 3 }}{{ len .items }} '
+                  '{{ "{{ literal }}" }}')
+        self.assertEqual(template.render(source, {"items": {"b": 2, "a": "x"},
+                                                  "flag": False,
+                                                  "name": None,
+                                                  "version": "v1.28.2"}),
+                         'a="x";b="2";\nb\n'
+                         'hi ANON abc ZmFsc2U= true 3 {{ literal }}')
+        with self.assertRaises(TemplateError):
+            template.render("{{ .a.b }}", {})
+        with self.assertRaises(TemplateError):
+            template.render("{{ if .a }}", {})
+
+    def test_render_chart(self):
+        from datetime import datetime, timezone
+        from neon_diana_utils.helm_render import render_chart, \
+            format_manifests, parse_set_values
+        chart_path = join(dirname(__file__), "helm_backend")
+        shutil.copytree(join(dirname(dirname(__file__)), "neon_diana_utils",
+                             "templates", "backend"), chart_path)
+        with open(join(chart_path, "diana.yaml"), 'w') as f:
+            f.write("test: true")
+        now = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        values = parse_set_values(
+            ["backend.domain=diana.test",
+             "backend.diana-http.tts-coqui.replicaCount=2"])
+        self.assertEqual(values["backend"]["diana-http"]["tts-coqui"],
+                         {"replicaCount": 2})
+        manifests = render_chart(chart_path, values, release_name="test",
+                                 now=now)
+        self.assertEqual(manifests, render_chart(chart_path, values,
+                                                 release_name="test",
+                                                 now=now))
+        documents = [d for d in yaml.safe_load_all(format_manifests(manifests))
+                     if d]
+        self.assertGreater(len(documents), 20)
+        secrets = {d["metadata"]["name"]: d for d in documents
+                   if d["kind"] == "Secret"}
+        self.assertEqual(secrets["diana-config"]["data"]["diana.yaml"],
+                         "dGVzdDogdHJ1ZQ==")
+        deployments = [d for d in documents if d["kind"] == "Deployment"]
+        for deployment in deployments:
+            annotations = deployment["spec"]["template"]["metadata"].get(
+                "annotations") or dict()
+            if "releaseTime" in annotations:
+                self.assertEqual(annotations["releaseTime"],
+                                 "2024-01-02 03:04:05Z")
+        shutil.rmtree(chart_path)
+
+    def test_render_autoscaling(self):
+        from neon_diana_utils.helm_render import render_chart
+        chart_path = join(dirname(dirname(__file__)), "neon_diana_utils",
+                          "helm_charts", "backend", "mq-services")
+        manifests = render_chart(chart_path, {
+            "neon-llm-chatgpt": {"autoscaling": {"enabled": True,
+                                                 "maxReplicas": 8}},
+            "neon-api-proxy": {"autoscaling": {"enabled": True}},
+            "neon-llm-claude": {"replicaCount": 0,
+                                "autoscaling": {"enabled": True}}})
+        charts = "diana-mq/charts"
+
+        def _load(chart, template):
+            return yaml.safe_load(manifests.get(
+                f"{charts}/{chart}/templates/{template}.yaml", "") or "{}")
+
+        scaled = _load("neon-llm-chatgpt", "autoscaling")
+        self.assertEqual(scaled["kind"], "ScaledObject")
+        self.assertEqual(scaled["spec"]["maxReplicaCount"], 8)
+        trigger = scaled["spec"]["triggers"][0]["metadata"]
+        self.assertEqual((trigger["queueName"], trigger["vhostName"]),
+                         ("chat_gpt_input", "/llm"))
+        self.assertNotIn("replicas", _load("neon-llm-chatgpt",
+                                           "deployment")["spec"])
+        self.assertEqual(_load("neon-api-proxy", "autoscaling")["kind"],
+                         "HorizontalPodAutoscaler")
+        # Disabled services are not scaled up
+        self.assertEqual(_load("neon-llm-claude", "autoscaling"), {})
+        self.assertEqual(_load("neon-llm-claude", "deployment")["spec"][
+            "replicas"], 0)
+        self.assertEqual(_load("neon-email-proxy", "autoscaling"), {})
+        self.assertEqual(_load("neon-email-proxy", "deployment")["spec"][
+            "replicas"], 1)
+
+        chart_path = join(dirname(chart_path), "http-services")
+        manifests = render_chart(chart_path, {
+            "tts-coqui": {"autoscaling": {"enabled": True,
+                                          "minReplicas": 2}}})
+        charts = "diana-http/charts"
+        scaled = _load("tts-coqui", "autoscaling")
+        self.assertEqual(scaled["kind"], "HorizontalPodAutoscaler")
+        self.assertEqual(scaled["spec"]["minReplicas"], 2)
+        self.assertNotIn("replicas", _load("tts-coqui",
+                                           "deployment")["spec"])
+        self.assertEqual(_load("libretranslate", "autoscaling"), {})
+        self.assertIn("replicas", _load("libretranslate",
+                                        "deployment")["spec"])
+
+    def test_package_chart(self):
+        import tarfile
+        from neon_diana_utils.chart_package import ChartStore, \
+            package_chart, vendor_dependencies
+        chart_dir = join(dirname(dirname(__file__)), "neon_diana_utils",
+                         "helm_charts")
+        output_path = join(dirname(__file__), "chart_output")
+        store = ChartStore(join(output_path, "cache"))
+        archive = package_chart(join(chart_dir, "backend", "mq-services"),
+                                join(output_path, "one"), store)
+        self.assertTrue(archive.endswith("diana-mq-0.0.18.tgz"))
+        # base-mq is packaged once and reused for each service
+        self.assertGreater(store.hits, 1)
+        with tarfile.open(archive) as f:
+            names = f.getnames()
+            self.assertIn("diana-mq/Chart.yaml", names)
+            self.assertIn("diana-mq/charts/neon-api-proxy-0.0.7.tgz", names)
+            self.assertEqual({m.mtime for m in f.getmembers()}, {0})
+
+        # Repackaging in a new store with the same contents is reproducible
+        new_store = ChartStore(join(output_path, "cache2"))
+        new_archive = package_chart(join(chart_dir, "backend", "mq-services"),
+                                    join(output_path, "two"), new_store)
+        with open(archive, 'rb') as a, open(new_archive, 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+        # Cached charts are reused
+        store = ChartStore(join(output_path, "cache"))
+        package_chart(join(chart_dir, "backend", "mq-services"),
+                      join(output_path, "one"), store)
+        self.assertEqual((store.hits, store.misses), (1, 0))
+
+        # Dependencies from this package's repository resolve locally
+        deployment = join(output_path, "klat")
+        shutil.copytree(join(dirname(chart_dir), "templates", "klat"),
+                        deployment)
+        vendored = vendor_dependencies(deployment, store)
+        self.assertEqual([basename(v) for v in vendored],
+                         ["klat-chat-0.0.8.tgz"])
+        shutil.rmtree(output_path)
+
+
+class TestChartGraph(unittest.TestCase):
+    @staticmethod
+    def _write_chart(path, name, version, dependencies=()):
+        os.makedirs(path, exist_ok=True)
+        with open(join(path, "Chart.yaml"), 'w') as f:
+            f.write(f"apiVersion: v2\nname: {name}\n# Chart version\n"
+                    f"version: {version}\nappVersion: \"1.0.0\"\n")
+            if dependencies:
+                f.write("dependencies:\n# - name: disabled\n")
+            for dep_name, dep_version, repository in dependencies:
+                f.write(f"  - name: {dep_name}\n"
+                        f"    version: {dep_version}\n"
+                        f"    repository: {repository}\n")
+
+    def test_bump_version(self):
+        from neon_diana_utils.chart_graph import bump_version
+        self.assertEqual(bump_version("0.1.25"), "0.1.26")
+        self.assertEqual(bump_version("0.1.25", "minor"), "0.2.0")
+        self.assertEqual(bump_version("1.2.3-a1", "major"), "2.0.0")
+        with self.assertRaises(ValueError):
+            bump_version("latest")
+
+    def test_sync_chart_versions(self):
+        from neon_diana_utils.chart_graph import ChartGraph
+        root = join(dirname(__file__), "chart_graph")
+        charts = join(root, "charts")
+        self._write_chart(join(charts, "base"), "base", "0.0.2")
+        self._write_chart(join(charts, "other"), "other", "0.0.1")
+        self._write_chart(join(charts, "service"), "service", "0.1.0",
+                          [("base", "0.0.1", "file://../base")])
+        self._write_chart(join(charts, "umbrella"), "umbrella", "1.0.0",
+                          [("service", "0.1.0", "file://../service"),
+                           ("rabbitmq", "11.13.0",
+                            "https://charts.bitnami.com/bitnami")])
+        repository = "https://neongeckocom.github.io/neon-diana-utils"
+        self._write_chart(join(root, "deploy"), "deploy", "1.0.0",
+                          [("umbrella", "1.0.0", repository)])
+        graph = ChartGraph.load(charts, [join(root, "deploy")])
+        order = [n.name for n in graph.topological_order()]
+        self.assertLess(order.index("base"), order.index("service"))
+        self.assertLess(order.index("service"), order.index("umbrella"))
+        self.assertLess(order.index("umbrella"), order.index("deploy"))
+
+        # Out of date pins are detected without writing
+        changes = graph.plan_sync()
+        self.assertEqual(list(changes), [join(charts, "service",
+                                              "Chart.yaml")])
+        self.assertIn("    version: 0.0.2\n", changes[join(
+            charts, "service", "Chart.yaml")])
+
+        # Bumps propagate to dependents in one pass
+        other_stat = os.stat(join(charts, "other", "Chart.yaml"))
+        changed = graph.sync(bump="patch", charts=["base"])
+        expected = {join(charts, c, "Chart.yaml")
+                    for c in ("base", "service", "umbrella")}
+        expected.add(join(root, "deploy", "Chart.yaml"))
+        self.assertEqual(set(changed), expected)
+        with open(join(charts, "umbrella", "Chart.yaml")) as f:
+            umbrella = yaml.safe_load(f)
+        self.assertEqual(umbrella["version"], "1.0.1")
+        self.assertEqual([d["version"] for d in umbrella["dependencies"]],
+                         ["0.1.1", "11.13.0"])
+        with open(join(root, "deploy", "Chart.yaml")) as f:
+            contents = f.read()
+        self.assertIn("# - name: disabled", contents)
+        deploy = yaml.safe_load(contents)
+        self.assertEqual(deploy["version"], "1.0.0")
+        self.assertEqual(deploy["dependencies"][0]["version"], "1.0.1")
+        self.assertEqual(other_stat,
+                         os.stat(join(charts, "other", "Chart.yaml")))
+
+        # appVersion is set for managed charts only
+        graph = ChartGraph.load(charts, [join(root, "deploy")])
+        changed = graph.sync("2.0.0a1")
+        self.assertEqual(len(changed), 4)
+        self.assertEqual(graph.plan_sync("2.0.0a1"), dict())
+        with open(join(root, "deploy", "Chart.yaml")) as f:
+            self.assertEqual(yaml.safe_load(f)["appVersion"], "1.0.0")
+
+        # Cycles are rejected
+        self._write_chart(join(charts, "base"), "base", "0.0.3",
+                          [("umbrella", "1.0.1", "file://../umbrella")])
+        with self.assertRaises(ValueError):
+            ChartGraph.load(charts, []).topological_order()
+        shutil.rmtree(root)
+
+
+class TestSizing(unittest.TestCase):
+    def test_quantities(self):
+        from neon_diana_utils.sizing import parse_cpu, parse_memory, \
+            format_cpu, format_memory
+        self.assertEqual(parse_cpu("0.01"), 0.01)
+        self.assertEqual(parse_cpu("250m"), 0.25)
+        self.assertEqual(parse_memory("600Mi"), 600)
+        self.assertEqual(parse_memory("4Gi"), 4096)
+        self.assertEqual(format_cpu(0.0125), "13m")
+        self.assertEqual(format_memory(4096), "4Gi")
+        self.assertEqual(format_memory(1536.2), "1537Mi")
+        with self.assertRaises(ValueError):
+            parse_cpu("lots")
+
+    def test_size_backend(self):
+        from neon_diana_utils.sizing import LoadProfile, size_backend, \
+            apply_sizing
+        sizing = size_backend({"neon-llm-chatgpt": LoadProfile(10, 200),
+                               "endpoint-hana": {"requests_per_second": 1}},
+                              headroom=0.25, autoscale=True)
+        chatgpt = sizing["diana-mq"]["neon-llm-chatgpt"]
+        # 200 sessions * 1.25 / 25 sessions per replica
+        self.assertEqual(chatgpt["replicaCount"], 10)
+        self.assertEqual(chatgpt["resources"]["requests"],
+                         {"cpu": "60m", "memory": "680Mi"})
+        self.assertEqual(chatgpt["resources"]["limits"],
+                         {"cpu": "120m", "memory": "1020Mi"})
+        self.assertEqual(chatgpt["autoscaling"]["minReplicas"], 10)
+        self.assertEqual(chatgpt["autoscaling"]["maxReplicas"], 30)
+        self.assertEqual(sizing["diana-http"]["endpoint-hana"]["replicaCount"],
+                         1)
+        with self.assertRaises(ValueError):
+            size_backend({"invalid-service": LoadProfile(1)})
+        with self.assertRaises(ValueError):
+            size_backend({"neon-api-proxy": {"rps": 1}})
+
+        values = {"diana-mq": {"neon-llm-chatgpt": {"replicaCount": 0}},
+                  "diana-http": {"endpoint-hana": {"image": {"tag": "dev"}}}}
+        apply_sizing(values, sizing)
+        self.assertEqual(values["diana-mq"]["neon-llm-chatgpt"],
+                         {"replicaCount": 0})
+        self.assertEqual(values["diana-http"]["endpoint-hana"]["image"],
+                         {"tag": "dev"})
+        self.assertEqual(values["diana-http"]["endpoint-hana"]["resources"],
+                         sizing["diana-http"]["endpoint-hana"]["resources"])
+
+    def test_apply_spec_sizing(self):
+        from neon_diana_utils.spec import apply_spec
+        output_path = join(dirname(__file__), "sizing_output")
+        spec = {"backend": {"rabbitmq": {"username": "admin",
+                                         "password": "pass"},
+                            "keys": {"claude": {"api_key": "key"}},
+                            "sizing": {"services": {"neon-llm-claude": {
+                                "requests_per_second": 5}}}}}
+        apply_spec(spec, output_path)
+        with open(join(output_path, "diana-backend", "values.yaml")) as f:
+            values = yaml.safe_load(f)["backend"]
+        mq_values = values["diana-mq"]
+        self.assertEqual(mq_values["neon-llm-claude"]["replicaCount"], 4)
+        self.assertNotIn("autoscaling", mq_values["neon-llm-claude"])
+        self.assertNotIn("resources", mq_values["neon-llm-chatgpt"])
+        self.assertNotIn("kedaRabbitMQHost", values)
+        shutil.rmtree(output_path)
+
+        spec["backend"]["autoscaling"] = {"neon-llm-claude": {
+            "max_replicas": 10, "target_queue_length": 2}}
+        apply_spec(spec, output_path)
+        with open(join(output_path, "diana-backend", "values.yaml")) as f:
+            values = yaml.safe_load(f)["backend"]
+        self.assertEqual(values["diana-mq"]["neon-llm-claude"]["autoscaling"],
+                         {"enabled": True, "minReplicas": 1,
+                          "maxReplicas": 10, "targetQueueLength": 2})
+        # KEDA authenticates as a monitoring user without resource access
+        with open(join(output_path, "diana-backend", "rabbitmq.json")) as f:
+            rmq_config = json.load(f)
+        keda_user = [user for user in rmq_config["users"]
+                     if user["name"] == "neon_keda"]
+        self.assertEqual(len(keda_user), 1)
+        self.assertEqual(keda_user[0]["tags"], ["monitoring"])
+        self.assertEqual(values["kedaRabbitMQHost"],
+                         f"http://neon_keda:{keda_user[0]['password']}"
+                         f"@neon-rabbitmq:15672/")
+        self.assertNotIn("admin", values["kedaRabbitMQHost"])
+        keda_permissions = [p for p in rmq_config["permissions"]
+                            if p["user"] == "neon_keda"]
+        self.assertEqual({p["vhost"] for p in keda_permissions},
+                         {v["name"] for v in rmq_config["vhosts"]})
+        for permission in keda_permissions:
+            self.assertEqual((permission["configure"], permission["write"],
+                              permission["read"]), ("^$", "^$", "^$"))
+        shutil.rmtree(output_path)
+
+        # The hashed KEDA password is recovered when regenerating
+        spec["backend"]["rabbitmq"]["hashing_algorithm"] = \
+            "rabbit_password_hashing_sha256"
+        apply_spec(spec, output_path, incremental=True)
+        contents = TestSpec._read_tree(output_path)
+        spec["backend"]["domain"] = "updated.test"
+        apply_spec(spec, output_path, incremental=True)
+        updated = TestSpec._read_tree(output_path)
+        rabbitmq = join("diana-backend", "rabbitmq.json")
+        self.assertEqual(updated[rabbitmq], contents[rabbitmq])
+        values = yaml.safe_load(updated[join("diana-backend", "values.yaml")])
+        self.assertEqual(values["backend"]["kedaRabbitMQHost"], yaml.safe_load(
+            contents[join("diana-backend", "values.yaml")])["backend"][
+            "kedaRabbitMQHost"])
+        shutil.rmtree(output_path)
+
+        spec["backend"]["autoscaling"] = {"endpoint-hana": {}}
+        with self.assertRaises(ValueError):
+            apply_spec(spec, output_path)
+        spec["backend"]["autoscaling"] = {"neon-llm-claude": {"max": 2}}
+        with self.assertRaises(ValueError):
+            apply_spec(spec, output_path)
+
+
+class TestMQBench(unittest.TestCase):
+    def test_local_benchmark(self):
+        from neon_diana_utils.configuration import generate_rmq_config
+        from neon_diana_utils.mq_bench import LocalBroker, percentile, \
+            bench_definitions, plan_targets, run_benchmark, \
+            cleanup_definitions, report_to_dict, compare_reports
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 99), 4)
+        self.assertEqual(percentile([], 95), 0.0)
+
+        definitions = bench_definitions(generate_rmq_config("admin", "pass"))
+        self.assertNotIn("bench_admin",
+                         [u['name'] for u in definitions['users']])
+        self.assertTrue(all(p['vhost'].startswith("/bench_")
+                            for p in definitions['permissions']))
+        targets = plan_targets(definitions, ["neon_llm_chatgpt",
+                                             "neon_metrics"])
+        self.assertEqual([(t.user, t.vhost) for t in targets],
+                         [("bench_neon_llm_chatgpt", "/bench_llm"),
+                          ("bench_neon_metrics", "/bench_neon_metrics")])
+        # Queues are named within the user's permissions
+        self.assertTrue(targets[0].request_queue.startswith("chat_gpt_"))
+
+        broker = LocalBroker()
+        broker.import_definitions(definitions)
+        with self.assertRaises(PermissionError):
+            broker.connect("/bench_llm", "bench_neon_llm_chatgpt", "wrong")
+        channel = broker.connect(targets[0].vhost, targets[0].user,
+                                 targets[0].password)
+        with self.assertRaises(PermissionError):
+            channel.declare_queue("claude_input")
+
+        results = run_benchmark(broker, targets, messages=50, in_flight=4,
+                                concurrency=2)
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertEqual((result.messages, result.errors), (50, 0))
+            self.assertLessEqual(result.p50, result.p99)
+            self.assertGreater(result.rate, 0)
+
+        # Permission failures are reported per target
+        denied = targets[0]._replace(queue_prefix="claude_")
+        result = run_benchmark(broker, [denied], messages=5)[0]
+        self.assertEqual(result.errors, 5)
+        self.assertIn("cannot configure", result.error)
+
+        cleanup_definitions(broker, definitions)
+        self.assertEqual((broker.users, broker.vhosts), (dict(), dict()))
+
+        baseline = report_to_dict(results)
+        self.assertEqual(compare_reports(baseline, baseline), [])
+        slower = report_to_dict([r._replace(p95=r.p95 * 2 + 1,
+                                            elapsed=r.elapsed * 2)
+                                 for r in results])
+        self.assertEqual(len(compare_reports(baseline, slower)), 4)
+
+
+class TestCredentials(unittest.TestCase):
+    def test_hkdf_sha256(self):
+        from neon_diana_utils.credentials import hkdf_sha256
+        # RFC 5869 test case 1
+        okm = hkdf_sha256(bytes.fromhex("0b" * 22),
+                          bytes.fromhex("f0f1f2f3f4f5f6f7f8f9"), 42,
+                          bytes.fromhex("000102030405060708090a0b0c"))
+        self.assertEqual(okm.hex(),
+                         "3cb25f25faacd57a90434f64d0362f2a"
+                         "2d2d0a90cf1a5a4c5db02d56ecc4c5bf"
+                         "34007208d5b887185865")
+        with self.assertRaises(ValueError):
+            hkdf_sha256(b"key", b"", 0)
+
+    def test_secret_generator(self):
+        from neon_diana_utils.credentials import SecretGenerator, \
+            DerivedSecretGenerator
+        generator = SecretGenerator(64)
+        names = [f"rabbitmq/user_{i}" for i in range(10)]
+        secrets = generator.generate(names)
+        self.assertEqual(list(secrets), names)
+        self.assertEqual(len(set(secrets.values())), len(names))
+        self.assertTrue(all(len(s) == 43 for s in secrets.values()))
+        hex_secrets = generator.generate(["a", "b"], 16, "hex")
+        self.assertTrue(all(len(s) == 32 for s in hex_secrets.values()))
+        with self.assertRaises(ValueError):
+            generator.generate(["a"], encoding="base32")
+
+        key = bytes(range(32))
+        derived = DerivedSecretGenerator(key, "tenant_one").generate(names)
+        self.assertEqual(
+            DerivedSecretGenerator(key, "tenant_one").generate(names),
+            derived)
+        other = DerivedSecretGenerator(key, "tenant_two").generate(names)
+        self.assertFalse(set(derived.values()) & set(other.values()))
+        with self.assertRaises(ValueError):
+            DerivedSecretGenerator(b"short")
+
+    def test_file_secret_store(self):
+        from neon_diana_utils.credentials import CredentialService, \
+            FileSecretStore
+        from neon_diana_utils.credentials import SecretStore
+
+        class IncompleteStore(SecretStore):
+            def get_many(self, names):
+                return dict()
+
+        with self.assertRaises(TypeError):
+            IncompleteStore()
+        store_path = join(dirname(__file__), "credentials_output",
+                          "secrets.json")
+        service = CredentialService(store=FileSecretStore(store_path))
+        created = service.get_or_create(["one", "two"])
+        self.assertEqual(os.stat(store_path).st_mode & 0o777, 0o600)
+
+        # Stored secrets are not regenerated
+        service = CredentialService(store=FileSecretStore(store_path))
+        secrets = service.get_or_create(["one", "two", "three"])
+        self.assertEqual(secrets["one"], created["one"])
+        self.assertEqual(secrets["two"], created["two"])
+        self.assertEqual(sorted(service.store.names()),
+                         ["one", "three", "two"])
+
+        # Services with a context share a store without sharing secrets
+        tenant = CredentialService(store=FileSecretStore(store_path),
+                                   context="tenant")
+        self.assertNotEqual(tenant.get_or_create(["one"])["one"],
+                            created["one"])
+        self.assertIn("tenant/one", tenant.store.names())
+        shutil.rmtree(dirname(store_path))
+
+    def test_sqlite_secret_store(self):
+        try:
+            import cryptography
+        except ImportError:
+            self.skipTest("cryptography is not installed")
+        from neon_diana_utils.credentials import CredentialService, \
+            SQLiteSecretStore
+        store_path = join(dirname(__file__), "credentials_output",
+                          "secrets.db")
+        key = bytes(range(32))
+        store = SQLiteSecretStore(store_path, key)
+        names = [f"rabbitmq/user_{i}" for i in range(1200)]
+        created = CredentialService(store=store).get_or_create(names)
+        self.assertEqual(store.get_many(names), created)
+        store.close()
+        with open(store_path, 'rb') as f:
+            self.assertNotIn(created[names[0]].encode(), f.read())
+
+        store = SQLiteSecretStore(store_path, bytes(32))
+        with self.assertRaises(ValueError):
+            store.get_many(names[:1])
+        store.close()
+        shutil.rmtree(dirname(store_path))
+
+    def test_apply_spec_credentials(self):
+        from neon_diana_utils.spec import apply_spec
+        output_root = join(dirname(__file__), "credentials_output")
+        key_file = join(output_root, "master.key")
+        spec = {"backend": {"rabbitmq": {"username": "admin",
+                                         "password": "pass"},
+                            "credentials": {"master_key_file": key_file,
+                                            "create_master_key": True,
+                                            "context": "tenant"}}}
+        rabbitmq = join("diana-backend", "rabbitmq.json")
+        apply_spec(spec, join(output_root, "one"))
+        apply_spec(spec, join(output_root, "two"))
+        self.assertEqual(os.stat(key_file).st_mode & 0o777, 0o600)
+        one = TestSpec._read_tree(join(output_root, "one"))
+        two = TestSpec._read_tree(join(output_root, "two"))
+        self.assertEqual(one[rabbitmq], two[rabbitmq])
+        self.assertEqual(one[join("diana-backend", "diana.yaml")],
+                         two[join("diana-backend", "diana.yaml")])
+
+        spec["backend"]["credentials"]["context"] = "other"
+        apply_spec(spec, join(output_root, "three"))
+        three = TestSpec._read_tree(join(output_root, "three"))
+        self.assertNotEqual(one[rabbitmq], three[rabbitmq])
+
+        spec["backend"]["credentials"]["invalid"] = True
+        with self.assertRaises(ValueError):
+            apply_spec(spec, join(output_root, "four"))
+        shutil.rmtree(output_root)
+
+
+class TestImports(unittest.TestCase):
+    def test_lazy_imports(self):
+        import subprocess
+        import sys
+        check = "import sys; import neon_diana_utils.{}; " \
+                "print(sorted(m for m in ('click.core', 'yaml.loader', " \
+                "'ovos_utils', 'requests') if m in sys.modules))"
+        for module in ("configuration", "kubernetes_utils",
+                       "rabbitmq_definitions"):
+            output = subprocess.check_output([sys.executable, "-c",
+                                              check.format(module)])
+            self.assertEqual(output.decode().strip(), "[]", module)
+
+    def test_lazy_import(self):
+        import sys
+        from neon_diana_utils.imports import lazy_import, LazyAttribute
+        self.assertIs(lazy_import("json"), json)
+        module = lazy_import("xml.dom.minidom")
+        self.assertIs(sys.modules["xml.dom.minidom"], module)
+        self.assertTrue(callable(module.parseString))
+        with self.assertRaises(ModuleNotFoundError):
+            lazy_import("not_a_real_module")
+
+        dumps = LazyAttribute("json", "dumps")
+        self.assertEqual(dumps({"a": 1}), '{"a": 1}')
+        self.assertIs(dumps.target, json.dumps)
+
+    def test_profile_imports(self):
+        from neon_diana_utils.imports import profile_imports, \
+            summarize_import_profile
+        results = profile_imports(["neon_diana_utils.cli"])
+        names = [r[0] for r in results]
+        self.assertIn("neon_diana_utils.cli", names)
+        self.assertIn("click", names)
+        for _, self_us, cumulative_us in results:
+            self.assertLessEqual(self_us, cumulative_us)
+        summary = summarize_import_profile(results, 3)
+        self.assertEqual(len(summary.splitlines()), 5)
+        self.assertTrue(summary.splitlines()[-1].startswith(
+            f"Total: {len(results)} modules"))
+        with self.assertRaises(RuntimeError):
+            profile_imports(["not_a_real_module"])
+
+
 class TestKubernetesUtils(unittest.TestCase):
     def test_generate_github_secret(self):
         from neon_diana_utils.kubernetes_utils import create_github_secret
@@ -338,7 +1528,638 @@ class TestKubernetesUtils(unittest.TestCase):
 
 class TestRabbitMQAPI(unittest.TestCase):
     from neon_diana_utils.rabbitmq_api import RabbitMQAPI
-    # TODO
+
+    @patch("requests.Session.request")
+    def test_session(self, request):
+        from requests import Session
+        request.return_value.ok = True
+        api = self.RabbitMQAPI("http://localhost:15672", timeout=5)
+        api.login("admin", "password")
+        session = api.session
+        self.assertIsInstance(session, Session)
+        self.assertEqual(session.auth.username, "admin")
+        adapter = session.get_adapter("http://localhost:15672")
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertEqual(adapter.max_retries.total, 3)
+
+        # Session is reused across calls
+        self.assertTrue(api.add_vhost("/test"))
+        self.assertTrue(api.add_user("test", "test"))
+        self.assertTrue(api.configure_vhost_user_permissions("/test", "test"))
+        self.assertTrue(api.delete_user("test"))
+        self.assertIs(api.session, session)
+        self.assertEqual(request.call_count, 4)
+        request.assert_called_with(
+            "DELETE", "http://localhost:15672/api/users/test", timeout=5)
+        request.assert_any_call(
+            "PUT", "http://localhost:15672/api/vhosts/%2Ftest", timeout=5)
+
+        # Auth changes are applied to an existing session
+        api.login("new_admin", "password")
+        self.assertEqual(session.auth.username, "new_admin")
+
+        # Context manager closes the session
+        with api:
+            pass
+        self.assertIsNone(api._session)
+        self.assertIsNot(api.session, session)
+        api.close()
+
+    @patch("requests.Session.request")
+    def test_import_definitions(self, request):
+        from neon_diana_utils.configuration import generate_rmq_config
+        request.return_value.ok = True
+        definitions = generate_rmq_config("admin", "password")
+        api = self.RabbitMQAPI("http://localhost:15672")
+
+        # Single request
+        report = api.import_definitions(definitions)
+        request.assert_called_once()
+        method, url = request.call_args.args
+        self.assertEqual((method, url),
+                         ("POST", "http://localhost:15672/api/definitions"))
+        self.assertEqual(json.loads(request.call_args.kwargs['data']),
+                         definitions)
+        self.assertEqual(set(report), {"users", "vhosts", "permissions"})
+        self.assertEqual(set(report['users']),
+                         {u['name'] for u in definitions['users']})
+        self.assertEqual(set(report['permissions']),
+                         {(p['user'], p['vhost'])
+                          for p in definitions['permissions']})
+        self.assertTrue(all(report['vhosts'].values()))
+
+        # Batched requests in dependency order
+        request.reset_mock()
+        request.return_value.ok = False
+        report = api.import_definitions(definitions, batch_size=10)
+        sections = [list(json.loads(c.kwargs['data']))[0]
+                    for c in request.call_args_list]
+        self.assertEqual(sections, sorted(sections, key=["vhosts", "users",
+                                                         "permissions"].index))
+        for call in request.call_args_list:
+            section = json.loads(call.kwargs['data'])
+            self.assertLessEqual(len(list(section.values())[0]), 10)
+        self.assertFalse(any(report['users'].values()))
+        api.close()
+
+    @patch("requests.Session.request")
+    def test_create_default_users(self, request):
+        request.return_value.ok = True
+        api = self.RabbitMQAPI("http://localhost:15672")
+        credentials = api.create_default_users(["user_1", "user_2"])
+        self.assertEqual(set(credentials), {"user_1", "user_2"})
+        request.assert_called_once()
+        users = json.loads(request.call_args.kwargs['data'])['users']
+        self.assertEqual({u['name']: u['password'] for u in users},
+                         credentials)
+        api.close()
+
+    def test_stream_definitions(self):
+        import threading
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        test_file = join(dirname(__file__), "test_rabbitmq.json")
+        with open(test_file, 'rb') as f:
+            contents = f.read()
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(contents)))
+                self.end_headers()
+                self.wfile.write(contents)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), _Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        output_file = join(dirname(__file__), "test_definitions.json")
+        try:
+            with self.RabbitMQAPI(f"http://127.0.0.1:{server.server_port}") \
+                    as api:
+                api.login("admin", "password")
+                users = list(api.iter_definitions_section("users"))
+                self.assertEqual(users, json.loads(contents)['users'])
+                api.download_definitions(output_file)
+            with open(output_file, 'rb') as f:
+                self.assertEqual(f.read(), contents)
+        finally:
+            server.shutdown()
+            if isfile(output_file):
+                os.remove(output_file)
+
+    def test_metrics_collector(self):
+        import threading
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from urllib.parse import urlparse, parse_qs, unquote
+        from neon_diana_utils.rabbitmq_metrics import MetricsCollector
+        queues = [{"name": f"q{i}", "vhost": "/llm", "messages": i,
+                   "messages_ready": i, "messages_unacknowledged": 0,
+                   "consumers": 1, "durable": True,
+                   "message_stats": {"publish_details": {"rate": 1.0}}}
+                  for i in range(5)]
+        responses = {
+            "/api/overview": {"queue_totals": {"messages": 10},
+                              "object_totals": {"connections": 3},
+                              "rabbitmq_version": "3.12.0"},
+            "/api/nodes": [{"name": "rabbit@node", "running": True,
+                            "mem_used": 1024, "uptime": 1}],
+            "/api/consumers": [
+                {"queue": {"name": "q1", "vhost": "/llm"},
+                 "channel_details": {"user": "neon_llm_chatgpt"}},
+                {"queue": {"name": "q2", "vhost": "/other"},
+                 "channel_details": {"user": "neon_llm_chatgpt"}}],
+            "/api/connections": [{"user": "neon_llm_chatgpt",
+                                  "vhost": "/llm"},
+                                 {"user": "guest", "vhost": "/"}]}
+        requests = list()
+
+        def _filter(obj, columns):
+            if not columns:
+                return obj
+            filtered = dict()
+            for column in columns[0].split(','):
+                src, dst = obj, filtered
+                keys = column.split('.')
+                for key in keys[:-1]:
+                    src = src.get(key) or {}
+                    dst = dst.setdefault(key, dict())
+                if keys[-1] in src:
+                    dst[keys[-1]] = src[keys[-1]]
+            return filtered
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = unquote(url.path)
+                query = parse_qs(url.query)
+                requests.append((path, query))
+                if path == "/api/queues//llm":
+                    data = queues
+                else:
+                    data = responses.get(path, [])
+                if isinstance(data, list):
+                    data = [_filter(o, query.get('columns')) for o in data]
+                    if 'page' in query:
+                        page = int(query['page'][0])
+                        size = int(query['page_size'][0])
+                        data = {"items": data[(page - 1) * size:page * size],
+                                "page": page,
+                                "page_count": -(-len(data) // size)}
+                else:
+                    data = _filter(data, query.get('columns'))
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), _Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with self.RabbitMQAPI(f"http://127.0.0.1:{server.server_port}") \
+                    as api:
+                api.login("admin", "password")
+                collector = MetricsCollector(
+                    api, {"/llm": {"neon_llm_chatgpt", "neon_llm_claude"}},
+                    capacity=2, page_size=2)
+                snapshot = collector.poll(timestamp=1)
+                # Stopped consumers keep their queue backlog attributed
+                responses["/api/consumers"] = []
+                queues[1]["messages"] = 5
+                collector.poll(timestamp=2)
+                collector.poll(timestamp=3)
+        finally:
+            server.shutdown()
+
+        # Lists are paginated and all requests are column-filtered
+        queue_pages = [q['page'] for p, q in requests
+                       if p == "/api/queues//llm"]
+        self.assertEqual(queue_pages[:3], [['1'], ['2'], ['3']])
+        self.assertTrue(all('columns' in q for _, q in requests))
+        self.assertNotIn("rabbitmq_version", json.dumps(snapshot))
+
+        self.assertEqual(snapshot['overview']['messages'], 10)
+        self.assertEqual(snapshot['overview']['publish_rate'], 0)
+        self.assertEqual(snapshot['vhosts']['/llm']['messages'], 10)
+        self.assertEqual(snapshot['vhosts']['/llm']['publish_rate'], 5.0)
+        self.assertEqual(snapshot['vhosts']['/llm']['connections'], 1)
+        chatgpt = snapshot['services']['neon_llm_chatgpt']
+        self.assertEqual((chatgpt['messages'], chatgpt['consumers'],
+                          chatgpt['connections']), (1, 1, 1))
+        self.assertEqual(snapshot['services']['neon_llm_claude']['messages'],
+                         0)
+        self.assertEqual(snapshot['nodes']['rabbit@node']['mem_used'], 1024)
+
+        series = collector.series
+        self.assertEqual(len(series), 2)
+        self.assertEqual(series.timestamps(), [2, 3])
+        key = ("service", "neon_llm_chatgpt", "messages")
+        self.assertEqual(series.values(key), [(2, 5), (3, 5)])
+        self.assertEqual(series.values(key, since=3), [(3, 5)])
+        self.assertEqual(series.latest(("vhost", "/llm", "messages")), 14)
+        self.assertIsNone(series.latest(("vhost", "/neon_api", "messages")))
+
+
+class TestAsyncRabbitMQAPI(unittest.TestCase):
+    from neon_diana_utils.rabbitmq_api import AsyncRabbitMQAPI
+
+    def test_provision(self):
+        import asyncio
+        from aiohttp import web
+        from neon_diana_utils.configuration import generate_rmq_config
+        from neon_diana_utils.rabbitmq_definitions import hash_user_passwords
+        definitions = generate_rmq_config("admin", "password")
+        requests = list()
+        bodies = dict()
+        active = {"now": 0, "max": 0}
+
+        async def _handle(request):
+            active['now'] += 1
+            active['max'] = max(active['max'], active['now'])
+            requests.append((request.method, request.path,
+                             request.headers.get("Authorization")))
+            if request.can_read_body:
+                bodies[request.path] = await request.json()
+            await asyncio.sleep(0.01)
+            active['now'] -= 1
+            if request.path.startswith("/api/users/fail"):
+                return web.Response(status=400)
+            return web.Response(status=201)
+
+        async def _run():
+            app = web.Application()
+            app.router.add_route("*", "/{tail:.*}", _handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            try:
+                async with self.AsyncRabbitMQAPI(f"http://127.0.0.1:{port}",
+                                                 max_concurrency=4) as api:
+                    api.login("admin", "password")
+                    report = await api.provision(definitions)
+                    failed = await api.add_user("fail", "password")
+                    definitions_report = await api.import_definitions(
+                        definitions, batch_size=5)
+                    hashed_report = await api.provision(hashed)
+            finally:
+                await runner.cleanup()
+            return report, failed, definitions_report, hashed_report
+
+        hashed = hash_user_passwords({"users": definitions['users']},
+                                     "rabbit_password_hashing_sha512")
+        report, failed, definitions_report, hashed_report = \
+            asyncio.run(_run())
+
+        # Hashed users are created with their password hash
+        self.assertTrue(all(hashed_report['users'].values()))
+        for user in hashed['users']:
+            body = bodies[f"/api/users/{user['name']}"]
+            self.assertNotIn("password", body)
+            self.assertEqual(body["password_hash"], user["password_hash"])
+            self.assertEqual(body["hashing_algorithm"],
+                             "rabbit_password_hashing_sha512")
+        self.assertFalse(failed)
+        self.assertTrue(all(report['users'].values()))
+        self.assertEqual(set(report['users']),
+                         {u['name'] for u in definitions['users']})
+        self.assertEqual(len(report['permissions']),
+                         len(definitions['permissions']))
+        self.assertTrue(all(definitions_report['permissions'].values()))
+        self.assertLessEqual(active['max'], 4)
+        self.assertGreater(active['max'], 1)
+        self.assertTrue(all(r[2].startswith("Basic ") for r in requests))
+
+        # All vhosts and users are created before permissions
+        first_permission = [r[1] for r in requests].index(
+            next(r[1] for r in requests if r[1].startswith("/api/perm")))
+        self.assertFalse(any(r[1].startswith(("/api/users", "/api/vhosts"))
+                             for r in requests[first_permission:
+                                               len(definitions['permissions'])
+                                               + first_permission]))
+
+
+class TestRabbitMQDefinitions(unittest.TestCase):
+    @staticmethod
+    def _hash(password: str, salt: bytes = b"salt") -> str:
+        import hashlib
+        from base64 import b64encode
+        return b64encode(salt + hashlib.sha256(
+            salt + password.encode()).digest()).decode()
+
+    def test_check_password_hash(self):
+        from neon_diana_utils.rabbitmq_definitions import check_password_hash
+        password_hash = self._hash("password")
+        self.assertTrue(check_password_hash("password", password_hash))
+        self.assertFalse(check_password_hash("Password", password_hash))
+        self.assertFalse(check_password_hash("password", password_hash,
+                                             "rabbit_password_hashing_sha512"))
+        self.assertFalse(check_password_hash("password", None))
+
+    def test_hash_user_passwords(self):
+        from unittest.mock import Mock
+        from neon_diana_utils.rabbitmq_definitions import apply_plan, \
+            check_password_hash, hash_password, hash_user_passwords
+        password_hash = hash_password("password", salt=b"salt")
+        self.assertEqual(password_hash, self._hash("password", b"salt"))
+        self.assertTrue(check_password_hash(
+            "password", hash_password("password",
+                                      "rabbit_password_hashing_sha512"),
+            "rabbit_password_hashing_sha512"))
+        with self.assertRaises(ValueError):
+            hash_password("password", "rabbit_password_hashing_crc32")
+        with self.assertRaises(ValueError):
+            hash_password("password", salt=b"salt_too_long")
+
+        users = [{"name": f"user_{i}", "password": f"pass_{i}",
+                  "tags": []} for i in range(50)]
+        definitions = {"users": users, "vhosts": [{"name": "/a"}]}
+        hashed = hash_user_passwords(definitions)
+        self.assertEqual(hashed['vhosts'], definitions['vhosts'])
+        self.assertEqual(users[0]['password'], "pass_0")
+        for user, hashed_user in zip(users, hashed['users']):
+            self.assertNotIn("password", hashed_user)
+            self.assertEqual(hashed_user['hashing_algorithm'],
+                             "rabbit_password_hashing_sha256")
+            self.assertTrue(check_password_hash(user['password'],
+                                                hashed_user['password_hash']))
+        self.assertEqual(len({u['password_hash'][:6]
+                              for u in hashed['users']}), len(users))
+
+        # Existing hashes are reused for unchanged passwords
+        users[0] = {**users[0], "password": "changed"}
+        rehashed = hash_user_passwords(definitions,
+                                       existing=hashed['users'])
+        self.assertEqual(rehashed['users'][1:], hashed['users'][1:])
+        self.assertTrue(check_password_hash(
+            "changed", rehashed['users'][0]['password_hash']))
+
+        # Parallel hashing produces valid hashes
+        parallel = hash_user_passwords(definitions,
+                                       "rabbit_password_hashing_sha512",
+                                       max_workers=2, chunk_size=20)
+        for user, hashed_user in zip(users, parallel['users']):
+            self.assertTrue(check_password_hash(
+                user['password'], hashed_user['password_hash'],
+                "rabbit_password_hashing_sha512"))
+
+        # Hashed users are created with their hash
+        api = Mock()
+        apply_plan(api, {"users": {"create": hashed['users'][:1],
+                                   "update": [], "delete": []}})
+        api.add_user.assert_called_once_with(
+            "user_0", None, "",
+            password_hash=hashed['users'][0]['password_hash'],
+            hashing_algorithm="rabbit_password_hashing_sha256")
+
+    def test_diff_definitions(self):
+        from neon_diana_utils.rabbitmq_definitions import diff_definitions, \
+            format_plan, plan_is_empty
+        desired = {"vhosts": [{"name": "/a"}, {"name": "/b"}],
+                   "users": [{"name": "same", "password": "same",
+                              "tags": ["backend", "service"]},
+                             {"name": "new_pass", "password": "new",
+                              "tags": []},
+                             {"name": "new_tags", "password": "pass",
+                              "tags": ["backend"]},
+                             {"name": "new_user", "password": "pass",
+                              "tags": []}],
+                   "permissions": [{"user": "same", "vhost": "/a",
+                                    "configure": ".*", "write": ".*",
+                                    "read": ".*"},
+                                   {"user": "same", "vhost": "/b",
+                                    "configure": ".*", "write": ".*",
+                                    "read": "./"}]}
+        current = {"vhosts": [{"name": "/a"}, {"name": "/c"}],
+                   "users": [{"name": "same",
+                              "password_hash": self._hash("same"),
+                              "hashing_algorithm":
+                                  "rabbit_password_hashing_sha256",
+                              "tags": "service,backend"},
+                             {"name": "new_pass",
+                              "password_hash": self._hash("old"),
+                              "tags": ""},
+                             {"name": "new_tags",
+                              "password_hash": self._hash("pass"),
+                              "tags": ["user"]},
+                             {"name": "admin",
+                              "password_hash": self._hash("admin"),
+                              "tags": ["administrator"]}],
+                   "permissions": [{"user": "same", "vhost": "/a",
+                                    "configure": ".*", "write": ".*",
+                                    "read": ".*"},
+                                   {"user": "same", "vhost": "/b",
+                                    "configure": ".*", "write": ".*",
+                                    "read": ".*"}]}
+        plan = diff_definitions(desired, current)
+        self.assertEqual(plan['vhosts'], {"create": [{"name": "/b"}],
+                                          "update": [], "delete": []})
+        self.assertEqual([u['name'] for u in plan['users']['create']],
+                         ["new_user"])
+        self.assertEqual([u['name'] for u in plan['users']['update']],
+                         ["new_pass", "new_tags"])
+        self.assertEqual(plan['users']['delete'], [])
+        self.assertEqual(plan['permissions']['update'],
+                         [desired['permissions'][1]])
+        self.assertFalse(plan_is_empty(plan))
+
+        pruned = diff_definitions(desired, current, prune=True)
+        self.assertEqual(pruned['vhosts']['delete'], [{"name": "/c"}])
+        self.assertEqual([u['name'] for u in pruned['users']['delete']],
+                         ["admin"])
+        text = format_plan(pruned)
+        self.assertIn("+ users: new_user", text)
+        self.assertIn("~ permissions: same @ /b", text)
+        self.assertIn("- vhosts: /c", text)
+        self.assertTrue(text.endswith("Plan: 2 to create, 3 to update, "
+                                      "2 to delete"))
+
+        # No changes
+        self.assertTrue(plan_is_empty(diff_definitions(current, current)))
+
+    def test_reconcile_definitions(self):
+        from unittest.mock import Mock
+        from neon_diana_utils.rabbitmq_definitions import \
+            reconcile_definitions
+        api = Mock()
+        api.get_definitions.return_value = {
+            "vhosts": [{"name": "/a"}],
+            "users": [{"name": "user", "password_hash": self._hash("pass"),
+                       "tags": []}],
+            "permissions": []}
+        desired = {"vhosts": [{"name": "/a"}, {"name": "/b"}],
+                   "users": [{"name": "user", "password": "pass",
+                              "tags": []}],
+                   "permissions": [{"user": "user", "vhost": "/b",
+                                    "configure": ".*", "write": ".*",
+                                    "read": ".*"}]}
+        plan = reconcile_definitions(api, desired, dry_run=True)
+        self.assertEqual(plan['vhosts']['create'], [{"name": "/b"}])
+        api.add_vhost.assert_not_called()
+
+        reconcile_definitions(api, desired, prune=True)
+        api.add_vhost.assert_called_once_with("/b")
+        api.add_user.assert_not_called()
+        api.configure_vhost_user_permissions.assert_called_once_with(
+            "/b", "user", ".*", ".*", ".*")
+        api.delete_user.assert_not_called()
+        api.delete_vhost.assert_not_called()
+
+        # The authenticated user and administrators are not pruned
+        def _perm(user):
+            return {"user": user, "vhost": "/a", "configure": ".*",
+                    "write": ".*", "read": ".*"}
+
+        api = Mock()
+        api.username = "admin"
+        api.get_definitions.return_value = {
+            "vhosts": [{"name": "/a"}],
+            "users": [{"name": name, "password_hash": self._hash("pass"),
+                       "tags": tags} for name, tags in
+                      (("admin", []), ("operator", "administrator"),
+                       ("stale", []))],
+            "permissions": [_perm("admin"), _perm("operator"),
+                            _perm("stale")]}
+        desired = {"vhosts": [{"name": "/a"}]}
+        plan = reconcile_definitions(api, desired, dry_run=True, prune=True)
+        self.assertEqual([user['name'] for user in plan['users']['delete']],
+                         ["stale"])
+        self.assertEqual(plan['permissions']['delete'], [_perm("stale")])
+        plan = reconcile_definitions(api, desired, dry_run=True, prune=True,
+                                     prune_admins=True)
+        self.assertEqual([user['name'] for user in plan['users']['delete']],
+                         ["operator", "stale"])
+
+    def test_merge_definitions(self):
+        from neon_diana_utils.rabbitmq_definitions import merge_definitions, \
+            index_definitions
+
+        def _perm(user, vhost, read=".*"):
+            return {"user": user, "vhost": vhost, "configure": ".*",
+                    "write": ".*", "read": read}
+
+        current = {"rabbit_version": "3.11.0",
+                   "users": [{"name": "op_user", "password": "op"},
+                             {"name": "service", "password": "old"}],
+                   "vhosts": [{"name": "/op"}, {"name": "/service"}],
+                   "permissions": [_perm("op_user", "/op"),
+                                   _perm("service", "/service", "")],
+                   "queues": [{"name": "q", "vhost": "/op",
+                               "durable": True}]}
+        desired = {"users": [{"name": "service", "password": "new"},
+                             {"name": "new_service", "password": "new"}],
+                   "vhosts": [{"name": "/service"}, {"name": "/new"}],
+                   "permissions": [_perm("service", "/service"),
+                                   _perm("new_service", "/new")]}
+
+        # Two-way merge keeps operator additions and existing users
+        merged = merge_definitions(current, desired)
+        self.assertEqual(merged['rabbit_version'], "3.11.0")
+        self.assertEqual(merged['users'],
+                         current['users'] + [desired['users'][1]])
+        self.assertEqual(merged['vhosts'], [{"name": "/op"},
+                                            {"name": "/service"},
+                                            {"name": "/new"}])
+        self.assertEqual(merged['permissions'],
+                         [_perm("op_user", "/op"),
+                          _perm("service", "/service"),
+                          _perm("new_service", "/new")])
+        self.assertEqual(merged['queues'], current['queues'])
+        self.assertEqual(index_definitions(merged)['queues'],
+                         {("/op", "q"): current['queues'][0]})
+
+        # Three-way merge respects operator changes and upstream removals
+        base = {"users": [{"name": "service", "password": "old"},
+                          {"name": "removed", "password": "pass"},
+                          {"name": "op_removed", "password": "pass"}],
+                "vhosts": [{"name": "/service"}, {"name": "/removed"}],
+                "permissions": [_perm("service", "/service", "")]}
+        current['users'].append({"name": "removed", "password": "pass"})
+        current['vhosts'].append({"name": "/removed"})
+        desired['users'].append({"name": "op_removed", "password": "pass"})
+        merged = merge_definitions(current, desired, base)
+        self.assertEqual([u['name'] for u in merged['users']],
+                         ["op_user", "service", "new_service"])
+        self.assertEqual([v['name'] for v in merged['vhosts']],
+                         ["/op", "/service", "/new"])
+        self.assertEqual(merged['permissions'][1],
+                         _perm("service", "/service"))
+        current['permissions'][1]['read'] = "operator"
+        merged = merge_definitions(current, desired, base)
+        self.assertEqual(merged['permissions'][1]['read'], "operator")
+
+    def test_definitions_reader_writer(self):
+        from io import StringIO
+        from neon_diana_utils.rabbitmq_definitions import DefinitionsReader, \
+            DefinitionsWriter, iter_definitions_section
+        definitions = {"rabbit_version": "3.11.0",
+                       "limit": 12345,
+                       "users": [{"name": f"user_{i}", "password": "p",
+                                  "tags": ["backend", "service"]}
+                                 for i in range(50)],
+                       "vhosts": [],
+                       "global_parameters": [{"name": "cluster_name",
+                                              "value": "rabbit@test"}],
+                       "queues": [{"name": f"q{i}", "vhost": "/",
+                                   "arguments": {"x-max-length": i}}
+                                  for i in range(50)]}
+        serialized = json.dumps(definitions, indent=2)
+
+        # Writer output matches `json.dump`
+        output = StringIO()
+        with DefinitionsWriter(output) as writer:
+            for key, value in definitions.items():
+                if isinstance(value, list):
+                    writer.write_section(key, iter(value))
+                else:
+                    writer.write_value(key, value)
+        self.assertEqual(output.getvalue(), serialized)
+        output = StringIO()
+        with DefinitionsWriter(output):
+            pass
+        self.assertEqual(output.getvalue(), json.dumps({}, indent=2))
+
+        # Reader handles values split across chunks
+        for chunk_size in (1, 7, 64, 65536):
+            for text in (serialized, json.dumps(definitions)):
+                parsed = dict()
+                for key, value in DefinitionsReader(StringIO(text),
+                                                    chunk_size).sections():
+                    parsed[key] = list(value) \
+                        if not isinstance(value, (str, int, dict)) else value
+                self.assertEqual(parsed, definitions)
+
+        # Unconsumed sections are skipped
+        self.assertEqual(list(iter_definitions_section(StringIO(serialized),
+                                                       "queues")),
+                         definitions['queues'])
+        self.assertEqual(list(iter_definitions_section(StringIO(serialized),
+                                                       "missing")), [])
+        with self.assertRaises(ValueError):
+            list(iter_definitions_section(StringIO("[]"), "users"))
+
+    def test_stream_merge_definitions(self):
+        from io import StringIO
+        from neon_diana_utils.configuration import generate_rmq_config
+        from neon_diana_utils.rabbitmq_definitions import merge_definitions, \
+            stream_merge_definitions
+        with open(join(dirname(__file__), "test_rabbitmq.json")) as f:
+            current = json.load(f)
+        current['queues'] = [{"name": f"q{i}", "vhost": "/neon_chat_api",
+                              "durable": True} for i in range(100)]
+        desired = generate_rmq_config("", "")
+        output = StringIO()
+        stream_merge_definitions(StringIO(json.dumps(current)), output,
+                                 desired)
+        self.assertEqual(json.loads(output.getvalue()),
+                         merge_definitions(current, desired))
 
 
 if __name__ == '__main__':